@@ -1,56 +1,211 @@
+import itertools
 import time
-from collections import deque
 from heapq import heappush, heappop
 
+import numpy as np
+
 from pcfg import PCFG
+from compiled_pcfg import compile_pcfg
+from stack_machine import prefix_from_compressed
 
 
-def a_star(G: PCFG):
+def a_star(G: PCFG, stats=None, prefix=False):
     """
     A generator that enumerates all programs using A*.
     Assumes that the PCFG only generates programs of bounded depth.
+    G can be either a PCFG or a CompiledPCFG.
+    If G is in log mode probabilities are added in log-space.
+    stats: a SearchStats updated during the search, or None
+    prefix: if True the programs are output in prefix form, see stack_machine
+    """
+    return a_star_object(G, stats, prefix).generator()
+
+
+class a_star_object:
+    """
+    The state of A* is the frontier, so that it can be saved and resumed
     """
 
-    frontier = []
-    initial_non_terminals = deque()
-    initial_non_terminals.append(G.start)
-    heappush(
-        frontier,
-        (
-            -G.max_probability[G.start].probability[(G.__hash__(), G.start)],
-            (None, initial_non_terminals, 1),
-        ),
-    )
-    # A frontier is a heap of pairs (-max_probability, (partial_program, non_terminals, probability))
-    # describing a partial program:
-    # max_probability is the most likely program completing the partial program
-    # partial_program is the list of primitives and variables describing the leftmost derivation,
-    # non_terminals is the queue of non-terminals appearing from left to right, and
-    # probability is the probability of the partial program
-
-    while len(frontier) != 0:
-        max_probability, (partial_program, non_terminals, probability) = heappop(
-            frontier
+    def __init__(self, G: PCFG, stats=None, prefix=False):
+        self.G = compile_pcfg(G)
+        self.log_probability = self.G.log_probability
+        self.stats = stats
+        self.prefix = prefix
+
+        self.frontier = []
+        # the second element of the entries of the frontier, so that ties are broken
+        # by the order of the pushes instead of comparing the partial programs
+        self.counter = itertools.count()
+        if self.log_probability:
+            max_probability = self.G.max_log_probability[self.G.start]
+        else:
+            max_probability = self.G.max_probability[self.G.start]
+        heappush(
+            self.frontier,
+            (
+                -float(max_probability),
+                next(self.counter),
+                (None, (self.G.start, None), 0 if self.log_probability else 1),
+            ),
         )
-        if len(non_terminals) == 0:
-            yield partial_program
+        # A frontier is a heap of triples (-max_probability, k, (partial_program, non_terminals, probability))
+        # describing a partial program:
+        # max_probability is the most likely program completing the partial program
+        # partial_program is the list of primitives and variables (derivation ids in prefix form)
+        # describing the leftmost derivation,
+        # non_terminals is the stack of ids of the non-terminals appearing from left to right,
+        # as a cons list (S, rest) starting with the rightmost one, or None: siblings share their stacks, and
+        # probability is the probability (or log-probability) of the partial program
+        # and k is the number of the push
+
+    def generator(self):
+        """
+        A generator which outputs the next most probable program
+        """
+        G = self.G
+        rules, weight, arguments, _ = G.python_tables()
+        log_probability = self.log_probability
+        if log_probability:
+            max_probability = G.max_log_probability.tolist()
+        else:
+            max_probability = G.max_probability.tolist()
+        prefix = self.prefix
+        derivations = range(G.number_of_derivations()) if prefix else G.derivations
+        frontier = self.frontier
+        counter = self.counter
+        stats = self.stats
+        if stats is None:
+            push, pop = heappush, heappop
         else:
-            S = non_terminals.pop()
-            for P in G.rules[S]:
-                args_P, w = G.rules[S][P]
-                new_partial_program = (P, partial_program)
-                new_non_terminals = non_terminals.copy()
-                new_probability = probability * w
-                new_max_probability = new_probability
-                for arg in args_P:
-                    new_non_terminals.append(arg)
-                    new_max_probability *= G.max_probability[arg].probability[
-                        (G.__hash__(), arg)
-                    ]
-                heappush(
-                    frontier,
-                    (
-                        -new_max_probability,
-                        (new_partial_program, new_non_terminals, new_probability),
-                    ),
+            push, pop = stats.timed("heappush", heappush), stats.timed("heappop", heappop)
+            stats.gauge("frontier_size", lambda: len(frontier))
+
+        while len(frontier) != 0:
+            max_probability_partial, _, (partial_program, non_terminals, probability) = pop(frontier)
+            if non_terminals is None:
+                if stats is not None:
+                    stats.output()
+                yield prefix_from_compressed(partial_program) if prefix else partial_program
+            else:
+                S, non_terminals = non_terminals
+                for d in rules[S]:
+                    new_partial_program = (derivations[d], partial_program)
+                    new_non_terminals = non_terminals
+                    if log_probability:
+                        new_probability = probability + weight[d]
+                        new_max_probability = new_probability
+                        for arg in arguments[d]:
+                            new_non_terminals = (arg, new_non_terminals)
+                            new_max_probability += max_probability[arg]
+                    else:
+                        new_probability = probability * weight[d]
+                        new_max_probability = new_probability
+                        for arg in arguments[d]:
+                            new_non_terminals = (arg, new_non_terminals)
+                            new_max_probability *= max_probability[arg]
+                    push(
+                        frontier,
+                        (
+                            -new_max_probability,
+                            next(counter),
+                            (new_partial_program, new_non_terminals, new_probability),
+                        ),
+                    )
+
+    def save(self, path):
+        """
+        Saves the frontier to path, to be resumed with load_a_star
+
+        The file is a NumPy archive: a partial program is stored as the ids of its derivations
+        in the compiled PCFG and its non-terminals as their ids, from left to right.
+        The frontier is saved in its order with the numbers of the pushes,
+        so that ties are broken in the same way, along with the modes of the search
+        (prefix and log_probability) which give their meaning to the derivations and the priorities.
+        """
+        derivation_id = {P.id: d for d, P in enumerate(self.G.derivations)}
+        priority, order, probability = [], [], []
+        program_offsets, program_derivations = [0], []
+        non_terminal_offsets, non_terminals = [0], []
+        for max_probability, k, (partial_program, non_terminals_partial, p) in self.frontier:
+            priority.append(max_probability)
+            order.append(k)
+            probability.append(p)
+            while partial_program is not None:
+                P, partial_program = partial_program
+                program_derivations.append(P if self.prefix else derivation_id[P.id])
+            program_offsets.append(len(program_derivations))
+            stack = []
+            while non_terminals_partial is not None:
+                S, non_terminals_partial = non_terminals_partial
+                stack.append(S)
+            non_terminals.extend(reversed(stack))
+            non_terminal_offsets.append(len(non_terminals))
+
+        # the number of the next push, the counter goes on from it
+        next_push = next(self.counter)
+        self.counter = itertools.count(next_push)
+
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                lhs=self.G.lhs,
+                children=self.G.children,
+                prefix=np.array(self.prefix, dtype=np.bool_),
+                log_probability=np.array(self.log_probability, dtype=np.bool_),
+                priority=np.array(priority, dtype=np.float64),
+                order=np.array(order, dtype=np.int64),
+                next_push=np.array([next_push], dtype=np.int64),
+                probability=np.array(probability, dtype=np.float64),
+                program_offsets=np.array(program_offsets, dtype=np.int64),
+                program_derivations=np.array(program_derivations, dtype=np.int32),
+                non_terminal_offsets=np.array(non_terminal_offsets, dtype=np.int64),
+                non_terminals=np.array(non_terminals, dtype=np.int32),
+            )
+
+
+def load_a_star(path, G: PCFG, stats=None, prefix=None):
+    """
+    Returns the a_star_object saved to path by save,
+    G must be the PCFG of the saved search (possibly compiled), in the same mode
+    prefix: the form of the programs output, by default the one of the saved search,
+    it cannot be changed
+    """
+    A = a_star_object.__new__(a_star_object)
+    A.G = compile_pcfg(G)
+    A.log_probability = A.G.log_probability
+    A.stats = stats
+    A.frontier = []
+    with np.load(path) as data:
+        if not (
+            np.array_equal(data["lhs"], A.G.lhs)
+            and np.array_equal(data["children"], A.G.children)
+        ):
+            raise ValueError("{} was saved for another PCFG".format(path))
+        if bool(data["log_probability"]) != A.log_probability:
+            raise ValueError(
+                "{} was saved for a PCFG with log_probability={}".format(
+                    path, bool(data["log_probability"])
                 )
+            )
+        A.prefix = bool(data["prefix"])
+        if prefix is not None and prefix != A.prefix:
+            raise ValueError("{} was saved with prefix={}".format(path, A.prefix))
+        program_offsets = data["program_offsets"].tolist()
+        program_derivations = data["program_derivations"].tolist()
+        non_terminal_offsets = data["non_terminal_offsets"].tolist()
+        non_terminals = data["non_terminals"].tolist()
+        A.counter = itertools.count(int(data["next_push"][0]))
+        for k, (max_probability, order, probability) in enumerate(
+            zip(data["priority"].tolist(), data["order"].tolist(), data["probability"].tolist())
+        ):
+            partial_program = None
+            # the derivations are stored from the last one to the first one
+            for d in reversed(program_derivations[program_offsets[k] : program_offsets[k + 1]]):
+                partial_program = (d if A.prefix else A.G.derivations[d], partial_program)
+            non_terminals_partial = None
+            for S in non_terminals[non_terminal_offsets[k] : non_terminal_offsets[k + 1]]:
+                non_terminals_partial = (S, non_terminals_partial)
+            A.frontier.append(
+                (max_probability, order, (partial_program, non_terminals_partial, probability))
+            )
+    return A
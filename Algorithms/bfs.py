@@ -1,48 +1,68 @@
 from program import *
 from pcfg import *
+from compiled_pcfg import compile_pcfg
+from stack_machine import prefix_from_compressed
 
-from collections import deque 
+import itertools
 from heapq import heappush, heappop, heappushpop
 
-def bfs(G : PCFG, beam_width = 50000):
+def bfs(G : PCFG, beam_width = 50000, stats = None, prefix = False):
     '''
     A generator that enumerates all programs using a BFS.
     Assumes that the PCFG only generates programs of bounded depth.
+    G can be either a PCFG or a CompiledPCFG.
+    If G is in log mode probabilities are added in log-space.
+    stats: a SearchStats updated during the search, or None
+    prefix: if True the programs are output in prefix form, see stack_machine
     '''
-    # We reverse the rules: they should be non-decreasing
-    for S in G.rules:
-        sorted(G.rules[S], key=lambda x: G.rules[S][x][1])
+    G = compile_pcfg(G)
+    rules, weight, arguments, _ = G.python_tables()
+    log_probability = G.log_probability
+    # in prefix form partial programs are built from derivation ids
+    derivations = range(G.number_of_derivations()) if prefix else G.derivations
 
+    # ties are broken by the order of the pushes instead of comparing the partial programs
+    counter = itertools.count()
     frontier = []
-    initial_non_terminals = deque()
-    initial_non_terminals.append(G.start)
-    heappush(frontier, (1, (None, initial_non_terminals)))
-    # A frontier is a heap of pairs (probability, (partial_program, non_terminals)) 
+    heappush(frontier, (0 if log_probability else 1, next(counter), (None, (G.start, None))))
+    # A frontier is a heap of triples (probability, k, (partial_program, non_terminals)) 
     # describing a partial program:
     # partial_program is the list of primitives and variables describing the leftmost derivation, and
-    # non_terminals is the queue of non-terminals appearing from left to right
-    # probability is the probability
+    # non_terminals is the stack of ids of the non-terminals appearing from left to right,
+    # as a cons list (S, rest) starting with the rightmost one, or None: siblings share their stacks
+    # probability is the probability (or log-probability) and k is the number of the push
+    if stats is None:
+        push, pop, pushpop = heappush, heappop, heappushpop
+    else:
+        push = stats.timed("heappush", heappush)
+        pop = stats.timed("heappop", heappop)
+        pushpop = stats.timed("heappushpop", heappushpop)
+        stats.gauge("frontier_size", lambda: len(frontier) + len(new_frontier))
 
     while True:
         new_frontier = []
         while True:
             try:
-                probability, (partial_program, non_terminals) = heappop(frontier)
-                if len(non_terminals) == 0: 
-                    yield partial_program
+                probability, _, (partial_program, non_terminals) = pop(frontier)
+                if non_terminals is None:
+                    if stats is not None:
+                        stats.output()
+                    yield prefix_from_compressed(partial_program) if prefix else partial_program
                 else:
-                    S = non_terminals.pop()
-                    for P in G.rules[S]:
-                        args_P, w = G.rules[S][P]
-                        new_partial_program = (P, partial_program)
-                        new_non_terminals = non_terminals.copy()
-                        new_probability = probability * w
-                        for arg in args_P:
-                            new_non_terminals.append(arg)
+                    S, non_terminals = non_terminals
+                    for d in rules[S]:
+                        new_partial_program = (derivations[d], partial_program)
+                        new_non_terminals = non_terminals
+                        if log_probability:
+                            new_probability = probability + weight[d]
+                        else:
+                            new_probability = probability * weight[d]
+                        for arg in arguments[d]:
+                            new_non_terminals = (arg, new_non_terminals)
                         if len(new_frontier) <= beam_width:
-                            heappush(new_frontier, (new_probability, (new_partial_program, new_non_terminals)))
+                            push(new_frontier, (new_probability, next(counter), (new_partial_program, new_non_terminals)))
                         else:
-                            heappushpop(new_frontier, (new_probability, (new_partial_program, new_non_terminals)))
+                            pushpop(new_frontier, (new_probability, next(counter), (new_partial_program, new_non_terminals)))
             except IndexError:
                 frontier = new_frontier
                 break
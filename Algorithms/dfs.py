@@ -1,31 +1,46 @@
 from pcfg import PCFG
+from compiled_pcfg import compile_pcfg
+from stack_machine import prefix_from_compressed
 
 from collections import deque 
 import time 
 
-def dfs(G : PCFG):
+def dfs(G : PCFG, stats = None, prefix = False):
     '''
     A generator that enumerates all programs using a DFS.
     Assumes that the rules are non-increasing
+    G can be either a PCFG or a CompiledPCFG.
+    stats: a SearchStats updated during the search, or None
+    prefix: if True the programs are output in prefix form, see stack_machine
     '''
+    G = compile_pcfg(G)
+    rules, _, arguments, _ = G.python_tables()
+    # in prefix form partial programs are built from derivation ids
+    derivations = range(G.number_of_derivations()) if prefix else G.derivations
+
     frontier = deque()
-    initial_non_terminals = deque()
-    initial_non_terminals.append(G.start)
-    frontier.append((None, initial_non_terminals))
+    frontier.append((None, (G.start, None)))
+    if stats is None:
+        push, pop = frontier.append, frontier.pop
+    else:
+        push, pop = stats.timed("push", frontier.append), stats.timed("pop", frontier.pop)
+        stats.gauge("frontier_size", lambda: len(frontier))
     # A frontier is a queue of pairs (partial_program, non_terminals) describing a partial program:
     # partial_program is the list of primitives and variables describing the leftmost derivation, and
-    # non_terminals is the queue of non-terminals appearing from left to right
+    # non_terminals is the stack of ids of the non-terminals appearing from left to right,
+    # as a cons list (S, rest) starting with the rightmost one, or None: siblings share their stacks
 
     while len(frontier) != 0:
-        partial_program, non_terminals = frontier.pop()
-        if len(non_terminals) == 0: 
-            yield partial_program
+        partial_program, non_terminals = pop()
+        if non_terminals is None:
+            if stats is not None:
+                stats.output()
+            yield prefix_from_compressed(partial_program) if prefix else partial_program
         else:
-            S = non_terminals.pop()
-            for P in G.list_derivations[S]:
-                args_P, w = G.rules[S][P]
-                new_partial_program = (P, partial_program)
-                new_non_terminals = non_terminals.copy()
-                for arg in args_P:
-                    new_non_terminals.append(arg)
-                frontier.append((new_partial_program, new_non_terminals))
+            S, non_terminals = non_terminals
+            for d in rules[S]:
+                new_partial_program = (derivations[d], partial_program)
+                new_non_terminals = non_terminals
+                for arg in arguments[d]:
+                    new_non_terminals = (arg, new_non_terminals)
+                push((new_partial_program, new_non_terminals))
@@ -1,82 +1,138 @@
 import copy
 import functools
+import logging
+import pickle
+import sys
 from collections import deque
-from heapq import heappush, heappop
+from heapq import heappush, heappop, heapify, nlargest
+
+import numpy as np
 
 from program import Program, Function, Variable
 from pcfg import PCFG
+from compiled_pcfg import compile_pcfg
+from evaluation_cache import EvaluationCache
+
+# sizes in bytes used by memory_usage: an entry (-probability, program, d) of a heap,
+# a float, an id, an evaluation in an EvaluationCache (key, value and ordering),
+# and a program node with its tuple of arguments and its key in program.unique_programs
+TUPLE_BYTES = sys.getsizeof((0, 0, 0))
+FLOAT_BYTES = sys.getsizeof(0.0)
+INT_BYTES = sys.getsizeof(2 ** 40)
+EVALUATION_BYTES = 200
+PROGRAM_BYTES = 350
 
+# default number of evaluations kept by the evaluation cache of observational equivalence
+CACHE_ENTRIES = 1_000_000
 
-def heap_search(G: PCFG):
-    H = heap_search_object(G)
+
+def heap_search(G: PCFG, dsl=None, environments=None, stats=None):
+    """
+    G can be either a PCFG or a CompiledPCFG
+    if environments is given, programs are pruned by observational equivalence,
+    see heap_search_object
+    stats: a SearchStats updated during the search, or None
+    """
+    H = heap_search_object(G, dsl, environments, stats)
     return H.generator()
 
 
+def heap_search_batch(G: PCFG, batch_size=1000, dsl=None, environments=None, stats=None):
+    """
+    A generator which outputs the programs of heap search by batches of batch_size programs
+    G can be either a PCFG or a CompiledPCFG
+    """
+    H = heap_search_object(G, dsl, environments, stats)
+    return H.batch_generator(batch_size)
+
+
 class heap_search_object:
-    def return_unique(self, P):
+    """
+    Observational equivalence: if environments (a list of inputs, as given to eval)
+    is not None, a program from S is output only if its evaluations on the environments
+    differ from those of all programs output before from S, that is, more probable ones.
+    Successors are built from the remaining programs only, so this prunes the search
+    space while keeping one program for each evaluation, the most probable one.
+    This is sound because the programs generated by DSL_to_CFG have no lambdas:
+    all variables are bound by the environments.
+    The evaluations are kept in an EvaluationCache bounded to cache_entries.
+    """
+
+    def __init__(self, G: PCFG, dsl=None, environments=None, stats=None, cache_entries=CACHE_ENTRIES):
+        self.setup(G, dsl, environments, cache_entries)
+        if stats is not None:
+            self.instrument(stats)
+        max_probability_derivation = self.G.python_tables()[3]
+
+        # Initialisation heaps, for all non-terminal symbols S from leaves to root
+        ## 1. add P(first(S1), first(S2), ...) to self.heaps[S] for all S -> P(S1, S2, ...)
+        ## where first(S') is the first program output from S', a most probable program from S'
+        ## 2. call query(S, None) to output first(S)
+        # with ties first(S') may differ from the argument max(S') of self.G.max_programs[d]:
+        # arguments are only replaced by their successors from S', so the programs whose
+        # arguments are output before max(S') would be missed
+        for S in reversed(self.symbols):
+            for d in self.rules[S]:
+                program = self.G.max_programs[d]
+                if isinstance(program, Function):
+                    program = Function(
+                        program.function,
+                        [self.succ[S2][-1] for S2 in self.arguments[d]],
+                        type_=program.type,
+                    )
+
+                # Remark: the program cannot already be in self.heaps[S]
+                assert program.id not in self.hash_table_program[S]
+
+                self.push(S, program, d, max_probability_derivation[d])
+            self.query(S, None)
+
+    def setup(self, G, dsl, environments, cache_entries):
         """
-        ensures that if a program appears in several heaps,
-        it is represented by the same object,
-        so we do not evaluate it several times
+        creates the empty tables of the search
         """
-        hash_P = P.hash
-        if hash_P in self.hash_table_global:
-            return self.hash_table_global[hash_P]
-        else:
-            self.hash_table_global[hash_P] = P
-            return P
-
-    def __init__(self, G: PCFG):
         self.current = None
+        self.stats = None
+
+        self.dsl = dsl
+        self.environments = environments
+        # self.evaluations is the evaluation cache {(id, i) : value} of the programs
+        # self.signatures[S] is the set of evaluations of the programs output from S
+        self.evaluations = EvaluationCache(max_entries=cache_entries)
 
-        self.G = G
-        self.start = G.start
-        self.rules = G.rules
-        self.symbols = [S for S in self.rules]
+        self.G = compile_pcfg(G)
+        self.start = self.G.start
+        self.rules, self.weight, self.arguments, _ = self.G.python_tables()
+        # in log mode self.weight and self.probabilities are log-probabilities
+        self.log_probability = self.G.log_probability
+        self.symbols = range(self.G.number_of_non_terminals())
 
-        # self.heaps[S] is a heap containing programs generated from the non-terminal S
-        self.heaps = {S: [] for S in self.symbols}
+        # self.heaps[S] is a heap containing triples (-probability, program, d)
+        # for programs generated from the non-terminal S using the derivation d
+        self.heaps = [[] for S in self.symbols]
 
         # the same program can be pushed in different heaps, with different probabilities
         # however, the same program cannot be pushed twice in the same heap
 
-        # self.succ[S][P] is the successor of P from S
-        self.succ = {S: {} for S in self.symbols}
+        # self.succ[S][id] is the successor from S of the program with this id
+        self.succ = [{} for S in self.symbols]
 
-        # self.hash_table_program[S] is the set of hashes of programs
+        # self.hash_table_program[S] is the set of ids of programs
         # ever added to the heap for S
-        self.hash_table_program = {S: set() for S in self.symbols}
+        # Programs are hash-consed so ids identify programs without collisions
+        self.hash_table_program = [set() for S in self.symbols]
 
-        # self.hash_table_global[hash] = P maps
-        # hashes to programs for all programs ever added to some heap
-        self.hash_table_global = {}
+        # self.probabilities[S][id] is the probability of the program with this id
+        # from S, for all programs ever added to the heap for S
+        self.probabilities = [{} for S in self.symbols]
 
-        # Initialisation heaps
-        ## 1. add P(max(S1),max(S2), ...) to self.heaps[S] for all S -> P(S1, S2, ...)
-        for S in reversed(self.rules):
-            for P in self.rules[S]:
-                args_P, w = self.rules[S][P]
-                program = self.G.max_probability[(S, P)]
-                hash_program = program.hash
+        self.signatures = [set() for S in self.symbols]
 
-                # Remark: the program cannot already be in self.heaps[S]
-                assert hash_program not in self.hash_table_program[S]
-
-                self.hash_table_program[S].add(hash_program)
-
-                # we assume that the programs from max_probability
-                # are represented by the same object
-                self.hash_table_global[hash_program] = program
-
-                # print("adding to the heap", program, program.probability[S])
-                heappush(
-                    self.heaps[S],
-                    (-program.probability[(self.G.hash, S)], program),
-                )
-
-        # 2. call query(S, None) for all non-terminal symbols S, from leaves to root
-        for S in reversed(self.rules):
-            self.query(S, None)
+        # self.pruned[S] is the list of the programs popped from the heap for S but pruned
+        # by observational equivalence: they are kept so that their ids stay in
+        # hash_table_program and succ, a program rebuilt after its node is freed
+        # would get a fresh id and be pushed again
+        self.pruned = [[] for S in self.symbols]
 
     def generator(self):
         """
@@ -85,59 +141,714 @@ class heap_search_object:
         while True:
             program = self.query(self.start, self.current)
             self.current = program
+            if self.stats is not None:
+                self.stats.output()
             yield program
 
+    def next_batch(self, k):
+        """
+        Returns the list of the next (at most) k most probable programs,
+        shorter than k only if there are no more programs
+        """
+        query = self.query
+        start = self.start
+        current = self.current
+        batch = []
+        for _ in range(k):
+            program = query(start, current)
+            if program is None:
+                break
+            batch.append(program)
+            current = program
+        self.current = current
+        if self.stats is not None:
+            self.stats.output(len(batch))
+        return batch
+
+    def batch_generator(self, batch_size):
+        """
+        A generator which outputs lists of batch_size programs in decreasing probability
+        """
+        while True:
+            batch = self.next_batch(batch_size)
+            if len(batch) == 0:
+                return
+            yield batch
+
     def query(self, S, program):
         """
         computing the successor of program from S
         """
         if program:
-            hash_program = program.hash
+            id_program = program.id
         else:
-            hash_program = 123891
+            id_program = -1
 
         # if we have already computed the successor of program from S, we return its stored value
-        if hash_program in self.succ[S]:
-            # print("already computed the successor of S, it's ", S, program, self.succ[S][hash_program])
-            return self.succ[S][hash_program]
+        if id_program in self.succ[S]:
+            return self.succ[S][id_program]
+
+        # programs popped but pruned as equivalent to an earlier one
+        pruned = self.pruned[S]
+        number_pruned = len(pruned)
+        while True:
+            # otherwise the successor is the next element in the heap
+            try:
+                _, succ, d = heappop(self.heaps[S])
+            except:
+                return # the heap is empty: there are no successors from S
+
+            # now we need to add all potential successors of succ in heaps[S]
+            # (if succ is a variable, there is no successor)
+            if isinstance(succ, Function):
+                self.push_successors(S, succ, d)
+
+            if self.environments is None or self.new_evaluation(S, succ):
+                break
+            pruned.append(succ)
+
+        self.succ[S][id_program] = succ  # we store the succesor
+        # so that succ maps every program popped from S to the next program output
+        for k in range(number_pruned, len(pruned)):
+            self.succ[S][pruned[k].id] = succ
+        return succ
+
+    def push(self, S, program, d, probability):
+        """
+        adds program, derived from S using d, to heaps[S]
+        """
+        self.hash_table_program[S].add(program.id)
+        self.probabilities[S][program.id] = probability
+        heappush(self.heaps[S], (-probability, program, d))
 
-        # otherwise the successor is the next element in the heap
+    def push_successors(self, S, succ, d):
+        """
+        adds to heaps[S] the programs obtained from succ by replacing one argument by its successor
+        """
+        F = succ.function
+        args_d = self.arguments[d]
+
+        # scratch list of arguments shared by all successors of succ,
+        # Function copies it into its own tuple
+        scratch = list(succ.arguments)
+
+        for i in range(len(succ.arguments)):
+            # non-terminal symbol used to derive the i-th argument
+            S2 = args_d[i]
+            succ_sub_program = self.query(S2, succ.arguments[i])
+
+            if isinstance(succ_sub_program, Program):
+                scratch[i] = succ_sub_program
+                new_program = Function(F, scratch, type_=succ.type)
+                scratch[i] = succ.arguments[i]
+
+                if new_program.id not in self.hash_table_program[S]:
+                    probability = self.weight[d]
+                    if self.log_probability:
+                        for arg, S3 in zip(new_program.arguments, args_d):
+                            probability += self.probabilities[S3][arg.id]
+                    else:
+                        for arg, S3 in zip(new_program.arguments, args_d):
+                            probability *= self.probabilities[S3][arg.id]
+                    self.push(S, new_program, d, probability)
+                elif self.stats is not None:
+                    self.stats.count("duplicates")
+
+    def instrument(self, stats):
+        """
+        Reports the search to stats (a SearchStats): query and push are replaced
+        by wrappers timed as "query" and "heappush", queries are counted as "succ_hits"
+        or "succ_misses", and the sizes of the heaps are recorded at each snapshot
+        """
+        self.stats = stats
+        succ = self.succ
+        query = self.query
+
+        def counted_query(S, program):
+            if (program.id if program else -1) in succ[S]:
+                stats.count("succ_hits")
+            else:
+                stats.count("succ_misses")
+            return query(S, program)
+
+        self.query = stats.timed("query", counted_query)
+        self.push = stats.timed("heappush", self.push)
+        stats.gauge("heap_sizes", lambda: [len(self.heaps[S]) for S in self.symbols])
+        stats.gauge("memory_usage", self.memory_usage)
+
+    def new_evaluation(self, S, program):
+        """
+        checks whether program is the first program from S with its evaluations
+        on the environments, and records them
+        """
         try:
-            _, succ = heappop(self.heaps[S])
-            # print("found succ in the heap", S, program, succ)
-        except:
-            return # the heap is empty: there are no successors from S
+            signature = tuple(
+                freeze(program.eval(self.dsl, environment, i, self.evaluations))
+                for i, environment in enumerate(self.environments)
+            )
+            if signature in self.signatures[S]:
+                return False
+        except TypeError:
+            return True  # evaluations which cannot be compared, such as functions
+        self.signatures[S].add(signature)
+        return True
 
-        self.succ[S][hash_program] = succ  # we store the succesor
+    def memory_usage(self):
+        """
+        Returns a dictionary {structure: estimated number of bytes}
+        The containers are counted with the numbers they hold, but not the programs
+        as they are shared between structures: "programs" counts PROGRAM_BYTES for each
+        program in a heap, successor of a program or pruned, an upper bound for the nodes they keep alive
+        """
+        heaps = 0
+        succ = 0
+        hash_table_program = 0
+        probabilities = 0
+        signatures = 0
+        pruned = 0
+        programs = 0
+        for S in self.symbols:
+            programs += len(self.heaps[S]) + len(self.succ[S]) + len(self.pruned[S])
+            heaps += sys.getsizeof(self.heaps[S]) + len(self.heaps[S]) * (TUPLE_BYTES + FLOAT_BYTES)
+            succ += sys.getsizeof(self.succ[S]) + len(self.succ[S]) * INT_BYTES
+            hash_table_program += (
+                sys.getsizeof(self.hash_table_program[S])
+                + len(self.hash_table_program[S]) * INT_BYTES
+            )
+            probabilities += sys.getsizeof(self.probabilities[S]) + len(self.probabilities[S]) * (
+                INT_BYTES + FLOAT_BYTES
+            )
+            signatures += sys.getsizeof(self.signatures[S])
+            pruned += sys.getsizeof(self.pruned[S])
+        return {
+            "heaps": heaps,
+            "succ": succ,
+            "hash_table_program": hash_table_program,
+            "probabilities": probabilities,
+            "signatures": signatures,
+            "pruned": pruned,
+            "evaluations": len(self.evaluations) * EVALUATION_BYTES,
+            "programs": programs * PROGRAM_BYTES,
+        }
 
-        # now we need to add all potential successors of succ in heaps[S]
-        if isinstance(succ, Variable):
-            return succ  # if succ is a variable, there is no successor so we stop here
+    def save(self, path):
+        """
+        Saves the state of the search to path, to be resumed with load_heap_search
 
-        if isinstance(succ, Function):
-            F = succ.function
+        The file is a NumPy archive of integer and float arrays: the programs are stored
+        once in a table, each entry being the id of its derivation in the compiled PCFG
+        followed by the entries of its arguments, which come first in the table.
+        Programs which are no longer used are not saved, their ids cannot occur again.
+        The evaluation cache is not saved; with observational equivalence
+        the signatures (pickled, they only contain evaluations) and the pruned programs are saved.
+        """
+        arrays, _ = self.encode_state()
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
 
-            for i in range(len(succ.arguments)):
-                # non-terminal symbol used to derive the i-th argument
-                S2 = self.G.rules[S][F][0][i]
-                succ_sub_program = self.query(S2, succ.arguments[i])
+    def encode_state(self):
+        """
+        Returns (arrays, entry): the arrays saved by save, and the dictionary mapping
+        the id of a saved program to its entry in the table of programs
+        """
+        derivation_of = [
+            {self.G.derivations[d].id: d for d in self.rules[S]} for S in self.symbols
+        ]
+        # entry[id] is the table entry of the program with this id
+        entry = {}
+        program_derivation = []
+        argument_offsets = [0]
+        program_arguments = []
 
-                if isinstance(succ_sub_program, Program):
-                    new_arguments = succ.arguments[:]
-                    new_arguments[i] = succ_sub_program
+        def encode(S, program):
+            if program.id in entry:
+                return entry[program.id]
+            if isinstance(program, Function):
+                d = derivation_of[S][program.function.id]
+                arguments = [
+                    encode(S2, argument)
+                    for S2, argument in zip(self.arguments[d], program.arguments)
+                ]
+            else:
+                d = derivation_of[S][program.id]
+                arguments = []
+            entry[program.id] = len(program_derivation)
+            program_derivation.append(d)
+            program_arguments.extend(arguments)
+            argument_offsets.append(len(program_arguments))
+            return entry[program.id]
 
-                    new_program = Function(
-                        F, new_arguments, type_=succ.type, probability={}
+        # the heaps are saved in their order, so that ties are broken in the same way
+        heaps = [[], [], []]
+        heap_offsets = [0]
+        for S in self.symbols:
+            for priority, program, d in self.heaps[S]:
+                heaps[0].append(priority)
+                heaps[1].append(encode(S, program))
+                heaps[2].append(d)
+            heap_offsets.append(len(heaps[0]))
+        succ_values = [[encode(S, succ) for succ in self.succ[S].values()] for S in self.symbols]
+        pruned = []
+        pruned_offsets = [0]
+        for S in self.symbols:
+            pruned.extend(encode(S, program) for program in self.pruned[S])
+            pruned_offsets.append(len(pruned))
+        current = -1 if self.current is None else encode(self.start, self.current)
+
+        # the keys are encoded once all programs still in use are in the table
+        succ = [[], []]
+        succ_offsets = [0]
+        probabilities = [[], []]
+        probability_offsets = [0]
+        for S in self.symbols:
+            for id_program, value in zip(self.succ[S], succ_values[S]):
+                if id_program == -1 or id_program in entry:
+                    succ[0].append(entry.get(id_program, -1))
+                    succ[1].append(value)
+            succ_offsets.append(len(succ[0]))
+            for id_program, probability in self.probabilities[S].items():
+                if id_program in entry:
+                    probabilities[0].append(entry[id_program])
+                    probabilities[1].append(probability)
+            probability_offsets.append(len(probabilities[0]))
+
+        if self.environments is None:
+            signatures = b""
+        else:
+            signatures = pickle.dumps(self.signatures, protocol=pickle.HIGHEST_PROTOCOL)
+
+        arrays = dict(
+            lhs=self.G.lhs,
+            children=self.G.children,
+            program_derivation=np.array(program_derivation, dtype=np.int32),
+            argument_offsets=np.array(argument_offsets, dtype=np.int64),
+            program_arguments=np.array(program_arguments, dtype=np.int64),
+            heap_offsets=np.array(heap_offsets, dtype=np.int64),
+            heap_priority=np.array(heaps[0], dtype=np.float64),
+            heap_program=np.array(heaps[1], dtype=np.int64),
+            heap_derivation=np.array(heaps[2], dtype=np.int32),
+            succ_offsets=np.array(succ_offsets, dtype=np.int64),
+            succ_key=np.array(succ[0], dtype=np.int64),
+            succ_value=np.array(succ[1], dtype=np.int64),
+            pruned_offsets=np.array(pruned_offsets, dtype=np.int64),
+            pruned_program=np.array(pruned, dtype=np.int64),
+            probability_offsets=np.array(probability_offsets, dtype=np.int64),
+            probability_program=np.array(probabilities[0], dtype=np.int64),
+            probability_value=np.array(probabilities[1], dtype=np.float64),
+            current=np.array([current], dtype=np.int64),
+            signatures=np.frombuffer(signatures, dtype=np.uint8),
+        )
+        return arrays, entry
+
+    def decode_state(self, data, path):
+        """
+        Restores the state saved to path by save from data, the arrays loaded from path,
+        returns the table of programs
+        """
+        if not (
+            np.array_equal(data["lhs"], self.G.lhs)
+            and np.array_equal(data["children"], self.G.children)
+        ):
+            raise ValueError("{} was saved for another PCFG".format(path))
+
+        programs = []
+        argument_offsets = data["argument_offsets"].tolist()
+        program_arguments = data["program_arguments"].tolist()
+        for k, d in enumerate(data["program_derivation"].tolist()):
+            arguments = program_arguments[argument_offsets[k] : argument_offsets[k + 1]]
+            if len(arguments) == 0:
+                programs.append(self.G.derivations[d])
+            else:
+                # as in PCFG.compute_max_probability, the type is the one of the non-terminal
+                programs.append(
+                    Function(
+                        self.G.derivations[d],
+                        [programs[j] for j in arguments],
+                        type_=self.G.max_programs[d].type,
                     )
-                    new_program = self.return_unique(new_program)
-                    hash_new_program = new_program.hash
+                )
+        ids = [program.id for program in programs]
+
+        heap_offsets = data["heap_offsets"].tolist()
+        heap_priority = data["heap_priority"].tolist()
+        heap_program = data["heap_program"].tolist()
+        heap_derivation = data["heap_derivation"].tolist()
+        succ_offsets = data["succ_offsets"].tolist()
+        succ_key = data["succ_key"].tolist()
+        succ_value = data["succ_value"].tolist()
+        pruned_offsets = data["pruned_offsets"].tolist()
+        pruned_program = data["pruned_program"].tolist()
+        probability_offsets = data["probability_offsets"].tolist()
+        probability_program = data["probability_program"].tolist()
+        probability_value = data["probability_value"].tolist()
+        for S in self.symbols:
+            self.heaps[S] = [
+                (heap_priority[k], programs[heap_program[k]], heap_derivation[k])
+                for k in range(heap_offsets[S], heap_offsets[S + 1])
+            ]
+            self.succ[S] = {
+                -1 if succ_key[k] == -1 else ids[succ_key[k]]: programs[succ_value[k]]
+                for k in range(succ_offsets[S], succ_offsets[S + 1])
+            }
+            self.pruned[S] = [
+                programs[pruned_program[k]]
+                for k in range(pruned_offsets[S], pruned_offsets[S + 1])
+            ]
+            self.probabilities[S] = {
+                ids[probability_program[k]]: probability_value[k]
+                for k in range(probability_offsets[S], probability_offsets[S + 1])
+            }
+            self.hash_table_program[S] = set(self.probabilities[S])
+
+        current = int(data["current"][0])
+        self.current = None if current == -1 else programs[current]
+        if self.environments is not None and len(data["signatures"]) > 0:
+            self.signatures = pickle.loads(data["signatures"].tobytes())
+        return programs
+
+
+def load_heap_search(path, G: PCFG, dsl=None, environments=None, stats=None, cache_entries=CACHE_ENTRIES):
+    """
+    Returns the heap_search_object saved to path by save, which continues
+    with the program following the last one output before saving
+    G must be the PCFG of the saved search (possibly compiled), and dsl and environments
+    must be given again for observational equivalence
+    """
+    H = heap_search_object.__new__(heap_search_object)
+    H.setup(G, dsl, environments, cache_entries)
+    if stats is not None:
+        H.instrument(stats)
+    with np.load(path) as data:
+        H.decode_state(data, path)
+    return H
+
+
+class bounded_heap_search_object(heap_search_object):
+    """
+    Heap search keeping its memory usage (see memory_usage) below memory_budget bytes
+
+    Every check_every programs output, if the memory usage exceeds the budget,
+    the successors of the programs which can no longer be queried are dropped;
+    if it still exceeds the budget the programs of the heaps which lead to the least probable
+    programs are evicted: a program from S with probability p leads to programs
+    with probability at most p * outside[S] (see outside_probabilities).
+    The search goes on, but the programs with probability at most cutoff, the largest bound
+    of an evicted program, may be missing: all the more probable programs are output.
+    The search ends if the budget cannot be met.
+
+    Only the successor of the last program output can be queried from the start.
+    The successors from S form a chain, the programs output from S in order;
+    the i-th program of the chain is queried again only while it is an argument of a
+    program in a heap, or if an earlier program of the chain is, as its successor
+    can bring it back. So the successors are dropped along the prefix of each chain
+    whose programs are not arguments of programs in heaps.
+
+    There is no hash_table_program: a program F(a1, ..., ak) is pushed only from the
+    program where the last argument ai which is not first[Si], the first program output
+    from the non-terminal Si of ai, is replaced by its predecessor, so each program is pushed once.
+
+    With observational equivalence the evaluation cache is bounded to cache_entries,
+    the signatures are never dropped.
+    The search is resumed from a save with load_bounded_heap_search.
+    """
 
-                    if hash_new_program not in self.hash_table_program[S]:
-                        self.hash_table_program[S].add(hash_new_program)
-                        probability = self.G.rules[S][F][1]
-                        for arg, S3 in zip(new_arguments, self.G.rules[S][F][0]):
-                            probability *= arg.probability[(self.G.hash, S3)]
-                        heappush(self.heaps[S], (-probability, new_program))
-                        new_program.probability[(self.G.hash, S)] = probability
+    def __init__(
+        self,
+        G: PCFG,
+        memory_budget,
+        dsl=None,
+        environments=None,
+        check_every=10_000,
+        cache_entries=CACHE_ENTRIES,
+        stats=None,
+    ):
+        self.memory_budget = memory_budget
+        self.check_every = check_every
+        super().__init__(G, dsl, environments, stats, cache_entries)
 
+    def setup(self, G, dsl, environments, cache_entries):
+        super().setup(G, dsl, environments, cache_entries)
+        self.number_of_queries = 0
+        # the largest probability of a program an evicted program leads to,
+        # None if no program was evicted
+        self.cutoff = None
+        self.outside = self.outside_probabilities()
+        # self.references[S][id] is the number of programs in heaps with
+        # the program with this id from S as argument (entries are removed at 0)
+        self.references = [{} for S in self.symbols]
+        # self.chains[S] are the keys of self.succ[S] in the order they were added
+        self.chains = [deque() for S in self.symbols]
+        # self.first[S] is the first program output from S, the start of its chain
+        self.first = [None for S in self.symbols]
+
+    def push(self, S, program, d, probability):
+        if isinstance(program, Function):
+            for argument, S2 in zip(program.arguments, self.arguments[d]):
+                references = self.references[S2]
+                references[argument.id] = references.get(argument.id, 0) + 1
+        heappush(self.heaps[S], (-probability, program, d))
+
+    def query(self, S, program):
+        if S == self.start:
+            self.number_of_queries += 1
+            if self.number_of_queries % self.check_every == 0:
+                self.enforce_budget()
+
+        if program:
+            id_program = program.id
+        else:
+            id_program = -1
+
+        if id_program in self.succ[S]:
+            return self.succ[S][id_program]
+
+        # the keys whose successor is succ: program and the programs pruned
+        keys = [id_program]
+        while True:
+            try:
+                minus_probability, succ, d = heappop(self.heaps[S])
+            except IndexError:
+                return
+            # the probability of a program from S is only needed once it is output
+            self.probabilities[S][succ.id] = -minus_probability
+
+            if isinstance(succ, Function):
+                self.release(succ, d)
+                self.push_successors(S, succ, d)
+
+            if self.environments is None or self.new_evaluation(S, succ):
+                break
+            keys.append(succ.id)
+
+        for key in keys:
+            self.succ[S][key] = succ
+        self.chains[S].extend(keys)
+        if id_program == -1:
+            self.first[S] = succ
         return succ
+
+    def release(self, program, d):
+        """
+        removes the references of program, derived using d and leaving a heap, to its arguments
+        """
+        for argument, S2 in zip(program.arguments, self.arguments[d]):
+            references = self.references[S2]
+            if references[argument.id] == 1:
+                del references[argument.id]
+            else:
+                references[argument.id] -= 1
+
+    def push_successors(self, S, succ, d):
+        F = succ.function
+        args_d = self.arguments[d]
+        first = self.first
+        scratch = list(succ.arguments)
+
+        # only the arguments from the last one which is not first[S2] are replaced
+        last = len(succ.arguments) - 1
+        while last > 0 and succ.arguments[last] is first[args_d[last]]:
+            last -= 1
+
+        for i in range(last, len(succ.arguments)):
+            S2 = args_d[i]
+            succ_sub_program = self.query(S2, succ.arguments[i])
+
+            if isinstance(succ_sub_program, Program):
+                scratch[i] = succ_sub_program
+                new_program = Function(F, scratch, type_=succ.type)
+                scratch[i] = succ.arguments[i]
+
+                probability = self.weight[d]
+                if self.log_probability:
+                    for arg, S3 in zip(new_program.arguments, args_d):
+                        probability += self.probabilities[S3][arg.id]
+                else:
+                    for arg, S3 in zip(new_program.arguments, args_d):
+                        probability *= self.probabilities[S3][arg.id]
+                self.push(S, new_program, d, probability)
+
+    def collect(self):
+        """
+        drops the successors of the programs which can no longer be queried
+        """
+        for S in self.symbols:
+            chain = self.chains[S]
+            references = self.references[S]
+            succ = self.succ[S]
+            probabilities = self.probabilities[S]
+            while len(chain) > 0 and chain[0] not in references:
+                key = chain.popleft()
+                del succ[key]
+                probabilities.pop(key, None)
+
+    def outside_probabilities(self):
+        """
+        Returns the list outside such that outside[S] is the largest probability of
+        a context of S: a program from the start with a program from S of probability p
+        as subprogram has probability at most p * outside[S] (p + outside[S] in log mode)
+        """
+        if self.log_probability:
+            max_probability = self.G.max_log_probability.tolist()
+            outside = [-float("inf") for S in self.symbols]
+            outside[self.start] = 0
+        else:
+            max_probability = self.G.max_probability.tolist()
+            outside = [0 for S in self.symbols]
+            outside[self.start] = 1
+        # the non-terminals are ordered from root to leaves
+        for S in self.symbols:
+            for d in self.rules[S]:
+                args_d = self.arguments[d]
+                for i, S2 in enumerate(args_d):
+                    probability = outside[S]
+                    if self.log_probability:
+                        probability += self.weight[d] + sum(
+                            max_probability[S3] for j, S3 in enumerate(args_d) if j != i
+                        )
+                    else:
+                        probability *= self.weight[d]
+                        for j, S3 in enumerate(args_d):
+                            if j != i:
+                                probability *= max_probability[S3]
+                    outside[S2] = max(outside[S2], probability)
+        return outside
+
+    def evict(self, number):
+        """
+        drops from the heaps the number programs which lead to the least probable programs
+        """
+        outside = self.outside
+        if self.log_probability:
+            bounds = (
+                (entry[0] - outside[S], S, k)
+                for S in self.symbols
+                for k, entry in enumerate(self.heaps[S])
+            )
+        else:
+            bounds = (
+                (entry[0] * outside[S], S, k)
+                for S in self.symbols
+                for k, entry in enumerate(self.heaps[S])
+            )
+        # the entries (-bound, S, k) of the evicted programs, k being their index in heaps[S]
+        evicted = nlargest(number, bounds)
+        if len(evicted) == 0:
+            return
+        positions = [set() for S in self.symbols]
+        for _, S, k in evicted:
+            positions[S].add(k)
+        for S in self.symbols:
+            if len(positions[S]) > 0:
+                heap = self.heaps[S]
+                for k in positions[S]:
+                    _, program, d = heap[k]
+                    if isinstance(program, Function):
+                        self.release(program, d)
+                heap[:] = [entry for k, entry in enumerate(heap) if k not in positions[S]]
+                heapify(heap)
+
+        # the entries are sorted by decreasing -bound
+        probability = -evicted[-1][0]
+        if self.cutoff is None:
+            logging.warning(
+                "heap search evicted {} programs after {} programs: memory budget exceeded {}, "
+                "programs with probability at most {} may be missing".format(
+                    len(evicted), self.number_of_queries, self.memory_usage(), probability
+                )
+            )
+        if self.cutoff is None or probability > self.cutoff:
+            self.cutoff = probability
+        if self.stats is not None:
+            self.stats.count("evicted", len(evicted))
+
+    def enforce_budget(self):
+        if sum(self.memory_usage().values()) > self.memory_budget:
+            self.collect()
+            excess = sum(self.memory_usage().values()) - self.memory_budget
+            if excess > 0:
+                # an evicted program frees its entry in the heap and its node
+                self.evict(-(-excess // (TUPLE_BYTES + FLOAT_BYTES + PROGRAM_BYTES)))
+                self.collect()
+
+    def memory_usage(self):
+        usage = super().memory_usage()
+        usage["references"] = sum(
+            sys.getsizeof(self.references[S]) + len(self.references[S]) * INT_BYTES
+            for S in self.symbols
+        )
+        usage["chains"] = sum(
+            sys.getsizeof(self.chains[S]) + len(self.chains[S]) * INT_BYTES for S in self.symbols
+        )
+        return usage
+
+    def encode_state(self):
+        """
+        Adds to the state saved by heap_search_object.save the first programs,
+        the number of queries and the cutoff;
+        a first program which is not saved cannot occur again as an argument
+        """
+        arrays, entry = super().encode_state()
+        arrays["first"] = np.array(
+            [-1 if program is None else entry.get(program.id, -1) for program in self.first],
+            dtype=np.int64,
+        )
+        arrays["number_of_queries"] = np.array([self.number_of_queries], dtype=np.int64)
+        arrays["cutoff"] = np.array(
+            [np.nan if self.cutoff is None else self.cutoff], dtype=np.float64
+        )
+        return arrays, entry
+
+    def decode_state(self, data, path):
+        """
+        Restores the state saved by encode_state,
+        the references and the chains are rebuilt from the heaps and the successors
+        """
+        programs = super().decode_state(data, path)
+        self.hash_table_program = [set() for S in self.symbols]
+        for S in self.symbols:
+            self.chains[S] = deque(self.succ[S])
+            for _, program, d in self.heaps[S]:
+                if isinstance(program, Function):
+                    for argument, S2 in zip(program.arguments, self.arguments[d]):
+                        references = self.references[S2]
+                        references[argument.id] = references.get(argument.id, 0) + 1
+        self.first = [None if k == -1 else programs[k] for k in data["first"].tolist()]
+        self.number_of_queries = int(data["number_of_queries"][0])
+        cutoff = float(data["cutoff"][0])
+        self.cutoff = None if np.isnan(cutoff) else cutoff
+        return programs
+
+
+def load_bounded_heap_search(
+    path,
+    G: PCFG,
+    memory_budget,
+    dsl=None,
+    environments=None,
+    check_every=10_000,
+    cache_entries=CACHE_ENTRIES,
+    stats=None,
+):
+    """
+    Returns the bounded_heap_search_object saved to path by save, see load_heap_search
+    """
+    H = bounded_heap_search_object.__new__(bounded_heap_search_object)
+    H.memory_budget = memory_budget
+    H.check_every = check_every
+    H.setup(G, dsl, environments, cache_entries)
+    if stats is not None:
+        H.instrument(stats)
+    with np.load(path) as data:
+        H.decode_state(data, path)
+    return H
+
+
+def freeze(value):
+    """
+    a hashable copy of value, raises TypeError for functions
+    """
+    if isinstance(value, list):
+        return tuple([freeze(x) for x in value])
+    if callable(value):
+        raise TypeError("cannot compare functions")
+    return value
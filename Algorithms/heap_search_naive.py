@@ -5,56 +5,71 @@ from heapq import heappush, heappop
 
 from program import Program, Function, Variable
 from pcfg import PCFG
+from compiled_pcfg import compile_pcfg
 
 
-def heap_search_naive(G: PCFG):
-    H = heap_search_object_naive(G)
+def heap_search_naive(G: PCFG, stats=None):
+    """
+    G can be either a PCFG or a CompiledPCFG
+    stats: a SearchStats updated during the search, or None
+    """
+    H = heap_search_object_naive(G, stats)
     return H.generator()
 
 
 class heap_search_object_naive:
-    def __init__(self, G: PCFG):
+    def __init__(self, G: PCFG, stats=None):
         self.current = None
+        self.stats = stats
 
-        self.G = G
-        self.start = G.start
-        self.rules = G.rules
-        self.symbols = [S for S in self.rules]
+        self.G = compile_pcfg(G)
+        self.start = self.G.start
+        self.rules, self.weight, self.arguments, max_probability_derivation = self.G.python_tables()
+        # in log mode self.weight and self.probabilities are log-probabilities
+        self.log_probability = self.G.log_probability
+        self.symbols = range(self.G.number_of_non_terminals())
 
-        # self.heaps[S] is a heap containing programs generated from the non-terminal S
-        self.heaps = {S: [] for S in self.symbols}
+        # self.heaps[S] is a heap containing triples (-probability, program, d)
+        # for programs generated from the non-terminal S using the derivation d
+        self.heaps = [[] for S in self.symbols]
 
         # the same program can be pushed in different heaps, with different probabilities
         # however, the same program cannot be pushed twice in the same heap
 
-        # self.succ[S][P] is the successor of P from S
-        self.succ = {S: {} for S in self.symbols}
+        # self.succ[S][id] is the successor from S of the program with this id
+        self.succ = [{} for S in self.symbols]
 
-        # self.hash_table_program[S] is the set of hashes of programs
+        # self.hash_table_program[S] is the set of ids of programs
         # ever added to the heap for S
-        self.hash_table_program = {S: set() for S in self.symbols}
+        self.hash_table_program = [set() for S in self.symbols]
+
+        # self.probabilities[S][id] is the probability of the program with this id
+        # from S, for all programs ever added to the heap for S
+        self.probabilities = [{} for S in self.symbols]
+
+        if stats is not None:
+            self.query = stats.timed("query", self.query)
+            stats.gauge("heap_sizes", lambda: [len(self.heaps[S]) for S in self.symbols])
 
         # Initialisation heaps
         ## 1. add P(max(S1),max(S2), ...) to self.heaps[S] for all S -> P(S1, S2, ...)
-        for S in reversed(self.rules):
-            for P in self.rules[S]:
-                args_P, w = self.rules[S][P]
-                program = self.G.max_probability[(S, P)]
-                hash_program = program.hash
+        for S in reversed(self.symbols):
+            for d in self.rules[S]:
+                program = self.G.max_programs[d]
 
                 # Remark: the program cannot already be in self.heaps[S]
-                assert hash_program not in self.hash_table_program[S]
+                assert program.id not in self.hash_table_program[S]
 
-                self.hash_table_program[S].add(hash_program)
+                self.hash_table_program[S].add(program.id)
+                self.probabilities[S][program.id] = max_probability_derivation[d]
 
-                # print("adding to the heap", program, program.probability[S])
                 heappush(
                     self.heaps[S],
-                    (-program.probability[(self.G.hash, S)], program),
+                    (-max_probability_derivation[d], program, d),
                 )
 
         # 2. call query(S, None) for all non-terminal symbols S, from leaves to root
-        for S in reversed(self.rules):
+        for S in reversed(self.symbols):
             self.query(S, None)
 
     def generator(self):
@@ -64,6 +79,8 @@ class heap_search_object_naive:
         while True:
             program = self.query(self.start, self.current)
             self.current = program
+            if self.stats is not None:
+                self.stats.output()
             yield program
 
     def query(self, S, program):
@@ -71,23 +88,21 @@ class heap_search_object_naive:
         computing the successor of program from S
         """
         if program:
-            hash_program = program.hash
+            id_program = program.id
         else:
-            hash_program = 123891
+            id_program = -1
 
         # if we have already computed the successor of program from S, we return its stored value
-        if hash_program in self.succ[S]:
-            # print("already computed the successor of S, it's ", S, program, self.succ[S][hash_program])
-            return self.succ[S][hash_program]
+        if id_program in self.succ[S]:
+            return self.succ[S][id_program]
 
         # otherwise the successor is the next element in the heap
         try:
-            _, succ = heappop(self.heaps[S])
-            # print("found succ in the heap", S, program, succ)
+            _, succ, d = heappop(self.heaps[S])
         except:
             return # the heap is empty: there are no successors from S
 
-        self.succ[S][hash_program] = succ  # we store the succesor
+        self.succ[S][id_program] = succ  # we store the succesor
 
         # now we need to add all potential successors of succ in heaps[S]
         if isinstance(succ, Variable):
@@ -95,27 +110,29 @@ class heap_search_object_naive:
 
         if isinstance(succ, Function):
             F = succ.function
+            args_d = self.arguments[d]
 
             for i in range(len(succ.arguments)):
                 # non-terminal symbol used to derive the i-th argument
-                S2 = self.G.rules[S][F][0][i]
+                S2 = args_d[i]
                 succ_sub_program = self.query(S2, succ.arguments[i])
 
                 if isinstance(succ_sub_program, Program):
-                    new_arguments = succ.arguments[:]
+                    new_arguments = list(succ.arguments)
                     new_arguments[i] = succ_sub_program
 
-                    new_program = Function(
-                        F, new_arguments, type_=succ.type, probability={}
-                    )
-                    hash_new_program = new_program.hash
-
-                    if hash_new_program not in self.hash_table_program[S]:
-                        self.hash_table_program[S].add(hash_new_program)
-                        probability = self.G.rules[S][F][1]
-                        for arg, S3 in zip(new_arguments, self.G.rules[S][F][0]):
-                            probability *= arg.probability[(self.G.hash, S3)]
-                        heappush(self.heaps[S], (-probability, new_program))
-                        new_program.probability[(self.G.hash, S)] = probability
+                    new_program = Function(F, new_arguments, type_=succ.type)
+
+                    if new_program.id not in self.hash_table_program[S]:
+                        self.hash_table_program[S].add(new_program.id)
+                        probability = self.weight[d]
+                        if self.log_probability:
+                            for arg, S3 in zip(new_arguments, args_d):
+                                probability += self.probabilities[S3][arg.id]
+                        else:
+                            for arg, S3 in zip(new_arguments, args_d):
+                                probability *= self.probabilities[S3][arg.id]
+                        heappush(self.heaps[S], (-probability, new_program, d))
+                        self.probabilities[S][new_program.id] = probability
 
         return succ
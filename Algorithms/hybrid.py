@@ -1,40 +1,55 @@
 from program import *
 from pcfg import *
-from Algorithms.sqrt_sampling import *
+from compiled_pcfg import compile_pcfg
+from evaluation_cache import EvaluationCache
+from Algorithms.power_sampling import power_pcfg
 from Algorithms.parallel import parallel_workers
 
-from collections import deque 
+import time
+from math import exp
 
-def hybrid(G : PCFG, DFS_depth = 3, width = 20, batch_size = 100000, CPUs=1, timeout=5):
+def hybrid(G : PCFG, DFS_depth = 3, width = 20, batch_size = 100000, CPUs=1, timeout=5, alpha=0.5, stats=None, dsl=None, examples=None):
     '''
-    A generator that enumerates all programs using a hybrid BFS + SQRT sampling.
+    A generator that enumerates all programs using a hybrid BFS + G^alpha sampling
+    (alpha = 0.5 is the SQRT sampling).
+    G can be either a PCFG or a CompiledPCFG.
+    stats: a SearchStats updated during the search, or None (only without parallelism)
+    With CPUs > 1 the workers check the programs on the examples (pairs (input, output)) with dsl
+    for timeout seconds, and only the programs correct on all of them are output
     '''
 
-    SQRT = sqrt_PCFG(G)
+    G = compile_pcfg(G)
+    # SQRT shares the non-terminal ids of G
+    SQRT = power_pcfg(G, alpha)
+    rules, weight, arguments, _ = G.python_tables()
+    log_probability = G.log_probability
 
     frontier = []
-    initial_non_terminals = deque()
-    initial_non_terminals.append(G.start)
-    frontier.append((None, initial_non_terminals, 1))
+    frontier.append((None, (G.start, None), 0 if log_probability else 1))
     # A frontier is a list of triples (partial_program, non_terminals, probability) 
     # describing a partial program:
     # partial_program is the list of primitives and variables describing the leftmost derivation, and
-    # non_terminals is the queue of non-terminals appearing from left to right
-    # probability is the probability
+    # non_terminals is the stack of ids of the non-terminals appearing from left to right,
+    # as a cons list (S, rest) starting with the rightmost one, or None: siblings share their stacks
+    # probability is the probability (or log-probability)
 
-    for d in range(DFS_depth):
+    for depth in range(DFS_depth):
         new_frontier = []
         while True:
             try:
                 (partial_program, non_terminals, probability) = frontier.pop()
-                if len(non_terminals) > 0: 
-                    S = non_terminals.pop()
-                    for F, args_F, w in G.rules[S][:width]:
-                        new_partial_program = (F, partial_program)
-                        new_non_terminals = non_terminals.copy()
-                        for arg in args_F:
-                            new_non_terminals.append(arg)
-                        new_probability = probability * w
+                if non_terminals is not None:
+                    S, non_terminals = non_terminals
+                    # the derivations are sorted by non-decreasing probability
+                    for d in rules[S][-width:]:
+                        new_partial_program = (G.derivations[d], partial_program)
+                        new_non_terminals = non_terminals
+                        for arg in arguments[d]:
+                            new_non_terminals = (arg, new_non_terminals)
+                        if log_probability:
+                            new_probability = probability + weight[d]
+                        else:
+                            new_probability = probability * weight[d]
                         new_frontier.append((new_partial_program, new_non_terminals, new_probability))
             except IndexError:
                 frontier = new_frontier
@@ -44,12 +59,12 @@ def hybrid(G : PCFG, DFS_depth = 3, width = 20, batch_size = 100000, CPUs=1, tim
     list_programs = []
     # set_non_terminals = set()
     for (partial_program, non_terminals, probability) in frontier:
-        program_as_list = []
-        list_from_compressed(partial_program, program_as_list)
+        if log_probability:
+            probability = exp(probability)
         weight = int(batch_size * probability)
         # print("the weight for {} is {}".format(program_as_list, weight))
         for i in range(weight):
-            list_programs.append((program_as_list, non_terminals, probability))
+            list_programs.append((partial_program, non_terminals, probability))
         # if weight > 0:
         #     for S in non_terminals:
         #         set_non_terminals.add(S)
@@ -57,37 +72,86 @@ def hybrid(G : PCFG, DFS_depth = 3, width = 20, batch_size = 100000, CPUs=1, tim
     # print("We now have a list of {} programs with repetitions using a total of {} non-terminals".format(len(list_programs), len(set_non_terminals)))
 
     if CPUs == 1: # no parallelism
-        while True:
-            # Idea: do we want to re-use sampled programs in non-terminals where they fit?
-            for (partial_program, non_terminals, probability) in list_programs:
-                new_program = partial_program.copy()
-                for S in non_terminals:
-                    new_program += SQRT.sample_program(S)
-                yield new_program
+        sample_batch = SQRT.sample_batch if stats is None else stats.timed("sample", SQRT.sample_batch)
+        if stats is not None:
+            stats.gauge("frontier_size", lambda: len(list_programs))
+        for new_program in complete(list_programs, sample_batch):
+            if stats is not None:
+                stats.output()
+            yield new_program
 
     else:
-        # TODO: workers need to have the timeout properly set
-        # TODO: workers need to check whether the sampled program is correct;
-        #       otherwise, you end up with way too much communication between processes
+        if dsl is None or examples is None:
+            raise ValueError("the workers of hybrid need dsl and examples to check the programs")
+        # each worker completes a share of the list for timeout seconds
+        # and sends only the solutions to the master
+        target_type = G.non_terminals[G.start][0]
         yield from parallel_workers(CPUs,
-                                    [(lp,timeout) for lp in list_programs],
+                                    [(list_programs[k::CPUs], SQRT, dsl, examples, target_type, timeout) for k in range(CPUs)],
                                     parallel_callback)
 
-def parallel_callback(list_program, timeout):
-    start_time = time.time()
-    
-    (partial_program, non_terminals, probability) = list_program
-    while time.time() < time.time() + timeout:
-        new_program = partial_program.copy()
-        for S in non_terminals:
-            new_program += SQRT.sample_program(S)
+def complete(list_programs, sample_batch):
+    '''
+    A generator that completes the partial programs of list_programs in rounds,
+    a round completing each of them once:
+    the programs of a round are drawn with one batch for each non-terminal
+    '''
+    if not list_programs:
+        return
+    # the number of programs sampled from each non-terminal in a round
+    count = {}
+    for (_, non_terminals, _) in list_programs:
+        stack = non_terminals
+        while stack is not None:
+            S, stack = stack
+            count[S] = count.get(S, 0) + 1
+
+    while True:
+        # Idea: do we want to re-use sampled programs in non-terminals where they fit?
+        samples = {S: iter(sample_batch(n, S)) for S, n in count.items()}
+        for (partial_program, non_terminals, probability) in list_programs:
+            # as in dfs, the last non-terminal is derived first
+            new_program = partial_program
+            stack = non_terminals
+            while stack is not None:
+                S, stack = stack
+                new_program = compress(next(samples[S]), new_program)
             yield new_program
 
-def list_from_compressed(program, program_as_list = []):
-    (F, sub_program) = program
-    if sub_program:
-        list_from_compressed(sub_program, program_as_list)
-    program_as_list.append(F)
+def parallel_callback(job):
+    '''
+    Completes the partial programs of the job until its deadline
+    and yields the ones which are correct on the examples
+    '''
+    (list_programs, SQRT, dsl, examples, target_type, timeout) = job
+    deadline = time.monotonic() + timeout
+    # the sampled programs are hash-consed, the programs sampled again are not evaluated again
+    cache = EvaluationCache(max_entries=1_000_000)
+    for new_program in complete(list_programs, SQRT.sample_batch):
+        if time.monotonic() > deadline:
+            return
+        program = reconstruct_from_compressed(new_program, target_type)
+        correct = True
+        i = 0
+        while correct and i < len(examples):
+            input_, output = examples[i]
+            correct = program.eval(dsl, input_, i, cache) == output
+            i += 1
+        if correct:
+            yield new_program
+
+def compress(program, partial_program):
+    '''
+    Adds the derivations of program to the partial program, in the order of dfs:
+    the outputs of hybrid are partial programs without non-terminals,
+    to be given to reconstruct_from_compressed
+    '''
+    if isinstance(program, Function):
+        partial_program = (program.function, partial_program)
+        for argument in reversed(program.arguments):
+            partial_program = compress(argument, partial_program)
+        return partial_program
+    return (program, partial_program)
 
 
 
@@ -1,6 +1,7 @@
 """template for having K parallel workers that periodically push results to a master thread"""
 import numpy as np
 import subprocess
+import traceback
 from multiprocessing import Queue, Process
 
 PARALLELPROCESSDATA = None
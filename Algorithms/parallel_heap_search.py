@@ -0,0 +1,399 @@
+import heapq
+import logging
+import multiprocessing
+import time
+from math import log
+from queue import Empty
+
+import numpy as np
+
+from pcfg import PCFG
+from program import Function
+from compiled_pcfg import CompiledPCFG, SharedPCFG, compile_pcfg
+from evaluation_cache import EvaluationCache
+from search_stats import SearchStats
+from Algorithms.heap_search import heap_search_object
+
+# Parallel heap search: the programs of the PCFG are partitioned by prefixes of their
+# derivations, the prefixes are distributed over the workers, and each worker enumerates
+# the sub-PCFG of its prefixes by heap search and checks the programs on the examples.
+# Workers only send back progress counters and solutions.
+# Workers are forked: they inherit the DSL, whose semantics cannot be pickled.
+# The compiled PCFG is published once in shared memory (see SharedPCFG): each worker
+# attaches to it and restricts it to its prefixes with sub_compiled_pcfg.
+# The search ends at a wall-clock deadline shared by the master and the workers:
+# the workers check it, and whether another one found a solution, every CHECK_EVERY programs.
+
+CHECK_EVERY = 100
+# seconds the master waits after the deadline for the workers to report before terminating them
+GRACE_PERIOD = 5
+
+
+def split_pcfg(G: PCFG, split_depth=2):
+    """
+    Returns a list of prefixes partitioning the programs generated by G:
+    split_depth=1: one prefix (P,) for each derivation S -> P from the start S
+    split_depth=2: one prefix (P, P1) for each derivation S -> P(S1, ...) from the start
+    and each derivation S1 -> P1 of its first argument, and (P,) if P has no arguments
+    """
+    prefixes = []
+    for P in G.rules[G.start]:
+        args_P, _ = G.rules[G.start][P]
+        if split_depth == 1 or len(args_P) == 0:
+            prefixes.append((P,))
+        else:
+            for P1 in G.rules[args_P[0]]:
+                prefixes.append((P, P1))
+    return prefixes
+
+
+def prefix_probability(G: PCFG, prefix):
+    """
+    the probability of the programs starting with prefix
+    """
+    P = prefix[0]
+    args_P, probability = G.rules[G.start][P]
+    if len(prefix) > 1:
+        probability *= G.rules[args_P[0]][prefix[1]][1]
+    return probability
+
+
+def sub_pcfg(G: PCFG, prefixes):
+    """
+    Returns the PCFG generating the programs of G starting with one of the prefixes,
+    with the same probabilities as in G
+    """
+    first_arguments = first_arguments_of(prefixes)
+
+    # the first argument of P is derived from a copy of S1 restricted to first_arguments[P];
+    # non-terminals are triples (type, context, depth) and the type is kept
+    start_rules = {}
+    copies = {}
+    for P in G.rules[G.start]:
+        if P in first_arguments:
+            args_P, w = G.rules[G.start][P]
+            args_P = list(args_P)
+            if first_arguments[P] is not None:
+                S1 = args_P[0]
+                args_P[0] = S1 + ("prefix", P)
+                copies.setdefault(S1, []).append((args_P[0], first_arguments[P]))
+            start_rules[P] = (args_P, w)
+
+    # the rules are listed from the root to the leaves, as expected by PCFG:
+    # the copies of S1 are inserted before S1
+    rules = {}
+    for S in G.rules:
+        for copy_S1, derivations in copies.get(S, []):
+            rules[copy_S1] = {P1: G.rules[S][P1] for P1 in G.rules[S] if P1 in derivations}
+        rules[S] = dict(G.rules[S])
+    rules[G.start] = start_rules
+
+    # the weights of the restricted non-terminals are not normalised,
+    # so that the probabilities are those in G
+    return PCFG(
+        start=G.start,
+        rules=rules,
+        max_program_depth=G.max_program_depth,
+        log_probability=G.log_probability,
+        normalise=False,
+    )
+
+
+def sub_compiled_pcfg(G: CompiledPCFG, prefixes):
+    """
+    The same as sub_pcfg for a CompiledPCFG, built from its arrays: returns the CompiledPCFG
+    generating the programs of G starting with one of the prefixes, with the same probabilities
+    The most probable programs are only recomputed for the start and the copies of the
+    non-terminals, and the non-terminals of G which are no longer reachable are kept.
+    """
+    first_arguments = first_arguments_of(prefixes)
+
+    # copies[s1] is the list of (P, derivations of the copy of s1 for P)
+    start_derivations = []
+    copies = {}
+    for d in G.rules_of(G.start):
+        P = G.derivations[d]
+        if P in first_arguments:
+            start_derivations.append(d)
+            if first_arguments[P] is not None:
+                s1 = G.arguments_of(d)[0]
+                derivations = [d1 for d1 in G.rules_of(s1) if G.derivations[d1] in first_arguments[P]]
+                copies.setdefault(s1, []).append((P, derivations))
+
+    # the non-terminals as (non-terminal of G, P) for the copy for P or (non-terminal of G, None),
+    # the copies of s1 being inserted before s1 as in sub_pcfg
+    sources = []
+    for s in range(G.number_of_non_terminals()):
+        sources.extend((s, P) for P, _ in copies.get(s, []))
+        sources.append((s, None))
+    non_terminal_id = {source: s for s, source in enumerate(sources)}
+    copy_derivations = {(s1, P): derivations for s1 in copies for P, derivations in copies[s1]}
+
+    # entries[s] is the list of (d, args_d, max program, its probability) of the derivations from s,
+    # computed from the leaves to the root as in PCFG.compute_max_probability
+    entries = [None] * len(sources)
+    max_probability = [None] * len(sources)
+    for s in reversed(range(len(sources))):
+        s_G, P = sources[s]
+        if P is not None:
+            rules = copy_derivations[s_G, P]
+        elif s_G == G.start:
+            rules = start_derivations
+        else:
+            rules = G.rules_of(s_G)
+        entries[s] = []
+        for d in rules:
+            args_d = [non_terminal_id[arg, None] for arg in G.arguments_of(d)]
+            program = G.max_programs[d]
+            if G.log_probability:
+                probability = G.max_log_probability_derivation[d]
+            else:
+                probability = G.max_probability_derivation[d]
+            if s_G == G.start and P is None and first_arguments[G.derivations[d]] is not None:
+                # the first argument is derived from the copy
+                args_d[0] = non_terminal_id[G.arguments_of(d)[0], G.derivations[d]]
+                copy_program = max(entries[args_d[0]], key=lambda entry: entry[3])[2]
+                program = Function(
+                    G.derivations[d],
+                    [copy_program] + list(program.arguments[1:]),
+                    type_=G.non_terminals[s_G][0],
+                )
+                if G.log_probability:
+                    probability = log(G.weight[d])
+                    for arg in args_d:
+                        probability += max_probability[arg]
+                else:
+                    probability = G.weight[d]
+                    for arg in args_d:
+                        probability *= max_probability[arg]
+            entries[s].append((d, args_d, program, probability))
+        max_probability[s] = max(entry[3] for entry in entries[s])
+
+    derivations = []
+    max_programs = []
+    first_derivation = [0]
+    lhs = []
+    derivation_of = []
+    first_child = [0]
+    children = []
+    max_probability_derivation = []
+    for s in range(len(sources)):
+        for d, args_d, program, probability in entries[s]:
+            derivations.append(G.derivations[d])
+            max_programs.append(program)
+            lhs.append(s)
+            derivation_of.append(d)
+            children.extend(args_d)
+            first_child.append(len(children))
+            max_probability_derivation.append(probability)
+        first_derivation.append(len(derivations))
+
+    sub_G = CompiledPCFG.__new__(CompiledPCFG)
+    sub_G.hash = hash((G.hash, tuple(prefixes)))
+    sub_G.max_program_depth = G.max_program_depth
+    sub_G.log_probability = G.log_probability
+    sub_G.non_terminals = [
+        G.non_terminals[s_G] if P is None else G.non_terminals[s_G] + ("prefix", P)
+        for s_G, P in sources
+    ]
+    sub_G.non_terminal_id = {S: s for s, S in enumerate(sub_G.non_terminals)}
+    sub_G.start = non_terminal_id[G.start, None]
+    sub_G.derivations = derivations
+    sub_G.max_programs = max_programs
+    sub_G.first_derivation = np.array(first_derivation, dtype=np.int32)
+    sub_G.lhs = np.array(lhs, dtype=np.int32)
+    sub_G.weight = G.weight[derivation_of]
+    sub_G.log_weight = G.log_weight[derivation_of]
+    sub_G.arity = G.arity[derivation_of]
+    sub_G.first_child = np.array(first_child, dtype=np.int32)
+    sub_G.children = np.array(children, dtype=np.int32)
+    max_probability_derivation = np.array(max_probability_derivation, dtype=np.float64)
+    max_probability = np.array(max_probability, dtype=np.float64)
+    if G.log_probability:
+        sub_G.max_log_probability_derivation = max_probability_derivation
+        sub_G.max_log_probability = max_probability
+        sub_G.max_probability_derivation = np.exp(max_probability_derivation)
+        sub_G.max_probability = np.exp(max_probability)
+    else:
+        sub_G.max_probability_derivation = max_probability_derivation
+        sub_G.max_probability = max_probability
+        with np.errstate(divide="ignore"):
+            sub_G.max_log_probability_derivation = np.log(max_probability_derivation)
+            sub_G.max_log_probability = np.log(max_probability)
+    sub_G.tables = None
+    sub_G.alias = None
+    return sub_G
+
+
+def first_arguments_of(prefixes):
+    """
+    Returns the dictionary mapping P to the set of P1 such that (P, P1) is a prefix,
+    or to None if (P,) is a prefix
+    """
+    first_arguments = {}
+    for prefix in prefixes:
+        if len(prefix) == 1:
+            first_arguments[prefix[0]] = None
+        else:
+            first_arguments.setdefault(prefix[0], set()).add(prefix[1])
+    return first_arguments
+
+
+def assign_prefixes(G: PCFG, prefixes, CPUs):
+    """
+    Distributes the prefixes over CPUs workers balancing their probabilities,
+    assigning greedily the most probable remaining prefix to the least loaded worker
+    """
+    loads = [(0, k) for k in range(CPUs)]
+    assignment = [[] for _ in range(CPUs)]
+    for prefix in sorted(prefixes, key=lambda prefix: -prefix_probability(G, prefix)):
+        load, k = heapq.heappop(loads)
+        assignment[k].append(prefix)
+        heapq.heappush(loads, (load + prefix_probability(G, prefix), k))
+    return [prefixes for prefixes in assignment if len(prefixes) > 0]
+
+
+def worker(
+    k,
+    G,
+    prefixes,
+    dsl,
+    examples,
+    queue,
+    stop,
+    deadline,
+    total_number_programs,
+    report_every,
+    cache_entries,
+    stats_path,
+):
+    """
+    Enumerates the programs of G (a SharedPCFG) starting with one of the prefixes
+    in decreasing probability and checks them on the examples until the deadline (a value of time.monotonic()),
+    sending messages to queue:
+    ("progress", k, number of programs),
+    ("solution", k, program, probability, number of programs),
+    ("finished", k, number of programs)
+    If stats_path is not None, snapshots of the search are appended to it every report_every programs
+    """
+    cache = EvaluationCache(max_entries=cache_entries)
+    if stats_path is None:
+        stats = None
+    else:
+        stats = SearchStats(stats_path, snapshot_every=report_every, labels={"worker": k})
+        stats.gauge("evaluation_cache", lambda: {"hits": cache.hits, "misses": cache.misses})
+    H = heap_search_object(sub_compiled_pcfg(compile_pcfg(G), prefixes), stats=stats)
+    nb_programs = 0
+    for program in H.generator():
+        if program is None:
+            break
+        nb_programs += 1
+        correct = True
+        i = 0
+        while correct and i < len(examples):
+            input_, output = examples[i]
+            correct = program.eval(dsl, input_, i, cache) == output
+            i += 1
+        if correct:
+            probability = H.probabilities[H.start][program.id]
+            queue.put(("solution", k, program, probability, nb_programs))
+            break
+        if nb_programs % report_every == 0:
+            queue.put(("progress", k, nb_programs))
+        if nb_programs >= total_number_programs:
+            break
+        if nb_programs % CHECK_EVERY == 0 and (stop.is_set() or time.monotonic() > deadline):
+            break
+    if stats is not None:
+        stats.write_snapshot()
+    queue.put(("finished", k, nb_programs))
+
+
+def parallel_heap_search(
+    G: PCFG,
+    dsl,
+    examples,
+    CPUs=multiprocessing.cpu_count(),
+    split_depth=2,
+    timeout=100,
+    total_number_programs=1_000_000,
+    report_every=10_000,
+    cache_entries=1_000_000,
+    stats_path=None,
+):
+    """
+    Runs heap search on CPUs processes until a program correct on the examples is found,
+    for at most timeout seconds, each process enumerating at most total_number_programs programs
+
+    Returns (program, probability, nb_programs) where program is the first solution found
+    (not necessarily the most probable one) or None, and nb_programs the number of programs
+    checked by all workers
+    stats_path: a JSONL file where the workers append snapshots of their search, see SearchStats
+    """
+    deadline = time.monotonic() + timeout
+    prefixes = split_pcfg(G, split_depth)
+    assignment = assign_prefixes(G, prefixes, CPUs)
+    logging.debug(
+        "{} prefixes distributed over {} workers".format(len(prefixes), len(assignment))
+    )
+
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    stop = context.Event()
+    shared_G = SharedPCFG(G)
+    workers = []
+    try:
+        workers += [
+            context.Process(
+                target=worker,
+                args=(
+                    k,
+                    shared_G,
+                    prefixes_k,
+                    dsl,
+                    examples,
+                    queue,
+                    stop,
+                    deadline,
+                    total_number_programs,
+                    report_every,
+                    cache_entries,
+                    stats_path,
+                ),
+            )
+            for k, prefixes_k in enumerate(assignment)
+        ]
+        for process in workers:
+            process.start()
+
+        solution, probability = None, None
+        nb_programs = [0] * len(workers)
+        number_of_active_workers = len(workers)
+        while number_of_active_workers > 0:
+            try:
+                message = queue.get(timeout=max(deadline - time.monotonic(), 0) + GRACE_PERIOD)
+            except Empty:
+                break  # the workers did not stop at the deadline
+            if message[0] == "finished":
+                _, k, nb_programs[k] = message
+                number_of_active_workers -= 1
+            elif message[0] == "progress":
+                _, k, nb_programs[k] = message
+                logging.debug("tested {} programs".format(sum(nb_programs)))
+            elif message[0] == "solution":
+                _, k, program, probability_program, nb_programs[k] = message
+                if solution is None:
+                    solution, probability = program, probability_program
+                    stop.set()
+    finally:
+        # also reached when the master is interrupted: the workers and the shared memory
+        # would otherwise outlive it
+        stop.set()
+        for process in workers:
+            if process.pid is None:
+                continue  # not started
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        shared_G.unlink()
+    return solution, probability, sum(nb_programs)
@@ -0,0 +1,105 @@
+import copy
+from collections import OrderedDict
+
+import numpy as np
+
+from compiled_pcfg import CompiledPCFG, compile_pcfg
+
+# Sampling from G^alpha: the distribution giving each program P a probability
+# proportional to G(P)^alpha, alpha = 0.5 is the sqrt sampling.
+# G^alpha is again a PCFG with the same rules: the derivation d from s has weight
+# w(d)^alpha * prod_{c argument of d} Z(c) / Z(s)
+# where Z(s) = sum_{P generated from s} G(P)^alpha is the partition function of s.
+
+# the power PCFGs already computed, indexed by (hash of the grammar, alpha)
+power_pcfgs = OrderedDict()
+cache_size = 128
+
+
+def power_pcfg(G, alpha):
+    """
+    Input: a PCFG G (possibly compiled) and an exponent alpha > 0
+    Output: the CompiledPCFG G^alpha, with an attribute log_partition_function
+    mapping a non-terminal id s to log Z(s)
+
+    G^alpha shares the non-terminals, derivations and arguments of the compilation of G
+    (the derivations of s are ordered as in G, not by their weight in G^alpha).
+    Its most probable programs are those of G: G^alpha(P) = G(P)^alpha / Z(s).
+    """
+    key = (G.hash, alpha)
+    if key in power_pcfgs:
+        power_pcfgs.move_to_end(key)
+        return power_pcfgs[key]
+
+    G = compile_pcfg(G)
+    log_Z, log_weight = log_partition_function_and_weights(G, alpha)
+
+    power_G = copy.copy(G)
+    power_G.hash = hash(key)
+    power_G.log_partition_function = log_Z
+    power_G.log_weight = log_weight
+    power_G.weight = np.exp(log_weight)
+    power_G.max_log_probability_derivation = (
+        alpha * G.max_log_probability_derivation - log_Z[G.lhs]
+    )
+    power_G.max_log_probability = alpha * G.max_log_probability - log_Z
+    power_G.max_probability_derivation = np.exp(power_G.max_log_probability_derivation)
+    power_G.max_probability = np.exp(power_G.max_log_probability)
+    power_G.tables = None
+    power_G.alias = None
+
+    power_pcfgs[key] = power_G
+    if len(power_pcfgs) > cache_size:
+        power_pcfgs.popitem(last=False)
+    return power_G
+
+
+def log_partition_function_and_weights(G: CompiledPCFG, alpha):
+    """
+    Returns (log_Z, log_weight): the arrays mapping a non-terminal id s to log Z(s)
+    and a derivation id d to its log-weight in G^alpha
+
+    The computation is done in log-space for all non-terminals at once:
+    each pass recomputes log Z(s) from the values of the previous pass for its arguments,
+    after k passes the values are exact for the non-terminals which derive programs
+    of depth at most k, so the values are fixed after max_program_depth + 1 passes.
+    """
+    owner = np.repeat(np.arange(len(G.derivations)), G.arity)
+    segments = G.first_derivation[:-1]
+    alpha_log_weight = alpha * G.log_weight
+    log_Z = np.zeros(len(G.non_terminals))
+    for _ in range(len(G.non_terminals)):
+        # the log-weight of d times the partition functions of its arguments
+        x = alpha_log_weight + np.bincount(
+            owner, weights=log_Z[G.children], minlength=len(G.derivations)
+        )
+        m = np.maximum.reduceat(x, segments)
+        new_log_Z = m + np.log(np.add.reduceat(np.exp(x - m[G.lhs]), segments))
+        if np.array_equal(new_log_Z, log_Z):
+            break
+        log_Z = new_log_Z
+    return log_Z, x - log_Z[G.lhs]
+
+
+def log_partition_function(G, alpha):
+    """
+    the array mapping a non-terminal id s (in the compilation of G) to log Z(s)
+    """
+    return power_pcfg(G, alpha).log_partition_function
+
+
+def power_sampling(G, alpha, batch_size=10_000, stats=None):
+    """
+    A generator that samples programs according to G^alpha,
+    drawn by batches of batch_size programs
+    stats: a SearchStats updated during the search, or None
+    """
+    power_G = power_pcfg(G, alpha)
+    if stats is None:
+        while True:
+            yield from power_G.sample_batch(batch_size)
+    sample_batch = stats.timed("sample_batch", power_G.sample_batch)
+    while True:
+        batch = sample_batch(batch_size)
+        stats.output(len(batch))
+        yield from batch
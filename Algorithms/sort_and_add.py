@@ -1,33 +1,103 @@
 from pcfg import *
-from Algorithms.dfs import *
+from compiled_pcfg import compile_pcfg
 
+from collections import deque
 import logging
 
-def sort_and_add(G : PCFG, init = 5, step = 5):
+def sort_and_add(G : PCFG, init = 5, step = 5, stats = None):
     '''
-    A generator that enumerates all programs using incremental search over a DFS 
+    A generator that enumerates all programs using incremental search over a DFS:
+    the programs using only the init most probable derivations of each non-terminal,
+    then the programs using the init + step most probable ones and not only the init ones, and so on.
+    Each stage only explores the partial programs which use or can still use a derivation
+    activated at this stage, so each program is output once.
+    G can be either a PCFG or a CompiledPCFG.
+    stats: a SearchStats updated during the search, or None
     '''
-    size = init
+    G = compile_pcfg(G)
+    rules, _, _, _ = G.python_tables()
+    largest = max(len(rules_S) for rules_S in rules)
+    old_size, size = 0, init
     logging.info("Initialising with size {}".format(size))
-    G_truncated = truncate(G, size)
-    gen = dfs(G_truncated)
-    
+
     while True:
-        try:
-            yield next(gen)
-        except StopIteration:
-            size += step
-            logging.info("Increasing size to {}".format(size))
-            G_truncated = truncate(G, size)
-            gen = dfs(G_truncated)
+        yield from dfs_new_derivations(G, old_size, size, stats)
+        if size >= largest:
+            return # all derivations are active
+        old_size, size = size, size + step
+        logging.info("Increasing size to {}".format(size))
+        if stats is not None:
+            stats.count("restarts")
+
+def dfs_new_derivations(G, old_size, size, stats = None):
+    '''
+    A generator that enumerates using a DFS the programs using only the size most probable
+    derivations of each non-terminal, and at least one which is not among the old_size most probable
+    '''
+    rules, _, arguments, _ = G.python_tables()
+    derivations = G.derivations
+
+    # active[S] are the size most probable derivations of S, sorted by non-decreasing probability,
+    # the first number_new[S] of them are not among the old_size most probable
+    active = [rules_S[-size:] for rules_S in rules]
+    number_new = [max(0, min(size, len(rules_S)) - old_size) for rules_S in rules]
+
+    # reach_new[S] is 1 if S derives a program using a new derivation, 0 otherwise
+    reach_new = [None] * len(rules)
+    def compute_reach_new(S):
+        if reach_new[S] is None:
+            reach_new[S] = int(
+                number_new[S] > 0
+                or any(compute_reach_new(arg) for d in active[S] for arg in arguments[d])
+            )
+        return reach_new[S]
+    for S in range(len(rules)):
+        compute_reach_new(S)
+
+    frontier = deque()
+    frontier.append((None, (G.start, None), False, reach_new[G.start]))
+    if stats is None:
+        push, pop = frontier.append, frontier.pop
+    else:
+        push, pop = stats.timed("push", frontier.append), stats.timed("pop", frontier.pop)
+        stats.gauge("frontier_size", lambda: len(frontier))
+    # A frontier is a queue of quadruples (partial_program, non_terminals, uses_new, pending_new)
+    # describing a partial program, partial_program and non_terminals are as in dfs,
+    # uses_new is whether the partial program uses a new derivation, and
+    # pending_new is the number of non-terminals in non_terminals which derive a program using one:
+    # a partial program is explored only if uses_new or pending_new > 0
+
+    while len(frontier) != 0:
+        partial_program, non_terminals, uses_new, pending_new = pop()
+        if non_terminals is None:
+            if stats is not None:
+                stats.output()
+            yield partial_program
+        else:
+            S, non_terminals = non_terminals
+            pending_new -= reach_new[S]
+            for i, d in enumerate(active[S]):
+                new_uses_new = uses_new or i < number_new[S]
+                new_pending_new = pending_new
+                new_non_terminals = non_terminals
+                for arg in arguments[d]:
+                    new_non_terminals = (arg, new_non_terminals)
+                    new_pending_new += reach_new[arg]
+                if new_uses_new or new_pending_new > 0:
+                    new_partial_program = (derivations[d], partial_program)
+                    push((new_partial_program, new_non_terminals, new_uses_new, new_pending_new))
 
 def truncate(G: PCFG, size):
+    '''
+    the PCFG keeping the size most probable derivations of each non-terminal, renormalised
+    '''
     new_rules = {}
     for S in G.rules:
         new_rules[S] = {}
-        s = sum(G.rules[S][P][1] for P in G.list_derivations[S][:size])
-        for i, P in enumerate(G.list_derivations[S]):
-            if i < size:
-                args_P, w = G.rules[S][P]
-                new_rules[S][P] = args_P, w / s
-    return PCFG(G.start, new_rules, max_program_depth = G.max_program_depth)
+        # list_derivations[S] is sorted by non-decreasing probability
+        most_probable = G.list_derivations[S][-size:]
+        s = sum(G.rules[S][P][1] for P in most_probable)
+        for P in most_probable:
+            args_P, w = G.rules[S][P]
+            new_rules[S][P] = args_P, w / s
+    return PCFG(G.start, new_rules, max_program_depth = G.max_program_depth, log_probability = G.log_probability)
@@ -1,50 +1,157 @@
 from program import *
 from pcfg import *
+from compiled_pcfg import compile_pcfg
+from stack_machine import prefix_from_compressed
 
 from collections import deque
 from heapq import heappush, heappop
-import time 
+from math import log, inf
+import time
 
-def bounded_threshold(G : PCFG, threshold = 0.0001):
+def bounded_threshold(G : PCFG, threshold = 0.0001, stats = None, prefix = False):
     '''
     A generator that enumerates all programs with probability greater than the threshold
+    G can be either a PCFG or a CompiledPCFG.
+    If G is in log mode probabilities are added in log-space
+    and compared to the logarithm of the threshold.
+    stats: a SearchStats updated during the search, or None
+    prefix: if True the programs are output in prefix form, see stack_machine
     '''
+    G = compile_pcfg(G)
+    if G.log_probability:
+        threshold = log(threshold)
     frontier = deque()
-    initial_non_terminals = deque()
-    initial_non_terminals.append(G.start)
-    frontier.append((None, initial_non_terminals, 1))
-    # A frontier is a queue of triples (partial_program, non_terminals, probability)
+    frontier.append((None, (G.start, None), 0 if G.log_probability else 1, None))
+    return expand_above_threshold(G, frontier, threshold, None, stats, prefix)
+
+def expand_above_threshold(G, frontier, threshold, cut, stats, prefix):
+    '''
+    A generator that enumerates the programs completing the partial programs of the frontier
+    with probability greater than the threshold (a log-probability if G is in log mode).
+    If cut is not None, cut(probability, partial_program, non_terminals, number_cut) is called
+    for each partial program whose number_cut least probable derivations of its first
+    non-terminal give partial programs below the threshold.
+    '''
+    rules, weight, arguments, _ = G.python_tables()
+    log_probability = G.log_probability
+    # in prefix form partial programs are built from derivation ids
+    derivations = range(G.number_of_derivations()) if prefix else G.derivations
+
+    if stats is None:
+        push, pop = frontier.append, frontier.pop
+    else:
+        push, pop = stats.timed("push", frontier.append), stats.timed("pop", frontier.pop)
+        stats.gauge("frontier_size", lambda: len(frontier))
+    # A frontier is a queue of quadruples (partial_program, non_terminals, probability, limit)
     # describing a partial program:
     # partial_program is the list of primitives and variables describing the leftmost derivation,
-    # non_terminals is the queue of non-terminals appearing from left to right, and
-    # probability is the probability of the partial program
+    # non_terminals is the stack of ids of the non-terminals appearing from left to right,
+    # as a cons list (S, rest) starting with the rightmost one, or None: siblings share their stacks,
+    # probability is the probability (or log-probability) of the partial program, and
+    # limit is None or the number of derivations of the first non-terminal to use, the least probable ones
 
     while len(frontier) != 0:
-        partial_program, non_terminals, probability = frontier.pop()
-        if len(non_terminals) == 0: 
-            yield partial_program
+        partial_program, non_terminals, probability, limit = pop()
+        if non_terminals is None:
+            if stats is not None:
+                stats.output()
+            yield prefix_from_compressed(partial_program) if prefix else partial_program
         else:
-            S = non_terminals.pop()
-            for P in G.rules[S]:
-                args_P, w = G.rules[S][P]
-                new_probability = probability * w
-                if new_probability > threshold:
-                    new_partial_program = (P, partial_program)
-                    new_non_terminals = non_terminals.copy()
-                    for arg in args_P:
-                        new_non_terminals.append(arg)
-                    frontier.append((new_partial_program, new_non_terminals, new_probability))
-
-def threshold_search(G: PCFG, initial_threshold = 0.0001, scale_factor = 100):        
-    threshold = initial_threshold
-    # print("Initialising threshold to {}".format(threshold))
-    gen = bounded_threshold(G, threshold)
+            S, rest = non_terminals
+            rules_S = rules[S] if limit is None else rules[S][:limit]
+            # the derivations are sorted by non-decreasing probability:
+            # the first number_cut ones give partial programs below the threshold
+            number_cut = len(rules_S)
+            while number_cut > 0:
+                if log_probability:
+                    new_probability = probability + weight[rules_S[number_cut - 1]]
+                else:
+                    new_probability = probability * weight[rules_S[number_cut - 1]]
+                if new_probability <= threshold:
+                    break
+                number_cut -= 1
+            for d in rules_S[number_cut:]:
+                if log_probability:
+                    new_probability = probability + weight[d]
+                else:
+                    new_probability = probability * weight[d]
+                new_partial_program = (derivations[d], partial_program)
+                new_non_terminals = rest
+                for arg in arguments[d]:
+                    new_non_terminals = (arg, new_non_terminals)
+                push((new_partial_program, new_non_terminals, new_probability, None))
+            if number_cut > 0 and cut is not None:
+                cut(probability, partial_program, non_terminals, number_cut)
+
+def threshold_search(G: PCFG, initial_threshold = 0.0001, scale_factor = 100, stats = None, prefix = False):
+    '''
+    A generator that enumerates all programs by decreasing thresholds:
+    the programs with probability greater than initial_threshold, then those with probability
+    greater than initial_threshold / scale_factor, and so on.
+    The partial programs cut off at a threshold are kept, grouped by the first threshold
+    their cut derivations exceed, and the search resumes from them: each program is output once,
+    and thresholds without programs are skipped.
+    G can be either a PCFG or a CompiledPCFG.
+    stats: a SearchStats updated during the search, or None
+    prefix: if True the programs are output in prefix form, see stack_machine
+    '''
+    G = compile_pcfg(G)
+    rules, weight, _, _ = G.python_tables()
+    log_probability = G.log_probability
+    log_scale_factor = log(scale_factor)
+    log_threshold = log(initial_threshold)
 
+    # thresholds[k] is the k-th threshold (its logarithm if G is in log mode)
+    thresholds = [log_threshold if log_probability else initial_threshold]
+    def extend_thresholds(k):
+        while len(thresholds) <= k:
+            if log_probability:
+                thresholds.append(thresholds[-1] - log_scale_factor)
+            else:
+                thresholds.append(thresholds[-1] / scale_factor)
+
+    # waiting[k] is the list of the partial programs cut off, as frontier entries limited
+    # to their cut derivations, such that the most probable of these is greater than
+    # the k-th threshold but not the previous ones
+    waiting = {}
+    level = 0
+
+    def cut(probability, partial_program, non_terminals, number_cut):
+        d = rules[non_terminals[0]][number_cut - 1]
+        if log_probability:
+            max_probability = probability + weight[d]
+            log_max_probability = max_probability
+        elif probability * weight[d] > 0:
+            max_probability = probability * weight[d]
+            log_max_probability = log(max_probability)
+        else:
+            return # never above a threshold
+        if log_max_probability == -inf:
+            return
+        # estimate of the first threshold below max_probability, then corrected
+        k = int((log_threshold - log_max_probability) / log_scale_factor) + 1
+        if k <= level:
+            k = level + 1
+        extend_thresholds(k + 1)
+        while k > level + 1 and max_probability > thresholds[k - 1]:
+            k -= 1
+        while max_probability <= thresholds[k]:
+            k += 1
+            extend_thresholds(k)
+        if k not in waiting:
+            waiting[k] = []
+        waiting[k].append((partial_program, non_terminals, probability, number_cut))
+
+    if stats is not None:
+        stats.gauge("waiting", lambda: sum(len(cut_k) for cut_k in waiting.values()))
+
+    frontier = deque()
+    frontier.append((None, (G.start, None), 0 if log_probability else 1, None))
     while True:
-        try:
-            yield next(gen)
-        except StopIteration:
-            threshold /= scale_factor
-            # print("Decreasing threshold to {}".format(threshold))
-            gen = bounded_threshold(G, threshold)
-    
+        yield from expand_above_threshold(G, frontier, thresholds[level], cut, stats, prefix)
+        if len(waiting) == 0:
+            return # all programs have been output
+        level = min(waiting)
+        if stats is not None:
+            stats.count("thresholds")
+        frontier.extend(waiting.pop(level))
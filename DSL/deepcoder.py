@@ -1,5 +1,8 @@
 from type_system import *
 from program import *
+from vectorised_eval import IntBatch, ListBatch, NotVectorisable, BOUND
+
+import numpy as np
 
 t0 = PolymorphicType('t0')
 t1 = PolymorphicType('t1')
@@ -134,3 +137,126 @@ no_repetitions = {
 	'SCANL1[MIN]',
 	'SCANL1[MAX]',
 	}
+
+# Vectorised semantics: evaluates the primitives on all the examples of a task at once,
+# on the batches defined in vectorised_eval.py.
+# It follows semantics exactly, including its quirks (COUNT[>0] and FILTER[>0] select
+# negative numbers, ZIPWITH[MIN] returns its second list).
+# TAKE, DROP and ACCESS are not curried in semantics, so Program.eval applies them
+# to a single argument and gets None: they are left out, and programs using them
+# are evaluated by Program.eval.
+
+def mask(l):
+	return np.arange(l.values.shape[1]) < l.lengths[:, None]
+
+def list_batch(values, lengths, defined):
+	# restores the invariant that the padding is 0
+	values = np.where(np.arange(values.shape[1]) < lengths[:, None], values, 0)
+	return ListBatch(values, lengths, defined)
+
+def v_head(l):
+	return IntBatch(l.values[:, 0], l.defined & (l.lengths > 0))
+
+def v_last(l):
+	last = np.maximum(l.lengths - 1, 0)
+	return IntBatch(l.values[np.arange(len(last)), last], l.defined & (l.lengths > 0))
+
+def v_reduce(ufunc, neutral):
+	def aux(l):
+		non_empty = l.lengths > 0
+		values = ufunc.reduce(np.where(mask(l), l.values, neutral), axis=1)
+		return IntBatch(np.where(non_empty, values, 0), l.defined & non_empty)
+	return aux
+
+def v_count(predicate):
+	return lambda l: IntBatch(np.sum(mask(l) & predicate(l.values), axis=1), l.defined)
+
+def v_sum(l):
+	return IntBatch(np.sum(l.values, axis=1), l.defined)
+
+def v_sort(l):
+	values = np.sort(np.where(mask(l), l.values, np.iinfo(np.int64).max), axis=1)
+	return list_batch(values, l.lengths, l.defined)
+
+def v_reverse(l):
+	positions = np.maximum(l.lengths[:, None] - 1 - np.arange(l.values.shape[1]), 0)
+	return list_batch(np.take_along_axis(l.values, positions, axis=1), l.lengths, l.defined)
+
+def v_filter(predicate):
+	def aux(l):
+		keep = mask(l) & predicate(l.values)
+		# stable sort moving the kept elements to the front, in order
+		positions = np.argsort(~keep, axis=1, kind='stable')
+		values = np.take_along_axis(l.values, positions, axis=1)
+		return list_batch(values, np.sum(keep, axis=1), l.defined)
+	return aux
+
+def v_map(f):
+	return lambda l: list_batch(f(l.values), l.lengths, l.defined)
+
+def v_zipwith(f):
+	def aux(l1, l2):
+		width = min(l1.values.shape[1], l2.values.shape[1])
+		values = f(l1.values[:, :width], l2.values[:, :width])
+		return list_batch(values, np.minimum(l1.lengths, l2.lengths), l1.defined & l2.defined)
+	return aux
+
+def v_scanl_ufunc(ufunc):
+	return lambda l: list_batch(ufunc.accumulate(l.values, axis=1), l.lengths, l.defined)
+
+def v_scanl_product(l):
+	# products can overflow int64 before the bound is checked:
+	# the floating point scan detects it
+	if np.any(np.abs(np.cumprod(np.where(mask(l), l.values, 1).astype(np.float64), axis=1)) > BOUND):
+		raise NotVectorisable('SCANL1[*]')
+	return list_batch(np.cumprod(l.values, axis=1), l.lengths, l.defined)
+
+def v_scanl_minus(l):
+	# y[0] = l[0] and y[k] = l[k] - y[k-1]
+	values = l.values.copy()
+	for k in range(1, values.shape[1]):
+		values[:, k] -= values[:, k - 1]
+	return list_batch(values, l.lengths, l.defined)
+
+def truncated_division(n):
+	return lambda x: np.sign(x) * (np.abs(x) // n)
+
+vectorised_semantics = {
+	'HEAD': (1, v_head),
+	'LAST': (1, v_last),
+	'MINIMUM': (1, v_reduce(np.minimum, np.iinfo(np.int64).max)),
+	'MAXIMUM': (1, v_reduce(np.maximum, np.iinfo(np.int64).min)),
+	'LENGTH': (1, lambda l: IntBatch(l.lengths, l.defined)),
+	'COUNT[<0]': (1, v_count(lambda x: x < 0)),
+	'COUNT[>0]': (1, v_count(lambda x: x < 0)),
+	'COUNT[%2==0]': (1, v_count(lambda x: x % 2 == 0)),
+	'COUNT[%2==1]': (1, v_count(lambda x: x % 2 == 1)),
+	'SUM': (1, v_sum),
+
+	'SORT': (1, v_sort),
+	'REVERSE': (1, v_reverse),
+	'FILTER[<0]': (1, v_filter(lambda x: x < 0)),
+	'FILTER[>0]': (1, v_filter(lambda x: x < 0)),
+	'FILTER[%2==0]': (1, v_filter(lambda x: x % 2 == 0)),
+	'FILTER[%2==1]': (1, v_filter(lambda x: x % 2 == 1)),
+	'MAP[+1]': (1, v_map(lambda x: x + 1)),
+	'MAP[-1]': (1, v_map(lambda x: x - 1)),
+	'MAP[*2]': (1, v_map(lambda x: x * 2)),
+	'MAP[/2]': (1, v_map(truncated_division(2))),
+	'MAP[*3]': (1, v_map(lambda x: x * 3)),
+	'MAP[/3]': (1, v_map(truncated_division(3))),
+	'MAP[*4]': (1, v_map(lambda x: x * 4)),
+	'MAP[/4]': (1, v_map(truncated_division(4))),
+	'MAP[**2]': (1, v_map(lambda x: x ** 2)),
+	'MAP[*(-1)]': (1, v_map(lambda x: -x)),
+	'ZIPWITH[+]': (2, v_zipwith(lambda x, y: x + y)),
+	'ZIPWITH[-]': (2, v_zipwith(lambda x, y: x - y)),
+	'ZIPWITH[*]': (2, v_zipwith(lambda x, y: x * y)),
+	'ZIPWITH[MAX]': (2, v_zipwith(np.maximum)),
+	'ZIPWITH[MIN]': (2, v_zipwith(lambda x, y: y)),
+	'SCANL1[+]': (1, v_scanl_ufunc(np.add)),
+	'SCANL1[-]': (1, v_scanl_minus),
+	'SCANL1[*]': (1, v_scanl_product),
+	'SCANL1[MIN]': (1, v_scanl_ufunc(np.minimum)),
+	'SCANL1[MAX]': (1, v_scanl_ufunc(np.maximum)),
+}
@@ -0,0 +1,420 @@
+from type_system import *
+from program import *
+from pcfg import *
+from dsl import *
+from legacy_pickle import load_legacy_task
+from search_stats import SearchStats
+from stack_machine import StackMachine, program_from_prefix
+from compiled_program import compile_program
+
+import DSL.deepcoder as deepcoder
+import DSL.list as list_dsl
+import DSL.circuits as circuits
+
+# Import algorithms
+from Algorithms.heap_search import heap_search
+from Algorithms.heap_search_naive import heap_search_naive
+from Algorithms.a_star import a_star
+from Algorithms.threshold_search import threshold_search
+from Algorithms.dfs import dfs
+from Algorithms.bfs import bfs
+from Algorithms.sort_and_add import sort_and_add
+from Algorithms.sqrt_sampling import sqrt_sampling
+from Algorithms.hybrid import hybrid
+from Algorithms.parallel_heap_search import parallel_heap_search
+
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Benchmark of the enumeration algorithms, with results written as JSON:
+# * syntactic runs enumerate the programs of a grammar preset and record the number
+# of programs per second and the cumulative probability of the programs over time
+# * semantic runs search for a solution of the tasks tmp/list_*.pickle
+# and record the time to solution
+# * parallel runs enumerate the programs of a grammar preset with parallel heap search
+# on a number of workers, checking them on examples that no program satisfies,
+# and record the number of programs per second of all workers
+# Each run is a separate process, so that its peak resident memory is its own.
+#
+# python benchmark.py --presets deepcoder --algorithms heap_search a_star --output new.json
+# python benchmark.py --tasks 0 20 --output new.json --baseline old.json
+# python benchmark.py --presets list --stats stats.jsonl
+# python benchmark.py --algorithms --parallel 1 2 4 8 16 32 64
+# the comparison with a baseline exits with status 1 if a metric regressed by more
+# than the tolerance.
+# With --stats, snapshots of the searches (see SearchStats) are appended to a JSONL file.
+
+# name: (type request, function building the DSL), the PCFGs are random with the seed
+# (DSL/flashfill.py does not parse, so it has no preset)
+PRESETS = {
+    "deepcoder": (
+        Arrow(List(INT), List(INT)),
+        lambda: DSL(deepcoder.semantics, deepcoder.primitive_types),
+    ),
+    "list": (
+        Arrow(List(INT), List(INT)),
+        lambda: DSL(list_dsl.semantics, list_dsl.primitive_types),
+    ),
+    "circuits": (
+        Arrow(BOOL, Arrow(BOOL, BOOL)),
+        lambda: DSL(circuits.semantics, circuits.primitive_types),
+    ),
+}
+
+# name: (algorithm, parameters)
+ALGORITHMS = {
+    "heap_search": (heap_search, {}),
+    "heap_search_naive": (heap_search_naive, {}),
+    "a_star": (a_star, {}),
+    "threshold_search": (threshold_search, {"initial_threshold": 0.0001, "scale_factor": 10}),
+    "dfs": (dfs, {}),
+    "bfs": (bfs, {"beam_width": 50000}),
+    "sort_and_add": (sort_and_add, {}),
+    "sqrt_sampling": (sqrt_sampling, {}),
+    "hybrid": (hybrid, {}),
+}
+
+# Set of algorithms where we need to reconstruct the programs
+reconstruct = {dfs, bfs, threshold_search, a_star, sort_and_add, hybrid}
+# Set of algorithms which output programs in prefix form (see stack_machine),
+# evaluated in semantic runs by a StackMachine without building the programs
+prefix_form = {dfs, bfs, threshold_search, a_star}
+
+# metric: True if higher is better
+METRICS = {
+    "programs_per_second": True,
+    "peak_rss_kb": False,
+    "time_to_solution": False,
+}
+
+
+def make_pcfg(preset, seed):
+    type_request, make_dsl = PRESETS[preset]
+    random.seed(seed)
+    np.random.seed(seed)
+    dsl = make_dsl()
+    return dsl, dsl.DSL_to_Random_PCFG(type_request, alpha=0.7)
+
+
+def programs(pcfg, algorithm_name, stats=None):
+    """
+    A generator of the programs output by the algorithm, reconstructed if needed,
+    which stops when the algorithm has no more programs
+    """
+    algorithm, param = ALGORITHMS[algorithm_name]
+    target_type = pcfg.start[0]
+    if stats is None:
+        reconstruct_program = reconstruct_from_compressed
+    else:
+        reconstruct_program = stats.timed("reconstruct_from_compressed", reconstruct_from_compressed)
+    for program in algorithm(pcfg, stats=stats, **param):
+        if program is None:
+            return
+        if algorithm in reconstruct:
+            program = reconstruct_program(program, target_type)
+        yield program
+
+
+def make_stats(stats_path, **labels):
+    if stats_path is None:
+        return None
+    return SearchStats(stats_path, labels=labels)
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def syntactic_run(preset, algorithm_name, seed, timeout, total_number_programs, stats_path=None):
+    """
+    Enumerates the programs of the preset, returns the metrics of the run
+    cumulative_probability: a list of [time, number of programs, cumulative probability]
+    recorded each time the number of programs doubles, and at the end
+    Programs output several times (by sampling algorithms) are counted once in the probability
+    """
+    _, pcfg = make_pcfg(preset, seed)
+    stats = make_stats(stats_path, preset=preset, algorithm=algorithm_name)
+    rss_before = peak_rss_kb()
+    # programs are hash-consed: ids identify them as long as they are kept alive
+    seen = {}
+    nb_programs = 0
+    cumulative_probability = 0
+    curve = []
+    chrono = -time.perf_counter()
+    gen = programs(pcfg, algorithm_name, stats)
+    while chrono + time.perf_counter() < timeout and nb_programs < total_number_programs:
+        program = next(gen, None)
+        if program is None:
+            break
+        nb_programs += 1
+        if program.id not in seen:
+            seen[program.id] = program
+            cumulative_probability += pcfg.probability_program(pcfg.start, program)
+        if nb_programs & (nb_programs - 1) == 0:
+            curve.append([chrono + time.perf_counter(), nb_programs, cumulative_probability])
+    chrono += time.perf_counter()
+    curve.append([chrono, nb_programs, cumulative_probability])
+    if stats is not None:
+        stats.write_snapshot()
+    return {
+        "preset": preset,
+        "algorithm": algorithm_name,
+        "programs": nb_programs,
+        "distinct_programs": len(seen),
+        "time": chrono,
+        "programs_per_second": nb_programs / chrono if chrono > 0 else None,
+        "cumulative_probability": curve,
+        "peak_rss_kb": peak_rss_kb(),
+        "rss_before_kb": rss_before,
+    }
+
+
+def semantic_run(task, algorithm_name, timeout, total_number_programs, stats_path=None):
+    """
+    Searches for a program correct on the examples of the task tmp/list_{task}.pickle,
+    returns the metrics of the run, time_to_solution is None if no solution was found
+    """
+    name_task, dsl, pcfg, examples = load_legacy_task("tmp/list_{}.pickle".format(task))
+    stats = make_stats(stats_path, task=task, algorithm=algorithm_name)
+    algorithm, param = ALGORITHMS[algorithm_name]
+    rss_before = peak_rss_kb()
+    nb_programs = 0
+    solution = None
+    chrono = -time.perf_counter()
+    if algorithm in prefix_form:
+        # only the solution is built as a Program
+        machine = StackMachine(pcfg, dsl)
+        gen = algorithm(machine.G, stats=stats, prefix=True, **param)
+        while chrono + time.perf_counter() < timeout and nb_programs < total_number_programs:
+            prefix = next(gen, None)
+            if prefix is None:
+                break
+            nb_programs += 1
+            if machine.check(prefix, examples):
+                solution = program_from_prefix(machine.G, prefix)
+                break
+    else:
+        # the programs are compiled, sharing the closures of their common subprograms
+        compiled = {}
+        gen = programs(pcfg, algorithm_name, stats)
+        while chrono + time.perf_counter() < timeout and nb_programs < total_number_programs:
+            program = next(gen, None)
+            if program is None:
+                break
+            nb_programs += 1
+            f = compile_program(program, dsl, compiled)
+            if all(f(input_) == output for input_, output in examples):
+                solution = program
+                break
+    chrono += time.perf_counter()
+    if stats is not None:
+        stats.write_snapshot()
+    return {
+        "task": task,
+        "name": name_task,
+        "algorithm": algorithm_name,
+        "programs": nb_programs,
+        "time": chrono,
+        "time_to_solution": chrono if solution is not None else None,
+        "solution": None if solution is None else str(solution),
+        "peak_rss_kb": peak_rss_kb(),
+        "rss_before_kb": rss_before,
+    }
+
+
+def parallel_run(preset, CPUs, seed, timeout, total_number_programs):
+    """
+    Enumerates the programs of the preset with parallel heap search on CPUs workers,
+    returns the metrics of the run
+    """
+    dsl, pcfg = make_pcfg(preset, seed)
+    # the output of a program is never a string: all programs are checked
+    examples = [((list(range(5)),), "no solution")]
+    chrono = -time.perf_counter()
+    _, _, nb_programs = parallel_heap_search(
+        pcfg,
+        dsl,
+        examples,
+        CPUs=CPUs,
+        timeout=timeout,
+        total_number_programs=total_number_programs,
+    )
+    chrono += time.perf_counter()
+    return {
+        "preset": preset,
+        "CPUs": CPUs,
+        "programs": nb_programs,
+        "time": chrono,
+        "programs_per_second": nb_programs / chrono if chrono > 0 else None,
+    }
+
+
+def run_in_process(function, args, timeout):
+    """
+    Runs function(*args) in a forked process and returns its result,
+    or None if it failed or did not finish within timeout seconds
+    """
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+
+    def target():
+        try:
+            queue.put(function(*args))
+        except Exception as e:
+            logging.warning("{}{} failed: {!r}".format(function.__name__, args, e))
+            queue.put(None)
+
+    process = context.Process(target=target)
+    process.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        logging.warning("{}{} did not finish within {}s".format(function.__name__, args, timeout))
+        result = None
+    process.join(timeout=1)
+    if process.is_alive():
+        process.terminate()
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "commit": commit,
+    }
+
+
+def key(run):
+    if "CPUs" in run:
+        return ("parallel", run["preset"], run["CPUs"])
+    if "preset" in run:
+        return ("syntactic", run["preset"], run["algorithm"])
+    return ("semantic", run["task"], run["algorithm"])
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the list of the regressions of results with respect to baseline, as strings:
+    a metric of a run regresses if it is worse by more than the fraction tolerance,
+    and a task solved in the baseline must be solved
+    """
+    baseline_runs = {key(run): run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        old = baseline_runs.get(key(run))
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in run:
+                continue
+            new_value, old_value = run[metric], old[metric]
+            if metric == "time_to_solution" and old_value is not None and new_value is None:
+                regressions.append("{}: no longer solved".format(key(run)))
+                continue
+            if new_value is None or old_value is None or old_value == 0:
+                continue
+            ratio = new_value / old_value
+            print("{} {}: {:.4g} -> {:.4g} ({:+.1%})".format(key(run), metric, old_value, new_value, ratio - 1))
+            if (higher_is_better and ratio < 1 - tolerance) or (
+                not higher_is_better and ratio > 1 + tolerance
+            ):
+                regressions.append("{} {}: {:.4g} -> {:.4g}".format(key(run), metric, old_value, new_value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the enumeration algorithms")
+    parser.add_argument("--presets", nargs="*", default=["deepcoder"], choices=list(PRESETS))
+    parser.add_argument("--algorithms", nargs="*", default=list(ALGORITHMS), choices=list(ALGORITHMS))
+    parser.add_argument("--tasks", nargs=2, type=int, default=None, metavar=("BEGIN", "END"),
+                        help="range of the tasks tmp/list_*.pickle for semantic runs")
+    parser.add_argument("--parallel", nargs="*", type=int, default=[], metavar="CPUS",
+                        help="numbers of workers for parallel runs of heap search")
+    parser.add_argument("--seed", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--total_number_programs", type=int, default=1_000_000)
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    parser.add_argument("--baseline", default=None, help="JSON file of results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--stats", default=None, help="JSONL file for snapshots of the searches")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(message)s", level=logging.DEBUG if args.verbose else logging.INFO)
+
+    # margin for building the grammar and loading the task
+    process_timeout = args.timeout + 60
+    runs = []
+    for preset in args.presets:
+        for algorithm_name in args.algorithms:
+            logging.info("syntactic: {} {}".format(preset, algorithm_name))
+            run = run_in_process(
+                syntactic_run,
+                (preset, algorithm_name, args.seed, args.timeout, args.total_number_programs, args.stats),
+                process_timeout,
+            )
+            if run is not None:
+                logging.info("{:.0f} programs per second".format(run["programs_per_second"] or 0))
+                runs.append(run)
+    for preset in args.presets:
+        for CPUs in args.parallel:
+            logging.info("parallel: {} {} workers".format(preset, CPUs))
+            run = run_in_process(
+                parallel_run,
+                (preset, CPUs, args.seed, args.timeout, args.total_number_programs),
+                process_timeout,
+            )
+            if run is not None:
+                logging.info("{:.0f} programs per second".format(run["programs_per_second"] or 0))
+                runs.append(run)
+    if args.tasks is not None:
+        for task in range(*args.tasks):
+            for algorithm_name in args.algorithms:
+                logging.info("semantic: task {} {}".format(task, algorithm_name))
+                run = run_in_process(
+                    semantic_run,
+                    (task, algorithm_name, args.timeout, args.total_number_programs, args.stats),
+                    process_timeout,
+                )
+                if run is not None:
+                    logging.info("time to solution: {}".format(run["time_to_solution"]))
+                    runs.append(run)
+
+    results = {
+        "environment": environment(),
+        "settings": vars(args),
+        "runs": runs,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
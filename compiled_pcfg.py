@@ -0,0 +1,488 @@
+import pickle
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from pcfg import PCFG
+from program import Function
+
+
+class CompiledPCFG:
+    """
+    Object that represents a PCFG compiled into flat arrays
+
+    Non-terminals and derivations are interned to dense integer ids.
+    The derivations of a non-terminal s are the ids d with
+    first_derivation[s] <= d < first_derivation[s+1], sorted
+    from least probable to most probable (as in PCFG.list_derivations).
+
+    non_terminals: a list mapping an id s to the non-terminal S
+    non_terminal_id: a dictionary {S: s} inverse of non_terminals
+    start: the id of the initial non-terminal
+
+    derivations: a list mapping a derivation id d to its program P
+    max_programs: a list mapping d to the most probable program starting with d
+    lhs: an array mapping d to the id of the non-terminal it derives from
+    weight, log_weight: arrays mapping d to its (log) probability
+    arity: an array mapping d to its number of arguments
+    first_child, children: the ids of the non-terminals for the arguments of d
+    are children[first_child[d]:first_child[d+1]]
+
+    max_probability: an array mapping s to the probability of the most probable
+    program generated from s
+    max_probability_derivation: an array mapping d to the probability of the most
+    probable program starting with d
+    max_log_probability, max_log_probability_derivation: the same in log-space
+
+    log_probability: a boolean, the mode of the PCFG it is compiled from
+    """
+
+    def __init__(self, G: PCFG):
+        self.hash = G.hash
+        self.max_program_depth = G.max_program_depth
+        self.log_probability = G.log_probability
+
+        self.non_terminals = list(G.rules)
+        self.non_terminal_id = {S: s for s, S in enumerate(self.non_terminals)}
+        self.start = self.non_terminal_id[G.start]
+
+        self.derivations = []
+        self.max_programs = []
+        first_derivation = [0]
+        lhs = []
+        weight = []
+        arity = []
+        first_child = [0]
+        children = []
+        max_probability_derivation = []
+
+        for s, S in enumerate(self.non_terminals):
+            for P in G.list_derivations[S]:
+                args_P, w = G.rules[S][P]
+                program = G.max_probability[(S, P)]
+                self.derivations.append(P)
+                self.max_programs.append(program)
+                lhs.append(s)
+                weight.append(w)
+                arity.append(len(args_P))
+                children.extend(self.non_terminal_id[arg] for arg in args_P)
+                first_child.append(len(children))
+                max_probability_derivation.append(G.probabilities[S][program.id])
+            first_derivation.append(len(self.derivations))
+
+        self.first_derivation = np.array(first_derivation, dtype=np.int32)
+        self.lhs = np.array(lhs, dtype=np.int32)
+        self.weight = np.array(weight, dtype=np.float64)
+        self.log_weight = np.log(self.weight)
+        self.arity = np.array(arity, dtype=np.int32)
+        self.first_child = np.array(first_child, dtype=np.int32)
+        self.children = np.array(children, dtype=np.int32)
+        max_probability_derivation = np.array(
+            max_probability_derivation, dtype=np.float64
+        )
+        max_probability = np.array(
+            [G.max_program_probability(S) for S in self.non_terminals],
+            dtype=np.float64,
+        )
+        if self.log_probability:
+            self.max_log_probability_derivation = max_probability_derivation
+            self.max_log_probability = max_probability
+            self.max_probability_derivation = np.exp(max_probability_derivation)
+            self.max_probability = np.exp(max_probability)
+        else:
+            self.max_probability_derivation = max_probability_derivation
+            self.max_probability = max_probability
+            # probabilities which underflowed to 0 have log-probability -inf
+            with np.errstate(divide="ignore"):
+                self.max_log_probability_derivation = np.log(max_probability_derivation)
+                self.max_log_probability = np.log(max_probability)
+
+        self.tables = None
+        self.alias = None
+
+    def __hash__(self):
+        return self.hash
+
+    def __repr__(self):
+        s = "Print a compiled PCFG\n"
+        s += "start: {}\n".format(self.non_terminals[self.start])
+        for i, S in enumerate(self.non_terminals):
+            s += "#\n {}\n".format(S)
+            for d in self.rules_of(i):
+                args_d = [self.non_terminals[arg] for arg in self.arguments_of(d)]
+                s += "   {} - {}: {}     {}\n".format(
+                    self.derivations[d], self.derivations[d].type, args_d, self.weight[d]
+                )
+        return s
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["tables"] = None
+        state["alias"] = None
+        # a CompiledPCFG attached to shared memory is pickled with copies of its arrays
+        state.pop("shared_memory", None)
+        return state
+
+    def number_of_non_terminals(self):
+        return len(self.non_terminals)
+
+    def number_of_derivations(self):
+        return len(self.derivations)
+
+    def rules_of(self, s):
+        """
+        the range of derivation ids from the non-terminal s
+        """
+        return range(self.first_derivation[s], self.first_derivation[s + 1])
+
+    def arguments_of(self, d):
+        """
+        the tuple of non-terminal ids for the arguments of the derivation d
+        """
+        return tuple(self.children[self.first_child[d] : self.first_child[d + 1]].tolist())
+
+    def python_tables(self):
+        """
+        Returns (rules, weight, arguments, max_probability_derivation) as Python lists:
+        rules[s] is the range of derivations from s and arguments[d] the tuple of
+        non-terminal ids for the arguments of d.
+        In log mode weight and max_probability_derivation are log-probabilities.
+        Indexing NumPy arrays from Python boxes a scalar per access,
+        so the enumerators unpack the arrays once and index these lists in their loops.
+        """
+        if self.tables is None:
+            if self.log_probability:
+                weight = self.log_weight
+                max_probability_derivation = self.max_log_probability_derivation
+            else:
+                weight = self.weight
+                max_probability_derivation = self.max_probability_derivation
+            first_derivation = self.first_derivation.tolist()
+            first_child = self.first_child.tolist()
+            children = self.children.tolist()
+            self.tables = (
+                [
+                    range(first_derivation[s], first_derivation[s + 1])
+                    for s in range(len(self.non_terminals))
+                ],
+                weight.tolist(),
+                [
+                    tuple(children[first_child[d] : first_child[d + 1]])
+                    for d in range(len(self.derivations))
+                ],
+                max_probability_derivation.tolist(),
+            )
+        return self.tables
+
+    def alias_tables(self):
+        """
+        Returns the arrays (threshold, alias) of the alias method (Vose) for all non-terminals:
+        to sample a derivation from s, draw d uniformly in rules_of(s) and u uniformly in [0, 1),
+        the result is d if u < threshold[d] and alias[d] otherwise
+        """
+        if self.alias is None:
+            weight = self.weight.tolist()
+            threshold = [1.0] * len(weight)
+            alias = list(range(len(weight)))
+            for s in range(len(self.non_terminals)):
+                derivations = self.rules_of(s)
+                total = sum(weight[d] for d in derivations)
+                scaled = {d: weight[d] * len(derivations) / total for d in derivations}
+                small = [d for d in derivations if scaled[d] < 1]
+                large = [d for d in derivations if scaled[d] >= 1]
+                while small and large:
+                    d_small, d_large = small.pop(), large.pop()
+                    threshold[d_small] = scaled[d_small]
+                    alias[d_small] = d_large
+                    scaled[d_large] -= 1 - scaled[d_small]
+                    if scaled[d_large] < 1:
+                        small.append(d_large)
+                    else:
+                        large.append(d_large)
+                # the remaining derivations have scaled weight 1 up to rounding errors
+            self.alias = (
+                np.array(threshold, dtype=np.float64),
+                np.array(alias, dtype=np.int32),
+            )
+        return self.alias
+
+    def sample_batch(self, n, s=None):
+        """
+        Samples n programs from the non-terminal s (by default the start), see SampledPrograms
+        The programs are sampled level by level: the derivations of all the nodes
+        at the same depth are drawn at once with the alias method
+        """
+        if s is None:
+            s = self.start
+        threshold, alias = self.alias_tables()
+        count = np.diff(self.first_derivation)
+
+        derivations = []
+        first_children = []
+        roots = []
+        number_of_nodes = 0
+        # the nodes of the current level: their non-terminals and the program they belong to
+        non_terminals = np.full(n, s, dtype=np.int32)
+        root = np.arange(n, dtype=np.int32)
+        while len(non_terminals) > 0:
+            m = len(non_terminals)
+            uniform = np.random.random((2, m))
+            count_level = count[non_terminals]
+            d = self.first_derivation[non_terminals] + np.minimum(
+                (uniform[0] * count_level).astype(np.int32), count_level - 1
+            )
+            d = np.where(uniform[1] < threshold[d], d, alias[d])
+
+            # the children of a node are contiguous in the next level, in the order of the arguments
+            arity = self.arity[d]
+            next_level = np.cumsum(arity) - arity
+            derivations.append(d)
+            first_children.append(number_of_nodes + m + next_level)
+            roots.append(root)
+            number_of_nodes += m
+
+            parent = np.repeat(np.arange(m), arity)
+            position = np.arange(len(parent)) - next_level[parent]
+            non_terminals = self.children[self.first_child[d[parent]] + position]
+            root = root[parent]
+
+        return SampledPrograms(
+            self,
+            n,
+            np.concatenate(derivations),
+            np.concatenate(first_children),
+            np.concatenate(roots),
+        )
+
+    def to_pcfg(self):
+        """
+        Rebuilds the dictionary-based PCFG
+        """
+        rules = {}
+        for s, S in enumerate(self.non_terminals):
+            rules[S] = {}
+            for d in self.rules_of(s):
+                args_d = [self.non_terminals[arg] for arg in self.arguments_of(d)]
+                rules[S][self.derivations[d]] = (args_d, float(self.weight[d]))
+        return PCFG(
+            start=self.non_terminals[self.start],
+            rules=rules,
+            max_program_depth=self.max_program_depth,
+            log_probability=self.log_probability,
+        )
+
+
+class SampledPrograms:
+    """
+    Object that represents a batch of programs sampled from a CompiledPCFG
+
+    The nodes of all programs are numbered level by level,
+    the root of the k-th program being the node k:
+    derivation[node] is the id of the derivation of the node,
+    its children are the nodes first_child[node], ..., first_child[node] + arity - 1
+    root[node] is the number of the program it belongs to
+
+    The programs are only built when accessed, with batch[k] or by iterating over the batch
+    """
+
+    def __init__(self, G, n, derivation, first_child, root):
+        self.G = G
+        self.n = n
+        self.derivation = derivation
+        self.first_child = first_child
+        self.root = root
+        _, _, self.arguments, _ = G.python_tables()
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.n:
+            raise IndexError(k)
+        return self.program(k, self.derivation, self.first_child)
+
+    def __iter__(self):
+        derivation = self.derivation.tolist()
+        first_child = self.first_child.tolist()
+        for k in range(self.n):
+            yield self.program(k, derivation, first_child)
+
+    def program(self, node, derivation, first_child):
+        # as PCFG.sample_program, sampled programs are not typed
+        d = derivation[node]
+        arity = len(self.arguments[d])
+        if arity == 0:
+            return self.G.derivations[d]
+        first = first_child[node]
+        return Function(
+            self.G.derivations[d],
+            [self.program(child, derivation, first_child) for child in range(first, first + arity)],
+        )
+
+    def log_probabilities(self):
+        """
+        the array of the log-probabilities of the programs
+        """
+        return np.bincount(
+            self.root, weights=self.G.log_weight[self.derivation], minlength=self.n
+        )
+
+    def probabilities(self):
+        """
+        the array of the probabilities of the programs
+        """
+        return np.exp(self.log_probabilities())
+
+
+class SharedPCFG:
+    """
+    Object that represents a CompiledPCFG published in shared memory,
+    so that worker processes can attach to it without unpickling the grammar
+
+    The block starts with the pickled objects of the compiled PCFG
+    (non-terminals, derivations and max_programs), followed by its arrays.
+    Pickling a SharedPCFG only sends the name of the block and its layout,
+    and attach() returns a CompiledPCFG whose arrays are read-only views on the block.
+    The objects are unpickled at most once per process: a process forked after
+    the PCFG was published inherits them (see shared_objects) and unpickles nothing.
+
+    The process which published the PCFG owns the block: it must call unlink()
+    once the workers are done. Other processes attach to it without registering it
+    with their resource tracker, which would unlink it when they exit.
+    """
+
+    def __init__(self, G):
+        G = compile_pcfg(G)
+        header = pickle.dumps(
+            {attribute: getattr(G, attribute) for attribute in SHARED_OBJECTS},
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+
+        # layout[attribute] = (offset, dtype, shape), offsets aligned on 8 bytes
+        self.layout = {}
+        size = len(header)
+        for attribute in SHARED_ARRAYS:
+            array = getattr(G, attribute)
+            size += -size % 8
+            self.layout[attribute] = (size, array.dtype.str, array.shape)
+            size += array.nbytes
+        self.header_size = len(header)
+
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.name = self.shared_memory.name
+        shared_objects[self.name] = {attribute: getattr(G, attribute) for attribute in SHARED_OBJECTS}
+        self.shared_memory.buf[: len(header)] = header
+        for attribute in SHARED_ARRAYS:
+            self.view(attribute)[:] = getattr(G, attribute)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["shared_memory"] = None
+        return state
+
+    def view(self, attribute):
+        offset, dtype, shape = self.layout[attribute]
+        return np.ndarray(shape, dtype=dtype, buffer=self.shared_memory.buf, offset=offset)
+
+    def attach(self):
+        """
+        Returns the CompiledPCFG, its arrays are views on the shared memory
+        """
+        if self.shared_memory is None:
+            self.shared_memory = attach_shared_memory(self.name)
+        if self.name not in shared_objects:
+            shared_objects[self.name] = pickle.loads(self.shared_memory.buf[: self.header_size])
+        G = CompiledPCFG.__new__(CompiledPCFG)
+        G.__dict__.update(shared_objects[self.name])
+        for attribute in SHARED_ARRAYS:
+            array = self.view(attribute)
+            array.flags.writeable = False
+            setattr(G, attribute, array)
+        G.tables = None
+        G.alias = None
+        # the arrays are valid as long as the block is mapped
+        G.shared_memory = self.shared_memory
+        return G
+
+    def close(self):
+        """
+        Unmaps the block in this process, the CompiledPCFG attached to it can no longer be used
+        """
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+            self.shared_memory = None
+
+    def unlink(self):
+        """
+        Frees the block, to be called by the process which published the PCFG
+        """
+        if self.shared_memory is None:
+            self.shared_memory = attach_shared_memory(self.name)
+        self.shared_memory.unlink()
+        shared_objects.pop(self.name, None)
+        self.close()
+
+
+def attach_shared_memory(name):
+    """
+    Returns the shared memory block name, without registering it with the resource tracker
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # before Python 3.13 SharedMemory registers every block it opens. The resource tracker
+    # of a process which is not a child of the publisher would unlink the block when the
+    # process exits; unregistering the block instead would remove the registration
+    # of the publisher from the tracker it shares with its forked or spawned children
+    register = resource_tracker.register
+
+    def register_except_shared_memory(name, rtype):
+        if rtype != "shared_memory":
+            register(name, rtype)
+
+    resource_tracker.register = register_except_shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+# the objects of the PCFGs published or attached to in this process, by name of their block
+shared_objects = {}
+
+
+# the attributes of a CompiledPCFG stored in shared memory
+SHARED_OBJECTS = [
+    "hash",
+    "max_program_depth",
+    "log_probability",
+    "non_terminals",
+    "non_terminal_id",
+    "start",
+    "derivations",
+    "max_programs",
+]
+SHARED_ARRAYS = [
+    "first_derivation",
+    "lhs",
+    "weight",
+    "log_weight",
+    "arity",
+    "first_child",
+    "children",
+    "max_probability",
+    "max_probability_derivation",
+    "max_log_probability",
+    "max_log_probability_derivation",
+]
+
+
+def compile_pcfg(G):
+    """
+    Returns G if it is already compiled, and its compilation otherwise
+    """
+    if isinstance(G, CompiledPCFG):
+        return G
+    if isinstance(G, SharedPCFG):
+        return G.attach()
+    return CompiledPCFG(G)
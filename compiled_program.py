@@ -0,0 +1,138 @@
+from program import *
+
+# Compilation of a program for a DSL into a Python closure over an environment,
+# which computes the same value as Program.eval without dispatching on the nodes:
+# the semantics of the primitives are looked up once, the variables are bound to
+# their position, and the arguments of a node are applied directly, one closure per
+# number of arguments.
+# As in Program.eval, the evaluation of a node raising IndexError, ValueError or TypeError
+# is None (also AttributeError for New), and evaluations are not cached.
+#
+# compiled: a dictionary {id: closure} given to compile_program as a side table,
+# so that the subprograms shared by several programs are compiled once,
+# including across tasks using the same DSL
+
+
+def compile_program(program, dsl, compiled=None):
+    """
+    Returns the closure mapping an environment to the evaluation of program,
+    raises KeyError if program uses a primitive which is not in the DSL
+    """
+    if compiled is not None:
+        f = compiled.get(program.id)
+        if f is not None:
+            return f
+
+    if isinstance(program, Variable):
+        f = compile_variable(program.variable)
+
+    elif isinstance(program, BasicPrimitive):
+        value = dsl.semantics[program.primitive]
+        f = lambda environment: value
+
+    elif isinstance(program, Function):
+        arguments = [compile_program(argument, dsl, compiled) for argument in program.arguments]
+        if isinstance(program.function, BasicPrimitive):
+            f = compile_application(dsl.semantics[program.function.primitive], arguments)
+        else:
+            f = compile_dynamic_application(compile_program(program.function, dsl, compiled), arguments)
+
+    elif isinstance(program, Lambda):
+        body = compile_program(program.body, dsl, compiled)
+        f = lambda environment: lambda x: body((x,) + environment)
+
+    elif isinstance(program, New):
+        body = compile_program(program.body, dsl, compiled)
+
+        def f(environment):
+            try:
+                return body(environment)
+            except (IndexError, ValueError, TypeError, AttributeError):
+                return None
+
+    else:
+        assert False
+
+    if compiled is not None:
+        compiled[program.id] = f
+    return f
+
+
+def compile_variable(k):
+    """
+    the closure of the variable k
+    """
+    def f(environment):
+        try:
+            return environment[k]
+        except (IndexError, TypeError):
+            return None
+    return f
+
+
+def compile_application(value, arguments):
+    """
+    the closure applying value, the semantics of a primitive, to the closures arguments
+    """
+    # the arguments are evaluated before being applied, as in Function.eval
+    if len(arguments) == 0:
+        return lambda environment: value
+    if len(arguments) == 1:
+        (a,) = arguments
+
+        def f(environment):
+            try:
+                return value(a(environment))
+            except (IndexError, ValueError, TypeError):
+                return None
+    elif len(arguments) == 2:
+        a, b = arguments
+
+        def f(environment):
+            try:
+                x = a(environment)
+                y = b(environment)
+                return value(x)(y)
+            except (IndexError, ValueError, TypeError):
+                return None
+    elif len(arguments) == 3:
+        a, b, c = arguments
+
+        def f(environment):
+            try:
+                x = a(environment)
+                y = b(environment)
+                z = c(environment)
+                return value(x)(y)(z)
+            except (IndexError, ValueError, TypeError):
+                return None
+    else:
+        def f(environment):
+            try:
+                evaluated_arguments = [argument(environment) for argument in arguments]
+                result = value
+                for evaluated_argument in evaluated_arguments:
+                    result = result(evaluated_argument)
+                return result
+            except (IndexError, ValueError, TypeError):
+                return None
+    return f
+
+
+def compile_dynamic_application(function, arguments):
+    """
+    the closure applying the evaluation of the closure function to the closures arguments
+    """
+    if len(arguments) == 0:
+        return function
+
+    def f(environment):
+        try:
+            evaluated_arguments = [argument(environment) for argument in arguments]
+            result = function(environment)
+            for evaluated_argument in evaluated_arguments:
+                result = result(evaluated_argument)
+            return result
+        except (IndexError, ValueError, TypeError):
+            return None
+    return f
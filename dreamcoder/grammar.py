@@ -29,6 +29,10 @@ class Grammar(object):
         self.expression2likelihood = dict((p, l) for l, _, p in productions)
         self.expression2likelihood[Index(0)] = self.logVariable
 
+        # memoises buildCandidates: maps the canonical signature of a call
+        # (see buildCandidates) to its candidates, or to None if there are none
+        self.candidateCache = {}
+
     def randomWeights(self, r):
         """returns a new grammar with random weights drawn from r. calls `r` w/ old weight"""
         return Grammar(logVariable=r(self.logVariable),
@@ -48,6 +52,11 @@ class Grammar(object):
                                     for l,t,p in self.productions ],
                        continuationType=self.continuationType)
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("candidateCache", None)
+        return state
+
     def __setstate__(self, state):
         """
         Legacy support for loading grammar objects without the imperative type filled in
@@ -160,6 +169,52 @@ class Grammar(object):
         if returnProbabilities:
             assert normalize
 
+        # The candidates only depend on the request and environment types under context,
+        # up to a renaming of their free variables: they are memoised in candidateCache,
+        # computed in a context of their own where these variables are 0, 1, ...
+        # in order of occurrence, and their types and contexts are renamed into context.
+        isContinuation = self.continuationType == request
+        bindings = {}
+        canonicalRequest = request.apply(context).canonical(bindings)
+        canonicalEnvironment = tuple(t.apply(context).canonical(bindings) for t in environment)
+        key = (canonicalRequest, canonicalEnvironment,
+               normalize, returnProbabilities, mustBeLeaf, isContinuation)
+        if key not in self.candidateCache:
+            self.candidateCache[key] = self.computeCandidates(
+                canonicalRequest, Context(len(bindings), {}), canonicalEnvironment,
+                normalize, returnProbabilities, mustBeLeaf, isContinuation)
+        canonicalCandidates = self.candidateCache[key]
+        if canonicalCandidates is None:
+            raise NoCandidates()
+
+        # renaming maps the variables of the canonical candidates to those of context:
+        # the variables created by their instantiation are fresh variables of context
+        numberOfVariables = len(bindings)
+        renaming = {c.v: TypeVariable(v) for v, c in bindings.items()}
+        candidates = []
+        for l, t, p, k in canonicalCandidates:
+            for c in range(len(renaming), k.nextVariable):
+                renaming[c] = TypeVariable(context.nextVariable + c - numberOfVariables)
+            nextVariable = context.nextVariable + k.nextVariable - numberOfVariables
+            if k.substitution:
+                substitution = dict(context.substitution)
+                for c, b in k.substitution.items():
+                    substitution[renaming[c].v] = b.canonical(renaming)
+                newContext = Context(nextVariable, substitution)
+            elif nextVariable != context.nextVariable:
+                newContext = Context(nextVariable, context.substitution)
+            else:
+                newContext = context
+            candidates.append((l, t.canonical(renaming), p, newContext))
+
+        if returnTable:
+            return {p: (l, t, k) for l, t, p, k in candidates}
+        else:
+            return candidates
+
+    def computeCandidates(self, request, context, environment,
+                          normalize, returnProbabilities, mustBeLeaf, isContinuation):
+        """The candidates of buildCandidates as a list, or None if there are none"""
         candidates = []
         variableCandidates = []
         for l, t, p in self.productions:
@@ -182,7 +237,7 @@ class Grammar(object):
             except UnificationFailure:
                 continue
 
-        if self.continuationType == request:
+        if isContinuation:
             terminalIndices = [v.i for t,v,k in variableCandidates if not t.isArrow()]
             if terminalIndices:
                 smallestIndex = Index(min(terminalIndices))
@@ -192,9 +247,7 @@ class Grammar(object):
         candidates += [(self.logVariable - log(len(variableCandidates)), t, p, k)
                        for t, p, k in variableCandidates]
         if candidates == []:
-            raise NoCandidates()
-        #eprint("candidates inside buildCandidates before norm:")
-        #eprint(candidates)
+            return None
 
         if normalize:
             z = lse([l for l, t, p, k in candidates])
@@ -204,13 +257,7 @@ class Grammar(object):
             else:
                 candidates = [(l - z, t, p, k) for l, t, p, k in candidates]
 
-        #eprint("candidates inside buildCandidates after norm:")
-        #eprint(candidates)
-
-        if returnTable:
-            return {p: (l, t, k) for l, t, p, k in candidates}
-        else:
-            return candidates
+        return candidates
 
 
     def sample(self, request, maximumDepth=6, maxAttempts=None):
@@ -156,10 +156,16 @@ class TypeVariable(Type):
     def functionArguments(self): return []
 
     def apply(self, context):
-        for v, t in context.substitution:
-            if v == self.v:
-                return t.apply(context)
-        return self
+        t = context.substitution.get(self.v)
+        if t is None:
+            return self
+        if t.isPolymorphic:
+            new = t.apply(context)
+            if new is not t:
+                # path compression: the binding is equivalent in every context sharing it
+                context.substitution[self.v] = new
+            return new
+        return t
 
     def applyMutable(self, context):
         s = context.substitution[self.v]
@@ -201,12 +207,22 @@ class TypeVariable(Type):
 
 
 class Context(object):
-    def __init__(self, nextVariable=0, substitution=[]):
+    """
+    Persistent context: extend and unify return new contexts and leave self unchanged.
+    The substitution is a dictionary {variable: type}, shared by the contexts built
+    from each other without binding new variables (makeVariable, instantiate),
+    and copied when a variable is bound, once per call to unify.
+    Shared dictionaries are only modified by path compression in TypeVariable.apply,
+    which replaces a binding by an equivalent one.
+    """
+    def __init__(self, nextVariable=0, substitution=None):
         self.nextVariable = nextVariable
-        self.substitution = substitution
+        self.substitution = {} if substitution is None else substitution
 
     def extend(self, j, t):
-        return Context(self.nextVariable, [(j, t)] + self.substitution)
+        substitution = dict(self.substitution)
+        substitution[j] = t
+        return Context(self.nextVariable, substitution)
 
     def makeVariable(self):
         return (Context(self.nextVariable + 1, self.substitution),
@@ -217,6 +233,21 @@ class Context(object):
         t2 = t2.apply(self)
         if t1 == t2:
             return self
+        k = Context(self.nextVariable, self.substitution)
+        k.unifyInPlace(t1, t2, self.substitution)
+        if k.substitution is self.substitution:
+            return self
+        return k
+
+    def unifyInPlace(self, t1, t2, shared):
+        """
+        Binds the variables of the unifier of t1 and t2 in self,
+        copying the substitution first if it is shared
+        """
+        t1 = t1.apply(self)
+        t2 = t2.apply(self)
+        if t1 == t2:
+            return
         # t1&t2 are not equal
         if not t1.isPolymorphic and not t2.isPolymorphic:
             raise UnificationFailure(t1, t2)
@@ -224,21 +255,26 @@ class Context(object):
         if isinstance(t1, TypeVariable):
             if t2.occurs(t1.v):
                 raise Occurs()
-            return self.extend(t1.v, t2)
+            self.bind(t1.v, t2, shared)
+            return
         if isinstance(t2, TypeVariable):
             if t1.occurs(t2.v):
                 raise Occurs()
-            return self.extend(t2.v, t1)
+            self.bind(t2.v, t1, shared)
+            return
         if t1.name != t2.name:
             raise UnificationFailure(t1, t2)
-        k = self
         for x, y in zip(t2.arguments, t1.arguments):
-            k = k.unify(x, y)
-        return k
+            self.unifyInPlace(x, y, shared)
+
+    def bind(self, j, t, shared):
+        if self.substitution is shared:
+            self.substitution = dict(shared)
+        self.substitution[j] = t
 
     def __str__(self):
         return "Context(next = %d, {%s})" % (self.nextVariable, ", ".join(
-            "t%d ||> %s" % (k, v.apply(self)) for k, v in self.substitution))
+            "t%d ||> %s" % (k, v.apply(self)) for k, v in self.substitution.items()))
 
     def __repr__(self): return str(self)
 
@@ -281,7 +317,7 @@ class MutableContext(object):
             self.unify(x, y)
 
 
-Context.EMPTY = Context(0, [])
+Context.EMPTY = Context(0, {})
 
 
 def canonicalTypes(ts):
@@ -70,7 +70,7 @@ def curry(fn):
 class Curried:
     def __init__(self, f, arguments=None, arity=None):
         if arity is None:
-            arity = len(inspect.getargspec(f)[0])
+            arity = len(inspect.getfullargspec(f).args)
         self.f = f
         self.arity = arity
         if arguments is None: arguments = []
@@ -4,7 +4,6 @@ from cfg import *
 from pcfg import *
 
 from collections import deque
-import copy
 import time
 
 
@@ -17,24 +16,34 @@ class DSL:
     semantics: a dictionary of the form {P : f}
     mapping a program P to its semantics f
     for P a BasicPrimitive
+
+    instantiated_primitives: a dictionary {upper_bound_type_size : l}
+    memoising instantiate_polymorphic_types
+
+    CFGs: a dictionary memoising DSL_to_CFG, whose keys are the tuples of its arguments
     """
 
     def __init__(self, semantics, primitive_types):
         self.list_primitives = []
         self.semantics = {}
+        self.instantiated_primitives = {}
+        self.CFGs = {}
 
         for p in primitive_types:
             formatted_p = format(p)
             if formatted_p in semantics:
                 self.semantics[formatted_p] = semantics[formatted_p]
-                P = BasicPrimitive(
-                    primitive=formatted_p, type_=primitive_types[p], probability={}
-                )
+                P = BasicPrimitive(primitive=formatted_p, type_=primitive_types[p])
                 self.list_primitives.append(P)
             else:
-                P = New(body=p.body, type_=primitive_types[p], probability={})
+                P = New(body=p.body, type_=primitive_types[p])
                 self.list_primitives.append(P)
 
+    def __setstate__(self, d):
+        d.setdefault("instantiated_primitives", {})
+        d.setdefault("CFGs", {})
+        self.__dict__ = d
+
     def __repr__(self):
         s = "Print a DSL\n"
         for P in self.list_primitives:
@@ -42,6 +51,14 @@ class DSL:
         return s
 
     def instantiate_polymorphic_types(self, upper_bound_type_size=10):
+        """
+        Returns the list of primitives where polymorphic primitives are replaced
+        by all their instantiations of size at most upper_bound_type_size,
+        memoised in instantiated_primitives; list_primitives is left unchanged
+        """
+        if upper_bound_type_size in self.instantiated_primitives:
+            return self.instantiated_primitives[upper_bound_type_size]
+
         set_basic_types = set()
         for P in self.list_primitives:
             set_basic_types_P, set_polymorphic_types_P = P.type.decompose_type()
@@ -63,13 +80,15 @@ class DSL:
 
         # print("set_types", set_types)
 
-        new_primitive_types = {}
-
+        # the monomorphic primitives followed by the instantiations of the polymorphic ones
+        list_primitives = []
+        instantiated_primitives = []
         for P in self.list_primitives:
             assert isinstance(P, (New, BasicPrimitive))
             type_P = P.type
             set_basic_types_P, set_polymorphic_types_P = type_P.decompose_type()
             if set_polymorphic_types_P:
+                # apply_unifier builds new types, no copy is needed
                 set_instantiated_types = set()
                 set_instantiated_types.add(type_P)
                 for poly_type in set_polymorphic_types_P:
@@ -77,20 +96,22 @@ class DSL:
                     for type_ in set_types:
                         for instantiated_type in set_instantiated_types:
                             unifier = {str(poly_type): type_}
-                            intermediate_type = copy.deepcopy(instantiated_type)
-                            new_type = intermediate_type.apply_unifier(unifier)
+                            new_type = instantiated_type.apply_unifier(unifier)
                             if new_type.size() <= upper_bound_type_size:
                                 new_set_instantiated_types.add(new_type)
                     set_instantiated_types = new_set_instantiated_types
                 for type_ in set_instantiated_types:
                     if isinstance(P, New):
-                        instantiated_P = New(P.body, type_, probability={})
+                        instantiated_P = New(P.body, type_)
                     if isinstance(P, BasicPrimitive):
-                        instantiated_P = BasicPrimitive(
-                            P.primitive, type_, probability={}
-                        )
-                    self.list_primitives.append(instantiated_P)
-                self.list_primitives.remove(P)
+                        instantiated_P = BasicPrimitive(P.primitive, type_)
+                    instantiated_primitives.append(instantiated_P)
+            else:
+                list_primitives.append(P)
+
+        list_primitives += instantiated_primitives
+        self.instantiated_primitives[upper_bound_type_size] = list_primitives
+        return list_primitives
 
     def DSL_to_CFG(
         self,
@@ -103,8 +124,21 @@ class DSL:
         """
         Constructs a CFG from a DSL imposing bounds on size of the types
         and on the maximum program depth
+
+        The CFG is memoised in CFGs: it is shared between the callers
+        with the same arguments, which should not modify it
         """
-        self.instantiate_polymorphic_types(upper_bound_type_size)
+        key = (
+            type_request,
+            upper_bound_type_size,
+            max_program_depth,
+            min_variable_depth,
+            n_gram,
+        )
+        if key in self.CFGs:
+            return self.CFGs[key]
+
+        list_primitives = self.instantiate_polymorphic_types(upper_bound_type_size)
 
         return_type = type_request.returns()
         args = type_request.arguments()
@@ -120,6 +154,13 @@ class DSL:
 
         list_to_be_treated = deque()
         list_to_be_treated.append((return_type, [], 0))
+        # the triples (type, context, depth) ever added to list_to_be_treated,
+        # with contexts as tuples
+        visited = set()
+        visited.add((return_type, (), 0))
+        # primitives_ending_with[type] is the list of the pairs (P, arguments_P)
+        # for the primitives P whose type ends with type, after the arguments arguments_P
+        primitives_ending_with = {}
 
         while len(list_to_be_treated) > 0:
             current_type, context, depth = list_to_be_treated.pop()
@@ -136,43 +177,48 @@ class DSL:
             if depth < max_program_depth and depth >= min_variable_depth:
                 for i in range(len(args)):
                     if current_type == args[i]:
-                        var = Variable(i, current_type, probability={})
+                        var = Variable(i, current_type)
                         rules[non_terminal][var] = []
 
             if depth == max_program_depth - 1:
-                for P in self.list_primitives:
+                for P in list_primitives:
                     type_P = P.type
                     return_P = type_P.returns()
                     if return_P == current_type and len(type_P.arguments()) == 0:
                         rules[non_terminal][P] = []
 
             elif depth < max_program_depth:
-                for P in self.list_primitives:
-                    type_P = P.type
-                    arguments_P = type_P.ends_with(current_type)
-                    if arguments_P != None:
-                        decorated_arguments_P = []
-                        for i, arg in enumerate(arguments_P):
-                            new_context = context.copy()
-                            new_context = [(P, i)] + new_context
-                            if len(new_context) > n_gram:
-                                new_context.pop()
-                            decorated_arguments_P.append(
-                                repr(arg, new_context, depth + 1)
+                if current_type not in primitives_ending_with:
+                    primitives_ending_with[current_type] = [
+                        (P, P.type.ends_with(current_type))
+                        for P in list_primitives
+                        if P.type.ends_with(current_type) is not None
+                    ]
+                for P, arguments_P in primitives_ending_with[current_type]:
+                    decorated_arguments_P = []
+                    for i, arg in enumerate(arguments_P):
+                        new_context = context.copy()
+                        new_context = [(P, i)] + new_context
+                        if len(new_context) > n_gram:
+                            new_context.pop()
+                        decorated_arguments_P.append(
+                            repr(arg, new_context, depth + 1)
+                        )
+                        if (arg, tuple(new_context), depth + 1) not in visited:
+                            visited.add((arg, tuple(new_context), depth + 1))
+                            list_to_be_treated.appendleft(
+                                (arg, new_context, depth + 1)
                             )
-                            if (arg, new_context, depth + 1) not in list_to_be_treated:
-                                list_to_be_treated.appendleft(
-                                    (arg, new_context, depth + 1)
-                                )
 
-                        rules[non_terminal][P] = decorated_arguments_P
+                    rules[non_terminal][P] = decorated_arguments_P
 
         # print(rules)
-        return CFG(
+        self.CFGs[key] = CFG(
             start=(return_type, None, 0),
             rules=rules,
             max_program_depth=max_program_depth,
         )
+        return self.CFGs[key]
 
     def DSL_to_Uniform_PCFG(
         self,
@@ -181,6 +227,7 @@ class DSL:
         max_program_depth=4,
         min_variable_depth=1,
         n_gram=1,
+        log_probability=False,
     ):
         CFG = self.DSL_to_CFG(
             type_request,
@@ -196,7 +243,10 @@ class DSL:
             for P in CFG.rules[S]:
                 augmented_rules[S][P] = (CFG.rules[S][P], 1 / p)
         return PCFG(
-            start=CFG.start, rules=augmented_rules, max_program_depth=max_program_depth
+            start=CFG.start,
+            rules=augmented_rules,
+            max_program_depth=max_program_depth,
+            log_probability=log_probability,
         )
 
     def DSL_to_Random_PCFG(
@@ -207,6 +257,7 @@ class DSL:
         min_variable_depth=1,
         n_gram=1,
         alpha=0.7,
+        log_probability=False,
     ):
         CFG = self.DSL_to_CFG(
             type_request,
@@ -230,5 +281,8 @@ class DSL:
             for i, P in enumerate(CFG.rules[S]):
                 new_rules[S][P] = (CFG.rules[S][P], weights[random_permutation[i]])
         return PCFG(
-            start=CFG.start, rules=new_rules, max_program_depth=max_program_depth
+            start=CFG.start,
+            rules=new_rules,
+            max_program_depth=max_program_depth,
+            log_probability=log_probability,
         )
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+import sys
+
+# returned by get for keys which are not in the cache,
+# evaluations can be None so None cannot be used to signal a miss
+missing = object()
+
+
+class EvaluationCache:
+    """
+    Object that stores evaluations of programs, to be given to Program.eval as cache
+
+    The keys are pairs (id, i) where id is the id of a program and i the number
+    of the environment, the values are the evaluations.
+    The cache is bounded: when it holds more than max_entries evaluations
+    or more than max_bytes bytes the least recently used evaluations are evicted.
+    None means no bound.
+    sizeof: a function mapping a value to its size in bytes, sys.getsizeof by default
+
+    hits, misses: the number of successful and failed lookups
+    evictions: the number of evaluations evicted
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=sys.getsizeof):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self.evaluations = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.evaluations)
+
+    def __contains__(self, key):
+        return key in self.evaluations
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.evaluations:
+            self.evaluations.move_to_end(key)
+            if self.max_bytes is not None:
+                self.bytes -= self.sizes[key]
+        self.evaluations[key] = value
+        if self.max_bytes is not None:
+            size = self.sizeof(value)
+            self.sizes[key] = size
+            self.bytes += size
+        self.evict()
+
+    def __repr__(self):
+        return "evaluation cache: {} entries, {} hits, {} misses, {} evictions".format(
+            len(self.evaluations), self.hits, self.misses, self.evictions
+        )
+
+    def get(self, key, default=missing):
+        """
+        returns the evaluation for key and marks it as recently used,
+        or default if there is none
+        """
+        try:
+            value = self.evaluations[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.evaluations.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def evict(self):
+        """
+        removes least recently used evaluations until the cache fits its bounds
+        """
+        while (self.max_entries is not None and len(self.evaluations) > self.max_entries) or (
+            self.max_bytes is not None and self.bytes > self.max_bytes
+        ):
+            key, _ = self.evaluations.popitem(last=False)
+            if self.max_bytes is not None:
+                self.bytes -= self.sizes.pop(key)
+            self.evictions += 1
+
+    def clear(self):
+        self.evaluations.clear()
+        self.sizes.clear()
+        self.bytes = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0
+        return self.hits / lookups
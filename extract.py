@@ -1,5 +1,4 @@
 from dreamcoder.PCFG.type_system import *
-from dreamcoder.PCFG.cons_list import *
 from dreamcoder.PCFG.program import *
 from dreamcoder.PCFG.cfg import *
 from dreamcoder.PCFG.pcfg import *
@@ -63,17 +62,17 @@ def construct_PCFG(DSL,
 
 def translate_program(old_program):
     if isinstance(old_program, Primitive):
-        return BasicPrimitive(old_program.name, type_=UnknownType(), probability={})
+        return BasicPrimitive(old_program.name, type_=UnknownType())
     if isinstance(old_program, Index):
-        return Variable(old_program.i, type_=UnknownType(), probability={})
+        return Variable(old_program.i, type_=UnknownType())
     if isinstance(old_program, Application):
         return Function(translate_program(old_program.f), 
             [translate_program(old_program.x)], 
-            type_=UnknownType(), probability={})
+            type_=UnknownType())
     if isinstance(old_program, Abstraction):
-        return Lambda(translate_program(old_program.body), type_=UnknownType(), probability={})
+        return Lambda(translate_program(old_program.body), type_=UnknownType())
     if isinstance(old_program, Invented):
-        return New(translate_program(old_program.body), type_=UnknownType(), probability={})
+        return New(translate_program(old_program.body), type_=UnknownType())
 
 def translate_type(old_type):
     if isinstance(old_type, TypeVariable):
@@ -117,9 +116,9 @@ with open('tmp/all_grammars.pickle', 'rb') as f:
             examples = task.examples
             for j in range(len(examples)):
                 if isinstance(examples[j][1], list):
-                    examples[j] = tuple2constlist(examples[j][0]), list(examples[j][1])
+                    examples[j] = tuple(examples[j][0]), list(examples[j][1])
                 else:
-                    examples[j] = tuple2constlist(examples[j][0]), examples[j][1]
+                    examples[j] = tuple(examples[j][0]), examples[j][1]
             logging.debug('Examples:\n%s'%examples)
 
             contextual_grammar = tasks[task]
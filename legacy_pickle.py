@@ -0,0 +1,162 @@
+from type_system import *
+from program import *
+from pcfg import PCFG
+from dsl import DSL
+
+import importlib
+import pickle
+
+# The tasks tmp/list_*.pickle were pickled with the classes of dreamcoder/PCFG,
+# as tuples (name, dsl, pcfg, examples). They cannot be unpickled with the current
+# classes: programs are hash-consed __slots__ nodes, and types and programs store hashes
+# of strings, which differ between processes.
+# They are unpickled into plain LegacyObject and then rebuilt with the current constructors.
+# Two formats occur:
+# * the PCFG has rules {S : {P : (args_P, w)}} and the DSL list_primitives and semantics
+# * the PCFG has rules {S : [(P, args_P, w)]}, the DSL semantics and primitive_types,
+# and functions applied to arguments may be MultiFunction
+# The inputs of the examples are cons lists (value, rest) or None in older pickles,
+# and tuples in the pickles written by extract.py since, they are loaded as tuples.
+
+
+class LegacyObject:
+    """
+    An object of a class of dreamcoder/PCFG, with its attributes as pickled
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """
+    Unpickler mapping the classes of dreamcoder/PCFG to subclasses of LegacyObject,
+    and the other objects of dreamcoder/PCFG (semantics) to the current modules
+    """
+
+    legacy_modules = {"program", "type_system", "dsl", "pcfg"}
+    classes = {}
+
+    def find_class(self, module, name):
+        if module.startswith("dreamcoder.PCFG."):
+            module = module[len("dreamcoder.PCFG.") :]
+            if module in self.legacy_modules:
+                if name not in self.classes:
+                    self.classes[name] = type(name, (LegacyObject,), {})
+                return self.classes[name]
+            return getattr(importlib.import_module(module), name)
+        return super().find_class(module, name)
+
+
+class LegacyConverter:
+    """
+    Rebuilds LegacyObject with the current classes, objects shared in the pickle stay shared
+    """
+
+    def __init__(self):
+        self.converted = {}
+
+    def convert(self, x):
+        if isinstance(x, tuple):
+            return tuple(self.convert(y) for y in x)
+        if isinstance(x, list):
+            return [self.convert(y) for y in x]
+        if not isinstance(x, LegacyObject):
+            return x
+        if id(x) not in self.converted:
+            self.converted[id(x)] = self.convert_object(x)
+        return self.converted[id(x)]
+
+    def convert_object(self, x):
+        name = type(x).__name__
+        d = x.__dict__
+        if name == "PolymorphicType":
+            return PolymorphicType(d["name"])
+        if name == "PrimitiveType":
+            return PrimitiveType(d["type"])
+        if name == "Arrow":
+            return Arrow(self.convert(d["type_in"]), self.convert(d["type_out"]))
+        if name == "List":
+            return List(self.convert(d["type_elt"]))
+        if name == "UnknownType":
+            return UnknownType()
+
+        type_ = self.convert(d.get("type", UnknownType()))
+        if name == "Variable":
+            return Variable(d["variable"], type_)
+        if name in ("Function", "MultiFunction"):
+            return Function(self.convert(d["function"]), self.convert(d["arguments"]), type_)
+        if name == "Lambda":
+            return Lambda(self.convert(d["body"]), type_)
+        if name == "BasicPrimitive":
+            return BasicPrimitive(d["primitive"], type_)
+        if name == "New":
+            return New(self.convert(d["body"]), type_)
+
+        if name == "DSL":
+            if "list_primitives" in d:
+                dsl = DSL.__new__(DSL)
+                dsl.__setstate__(
+                    {
+                        "list_primitives": self.convert(d["list_primitives"]),
+                        "semantics": d["semantics"],
+                    }
+                )
+                return dsl
+            primitive_types = {
+                self.convert(P): self.convert(t) for P, t in d["primitive_types"].items()
+            }
+            return DSL(d["semantics"], primitive_types)
+
+        if name == "PCFG":
+            rules = {}
+            for S, rules_S in d["rules"].items():
+                if isinstance(rules_S, dict):
+                    rules_S = [(P, args_P, w) for P, (args_P, w) in rules_S.items()]
+                rules[self.convert(S)] = {
+                    self.convert(P): (self.convert(args_P), w) for P, args_P, w in rules_S
+                }
+            return PCFG(
+                start=self.convert(d["start"]),
+                rules=rules,
+                max_program_depth=d["max_program_depth"],
+            )
+
+        raise pickle.UnpicklingError("no conversion for the legacy class {}".format(name))
+
+
+def is_cons_list(x):
+    while x is not None:
+        if not (isinstance(x, tuple) and len(x) == 2):
+            return False
+        x = x[1]
+    return True
+
+
+def environment_from_cons_list(environment):
+    """
+    the environment (a tuple) of the input of a legacy example, a cons list or already a tuple
+    """
+    # the values of the inputs are integers or lists, never tuples or None,
+    # so that a tuple environment is not a cons list
+    if not is_cons_list(environment):
+        return environment
+    values = []
+    while environment is not None:
+        value, environment = environment
+        values.append(value)
+    return tuple(values)
+
+
+def load_legacy_task(path):
+    """
+    Returns (name, dsl, pcfg, examples) for a task pickled with the classes of dreamcoder/PCFG
+    """
+    with open(path, "rb") as f:
+        name, dsl, pcfg, examples = LegacyUnpickler(f).load()
+    converter = LegacyConverter()
+    examples = [(environment_from_cons_list(input_), output) for input_, output in examples]
+    return name, converter.convert(dsl), converter.convert(pcfg), examples
@@ -1,6 +1,6 @@
 import random
 import numpy as np
-from math import prod
+from math import prod, log
 
 import vose
 
@@ -18,38 +18,62 @@ class PCFG:
 
     list_derivations: a dictionary of type {S: l}
     with S a non-terminal and l the list of programs P appearing in derivations from S,
-    sorted from most probable to least probable
+    sorted from least probable to most probable
 
-    max_probability: a dictionary of type {S: (Pmax, probability)} cup {(S, P): (Pmax, probability)}
-    with S a non-terminal
+    max_probability: a dictionary of type {S: Pmax} cup {(S, P): Pmax}
+    with S a non-terminal and Pmax the most probable program from S
+    (starting with P)
 
-    hash_table_programs: a dictionary {hash: P}
-    mapping hashes to programs
-    for all programs appearing in max_probability
+    probabilities: a dictionary of type {S: D}
+    with S a non-terminal and D a dictionary {id: probability}
+    mapping the ids of the programs appearing in max_probability
+    to their probability of being generated from S
+
+    log_probability: a boolean, if True the probabilities stored in probabilities
+    and used by the algorithms are log-probabilities,
+    so that long enumerations do not underflow.
+    The weights in rules are always probabilities.
+
+    normalise: a boolean, if False the weights are kept as given instead of being
+    normalised for each non-terminal, so that a PCFG restricted to some programs
+    keeps their probabilities (see Algorithms.parallel_heap_search.sub_pcfg)
     """
 
-    def __init__(self, start, rules, max_program_depth=4):
+    def __init__(self, start, rules, max_program_depth=4, log_probability=False, normalise=True):
         self.start = start
         self.rules = rules
         self.max_program_depth = max_program_depth
-
-        self.hash = hash(format(rules))
+        self.log_probability = log_probability
 
         self.remove_non_productive(max_program_depth)
         self.remove_non_reachable(max_program_depth)
 
-        for S in self.rules:
-            s = sum([self.rules[S][P][1] for P in self.rules[S]])
-            for P in self.rules[S]:
-                args_P, w = self.rules[S][P]
-                self.rules[S][P] = (args_P, w / s)
+        if normalise:
+            for S in self.rules:
+                s = sum([self.rules[S][P][1] for P in self.rules[S]])
+                for P in self.rules[S]:
+                    args_P, w = self.rules[S][P]
+                    self.rules[S][P] = (args_P, w / s)
+
+        self.update()
+
+    def update(self):
+        """
+        computes the tables derived from the rules,
+        to be called again after the rules are rewritten
+        """
+        # the same rules in the two modes are different grammars,
+        # the caches indexed by the hash (see power_pcfg) see the rewritten rules as a new grammar
+        self.hash = hash((format(self.rules), self.log_probability))
 
-        self.hash_table_programs = {}
         self.max_probability = {}
+        self.probabilities = {S: {} for S in self.rules}
         self.compute_max_probability()
 
         self.list_derivations = {}
         self.vose_samplers = {}
+        # the compiled PCFG used by sample_batch, built on the first call
+        self.compiled = None
 
         for S in self.rules:
             self.list_derivations[S] = sorted(
@@ -59,17 +83,6 @@ class PCFG:
                 np.array([self.rules[S][P][1] for P in self.list_derivations[S]])
             )
 
-    def return_unique(self, P):
-        """
-        ensures that if a program appears in several rules,
-        it is represented by the same object
-        """
-        if P.hash in self.hash_table_programs:
-            return self.hash_table_programs[P.hash]
-        else:
-            self.hash_table_programs[P.hash] = P
-            return P
-
     def remove_non_productive(self, max_program_depth=4):
         """
         remove non-terminals which do not produce programs
@@ -117,58 +130,80 @@ class PCFG:
 
     def compute_max_probability(self):
         """
-        populates the dictionary max_probability
+        populates the dictionaries max_probability and probabilities
         """
+        if self.log_probability:
+            probability_program = self.log_probability_program
+        else:
+            probability_program = self.probability_program
+
         for S in reversed(self.rules):
             best_program = None
-            best_probability = 0
+            best_probability = -float("inf") if self.log_probability else 0
 
             for P in self.rules[S]:
                 args_P, w = self.rules[S][P]
-                P_unique = self.return_unique(P)
+                if self.log_probability:
+                    w = log(w)
 
                 if len(args_P) == 0:
-                    self.max_probability[(S, P)] = P_unique
-                    P_unique.probability[(self.__hash__(), S)] = w
-                    assert P_unique.probability[
-                        (self.__hash__(), S)
-                    ] == self.probability_program(S, P_unique)
+                    self.max_probability[(S, P)] = P
+                    self.probabilities[S][P.id] = w
+                    assert w == probability_program(S, P)
 
                 else:
                     new_program = Function(
-                        function=P_unique,
+                        function=P,
                         arguments=[self.max_probability[arg] for arg in args_P],
                         type_=S[0],
-                        probability={},
                     )
-                    P_unique = self.return_unique(new_program)
                     probability = w
                     for arg in args_P:
-                        probability *= self.max_probability[arg].probability[(self.__hash__(), arg)]
-                    self.max_probability[(S, P)] = P_unique
-                    assert (self.__hash__(), S) not in P_unique.probability
-                    P_unique.probability[(self.__hash__(), S)] = probability
-                    assert probability == self.probability_program(S, P_unique)
-
-                if (
-                    self.max_probability[(S, P)].probability[(self.__hash__(), S)]
-                    > best_probability
-                ):
+                        if self.log_probability:
+                            probability += self.probabilities[arg][self.max_probability[arg].id]
+                        else:
+                            probability *= self.probabilities[arg][self.max_probability[arg].id]
+                    self.max_probability[(S, P)] = new_program
+                    assert new_program.id not in self.probabilities[S]
+                    self.probabilities[S][new_program.id] = probability
+                    assert probability == probability_program(S, new_program)
+
+                if self.probabilities[S][self.max_probability[(S, P)].id] > best_probability:
                     best_program = self.max_probability[(S, P)]
-                    best_probability = self.max_probability[(S, P)].probability[
-                        (self.__hash__(), S)
-                    ]
+                    best_probability = self.probabilities[S][best_program.id]
 
-            assert best_probability > 0
+            assert best_program is not None
             self.max_probability[S] = best_program
 
+    def max_program_probability(self, S, P=None):
+        """
+        the probability of max_probability[S], or of max_probability[(S, P)] if P is given
+        """
+        if P is None:
+            return self.probabilities[S][self.max_probability[S].id]
+        return self.probabilities[S][self.max_probability[(S, P)].id]
+
     def __getstate__(self):
         state = dict(self.__dict__)
         del state["vose_samplers"]
+        state["compiled"] = None
+        # ids are not preserved by pickling, the probabilities are recomputed
+        del state["probabilities"]
         return state
 
     def __setstate__(self, d):
+        d.setdefault("log_probability", False)
+        d.setdefault("compiled", None)
         self.__dict__ = d
+        if self.log_probability:
+            probability_program = self.log_probability_program
+        else:
+            probability_program = self.probability_program
+        self.probabilities = {S: {} for S in self.rules}
+        for S in self.rules:
+            for P in self.rules[S]:
+                program = self.max_probability[(S, P)]
+                self.probabilities[S][program.id] = probability_program(S, program)
         self.vose_samplers = {
             S: vose.Sampler(
                 np.array([self.rules[S][P][1] for P in self.list_derivations[S]])
@@ -189,13 +224,28 @@ class PCFG:
                 s += "   {} - {}: {}     {}\n".format(P, P.type, args_P, w)
         return s
 
-    def sampling(self):
+    def sampling(self, batch_size=10_000):
         """
-        A generator that samples programs according to the PCFG G
+        A generator that samples programs according to the PCFG G,
+        drawn by batches of batch_size programs
         """
 
         while True:
-            yield self.sample_program(self.start)
+            yield from self.sample_batch(batch_size)
+
+    def sample_batch(self, n, S=None):
+        """
+        Samples n programs from the non-terminal S (by default the start),
+        returns a SampledPrograms which builds the programs when they are accessed
+        """
+        # compiled_pcfg imports this module
+        from compiled_pcfg import CompiledPCFG
+
+        if self.compiled is None:
+            self.compiled = CompiledPCFG(self)
+        if S is None:
+            return self.compiled.sample_batch(n)
+        return self.compiled.sample_batch(n, self.compiled.non_terminal_id[S])
 
     def sample_program(self, S):
         i = self.vose_samplers[S].sample()
@@ -222,3 +272,18 @@ class PCFG:
                 probability *= self.probability_program(self.rules[S][F][0][i], arg)
             return probability
         assert False
+
+    def log_probability_program(self, S, P):
+        """
+        Compute the log-probability of a program P generated from the non-terminal S
+        """
+        if isinstance(P, (Variable, BasicPrimitive, New)):
+            return log(self.rules[S][P][1])
+        if isinstance(P, Function):
+            F = P.function
+            args_P = P.arguments
+            probability = log(self.rules[S][F][1])
+            for i, arg in enumerate(args_P):
+                probability += self.log_probability_program(self.rules[S][F][0][i], arg)
+            return probability
+        assert False
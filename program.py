@@ -1,14 +1,39 @@
 from type_system import *
-from cons_list import index
+from evaluation_cache import missing
 
+import itertools
 import logging
-
-# dictionary { number of environment : value }
-# environment: a cons list
-# list = None | (value, list)
-# probability: a dictionary {(G.__hash(), S) : probability}
-# such that P.probability[S] is the probability that P is generated
-# from the non-terminal S when the underlying PCFG is G.
+import weakref
+
+# Programs are hash-consed: the constructors return the unique node
+# structurally identical to the requested one, so two programs are equal
+# if and only if they are the same object.
+# Each node has an integer id, unique over the lifetime of the process,
+# and is immutable: the arguments of a Function are stored as a tuple.
+# Nodes do not carry probabilities or evaluations, these live in side tables
+# keyed by node ids:
+# * probabilities: see PCFG.probabilities or heap_search_object.probabilities
+# * evaluations: a dictionary {(id, i) : value} where i is the number of the
+# environment, or a bounded EvaluationCache, given to eval as the argument cache
+# environment: a tuple of values, the variable k being environment[k],
+# a Lambda binds its argument as the variable 0: (x,) + environment
+
+# maps the key of a node to the node, entries vanish when the node is no longer used
+unique_programs = weakref.WeakValueDictionary()
+fresh_ids = itertools.count()
+
+
+def hash_cons(cls, key):
+    """
+    returns the node for key if it exists, and otherwise a fresh uninitialised node
+    """
+    P = unique_programs.get(key)
+    if P is None:
+        P = object.__new__(cls)
+        P.id = next(fresh_ids)
+        unique_programs[key] = P
+        return P, True
+    return P, False
 
 
 class Program:
@@ -16,11 +41,16 @@ class Program:
     Object that represents a program: a lambda term with basic primitives
     """
 
+    __slots__ = ("type", "hash", "id", "__weakref__")
+
     def __eq__(self, other):
+        if self is other:
+            return True
         return (
             isinstance(self, Program)
             and isinstance(other, Program)
-            and self.type.__eq__(other.type)
+            and self.hash == other.hash
+            and self.type is other.type
             and self.typeless_eq(other)
         )
 
@@ -85,45 +115,54 @@ class Program:
         return self.hash
 
 class Variable(Program):
-    def __init__(self, variable, type_=UnknownType(), probability={}):
-        # self.variable is a natural number
-        # assert isinstance(variable, int)
-        self.variable = variable
-        # assert isinstance(type_, Type)
-        self.type = type_
-        self.hash = variable
+    __slots__ = ("variable",)
+
+    def __new__(cls, variable, type_=UnknownType()):
+        P, fresh = hash_cons(cls, (cls, variable, type_))
+        if fresh:
+            # P.variable is a natural number
+            P.variable = variable
+            P.type = type_
+            P.hash = variable
+        return P
 
-        self.probability = probability
-        self.evaluation = {}
+    def __reduce__(self):
+        return (Variable, (self.variable, self.type))
 
     def __repr__(self):
         return "var" + format(self.variable)
 
-    def eval(self, dsl, environment, i):
-        if i in self.evaluation:
-            # logging.debug('Already evaluated')
-            return self.evaluation[i]
-        # logging.debug('Not yet evaluated')
+    def eval(self, dsl, environment, i, cache=None):
+        if cache is not None:
+            result = cache.get((self.id, i), missing)
+            if result is not missing:
+                return result
         try:
-            result = index(environment, self.variable)
-            self.evaluation[i] = result
-            return result
-        except (IndexError, ValueError, TypeError):
-            self.evaluation[i] = None
-            return None
+            result = environment[self.variable]
+        except (IndexError, TypeError):
+            result = None
+        if cache is not None:
+            cache[self.id, i] = result
+        return result
 
 
 class Function(Program):
-    def __init__(self, function, arguments, type_=UnknownType(), probability={}):
-        # assert isinstance(function, Program)
-        self.function = function
-        # assert isinstance(arguments, list)
-        self.arguments = arguments
-        self.type = type_
-        self.hash = hash(tuple([arg.hash for arg in self.arguments] + [self.function.hash]))
+    __slots__ = ("function", "arguments")
+
+    def __new__(cls, function, arguments, type_=UnknownType()):
+        arguments = tuple(arguments)
+        P, fresh = hash_cons(
+            cls, (cls, function.id, tuple([arg.id for arg in arguments]), type_)
+        )
+        if fresh:
+            P.function = function
+            P.arguments = arguments
+            P.type = type_
+            P.hash = hash(tuple([arg.hash for arg in arguments] + [function.hash]))
+        return P
 
-        self.probability = probability
-        self.evaluation = {}
+    def __reduce__(self):
+        return (Function, (self.function, self.arguments, self.type))
 
     def __repr__(self):
         if len(self.arguments) == 0:
@@ -134,100 +173,102 @@ class Function(Program):
                 s += " " + format(arg)
             return s + ")"
 
-    def eval(self, dsl, environment, i):
-        if i in self.evaluation:
-            # logging.debug('Already evaluated')
-            return self.evaluation[i]
-        # logging.debug('Not yet evaluated')
+    def eval(self, dsl, environment, i, cache=None):
+        if cache is not None:
+            result = cache.get((self.id, i), missing)
+            if result is not missing:
+                return result
         try:
             if len(self.arguments) == 0:
-                return self.function.eval(dsl, environment, i)
+                return self.function.eval(dsl, environment, i, cache)
             else:
                 evaluated_arguments = []
                 for j in range(len(self.arguments)):
-                    e = self.arguments[j].eval(dsl, environment, i)
+                    e = self.arguments[j].eval(dsl, environment, i, cache)
                     evaluated_arguments.append(e)
-                result = self.function.eval(dsl, environment, i)
+                result = self.function.eval(dsl, environment, i, cache)
                 for evaluated_arg in evaluated_arguments:
                     result = result(evaluated_arg)
-                self.evaluation[i] = result
-                return result
         except (IndexError, ValueError, TypeError):
-            self.evaluation[i] = None
-            return None
+            result = None
+        if cache is not None:
+            cache[self.id, i] = result
+        return result
 
 
 class Lambda(Program):
-    def __init__(self, body, type_=UnknownType(), probability={}):
-        # assert isinstance(body, Program)
-        self.body = body
-        # assert isinstance(type_, Type)
-        self.type = type_
-        self.hash = hash(94135 + body.hash)
+    __slots__ = ("body",)
 
-        self.probability = probability
-        self.evaluation = {}
+    def __new__(cls, body, type_=UnknownType()):
+        P, fresh = hash_cons(cls, (cls, body.id, type_))
+        if fresh:
+            P.body = body
+            P.type = type_
+            P.hash = hash(94135 + body.hash)
+        return P
+
+    def __reduce__(self):
+        return (Lambda, (self.body, self.type))
 
     def __repr__(self):
         s = "(lambda " + format(self.body) + ")"
         return s
 
-    def eval(self, dsl, environment, i):
-        if i in self.evaluation:
-            # logging.debug('Already evaluated')
-            return self.evaluation[i]
-        # logging.debug('Not yet evaluated')
-        try:
-            result = lambda x: self.body.eval(dsl, (x, environment), i)
-            self.evaluation[i] = result
-            return result
-        except (IndexError, ValueError, TypeError):
-            self.evaluation[i] = None
-            return None
+    def eval(self, dsl, environment, i, cache=None):
+        # the body depends on the argument x, so its evaluations are not cached
+        return lambda x: self.body.eval(dsl, (x,) + environment, i)
 
 
 class BasicPrimitive(Program):
-    def __init__(self, primitive, type_=UnknownType(), probability={}):
-        # assert isinstance(primitive, str)
-        self.primitive = primitive
-        # assert isinstance(type_, Type)
-        self.type = type_
-        self.hash = hash(primitive) + self.type.hash
+    __slots__ = ("primitive",)
+
+    def __new__(cls, primitive, type_=UnknownType()):
+        P, fresh = hash_cons(cls, (cls, primitive, type_))
+        if fresh:
+            P.primitive = primitive
+            P.type = type_
+            P.hash = hash(primitive) + type_.hash
+        return P
 
-        self.probability = probability
-        self.evaluation = {}
+    def __reduce__(self):
+        return (BasicPrimitive, (self.primitive, self.type))
 
     def __repr__(self):
         return format(self.primitive)
 
-    def eval(self, dsl, environment, i):
+    def eval(self, dsl, environment, i, cache=None):
         return dsl.semantics[self.primitive]
 
 
 class New(Program):
-    def __init__(self, body, type_=UnknownType(), probability={}):
-        self.body = body
-        self.type = type_
-        self.hash = hash(783712 + body.hash) + type_.hash
+    __slots__ = ("body",)
 
-        self.probability = probability
-        self.evaluation = {}
+    def __new__(cls, body, type_=UnknownType()):
+        P, fresh = hash_cons(cls, (cls, body.id, type_))
+        if fresh:
+            P.body = body
+            P.type = type_
+            P.hash = hash(783712 + body.hash) + type_.hash
+        return P
+
+    def __reduce__(self):
+        return (New, (self.body, self.type))
 
     def __repr__(self):
         return format(self.body)
 
-    def eval(self, dsl, environment, i):
-        if i in self.evaluation:
-            # logging.debug('Already evaluated')
-            return self.evaluation[i]
-        # logging.debug('Not yet evaluated')
+    def eval(self, dsl, environment, i, cache=None):
+        if cache is not None:
+            result = cache.get((self.id, i), missing)
+            if result is not missing:
+                return result
         try:
-            result = self.body.eval(dsl, environment, i)
-            self.evaluation[i] = result
-            return result
+            result = self.body.eval(dsl, environment, i, cache)
         except (IndexError, ValueError, TypeError, AttributeError):
-            self.evaluation[i] = None
-            return None
+            result = None
+        if cache is not None:
+            cache[self.id, i] = result
+        return result
 
 
 def reconstruct_from_list(program_as_list, target_type):
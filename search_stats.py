@@ -0,0 +1,139 @@
+import json
+import time
+
+# Statistics of a search, given as stats to the algorithms of Algorithms/.
+# When stats is None the algorithms run their uninstrumented code: instrumentation
+# replaces the functions they call (query, heappush, ...) by wrappers counting the calls.
+
+
+class SearchStats:
+    """
+    Object that the algorithms update during a search
+
+    counters: {name: count} for events counted by the algorithms, such as
+    "duplicates" (programs not pushed as already pushed) or "succ_hits" and "succ_misses"
+    (queries answered or not by the stored successors in heap search)
+    calls: {name: number of calls} of the functions wrapped by timed
+    outputs: the number of programs output
+    gauges: {name: function} evaluated at each snapshot, such as the sizes of the heaps
+
+    Timing is sampled: one call out of sample_every of a wrapped function is timed,
+    starting with the first one, and its time is given to profiler(name, seconds)
+    if profiler is not None.
+    Times are inclusive: the time of a recursive query contains the time of its sub-queries.
+
+    If path is not None, every snapshot_every programs output a snapshot is appended
+    to path as a line of JSON, together with labels (a dictionary).
+    """
+
+    def __init__(self, path=None, snapshot_every=10_000, sample_every=64, profiler=None, labels=None):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.sample_every = sample_every
+        self.profiler = profiler
+        self.labels = labels or {}
+
+        self.counters = {}
+        self.calls = {}
+        # self.sampled[name] is [number of timed calls, total time of the timed calls]
+        self.sampled = {}
+        self.gauges = {}
+        self.outputs = 0
+
+        self.start = time.perf_counter()
+        self.last_snapshot = None
+
+    def count(self, name, k=1):
+        self.counters[name] = self.counters.get(name, 0) + k
+
+    def gauge(self, name, function):
+        """
+        registers function, whose value is recorded at each snapshot under name
+        """
+        self.gauges[name] = function
+
+    def output(self, k=1):
+        """
+        records that k programs were output
+        """
+        before = self.outputs
+        self.outputs += k
+        if self.path is not None and before // self.snapshot_every != self.outputs // self.snapshot_every:
+            self.write_snapshot()
+
+    def timed(self, name, function):
+        """
+        Returns a function calling function, counting its calls under name
+        and timing one call out of sample_every
+        """
+        if name not in self.calls:
+            self.calls[name] = 0
+            self.sampled[name] = [0, 0.0]
+        calls = self.calls
+        sampled = self.sampled[name]
+        sample_every = self.sample_every
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            calls[name] += 1
+            # the first call is timed, so that rarely called functions are timed
+            if (calls[name] - 1) % sample_every:
+                return function(*args)
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                seconds = perf_counter() - start
+                sampled[0] += 1
+                sampled[1] += seconds
+                if self.profiler is not None:
+                    self.profiler(name, seconds)
+
+        return wrapper
+
+    def seconds(self, name):
+        """
+        estimated total time spent in the function timed under name
+        """
+        timed_calls, seconds = self.sampled[name]
+        if timed_calls == 0:
+            return 0.0
+        return seconds * self.calls[name] / timed_calls
+
+    def snapshot(self):
+        """
+        Returns the current statistics as a dictionary, with the rates
+        (per second) of the outputs, counters and calls since the last snapshot
+        """
+        now = time.perf_counter()
+        values = {
+            "time": now - self.start,
+            "outputs": self.outputs,
+            "counters": dict(self.counters),
+            "calls": dict(self.calls),
+            "seconds": {name: self.seconds(name) for name in self.calls},
+        }
+        for name, function in self.gauges.items():
+            values[name] = function()
+
+        if self.last_snapshot is None:
+            last_time, last_values = self.start, {"outputs": 0, "counters": {}, "calls": {}}
+        else:
+            last_time, last_values = self.last_snapshot
+        elapsed = now - last_time
+        if elapsed > 0:
+            values["rates"] = {"outputs": (self.outputs - last_values["outputs"]) / elapsed}
+            for group in ("counters", "calls"):
+                for name, value in values[group].items():
+                    values["rates"][name] = (value - last_values[group].get(name, 0)) / elapsed
+        self.last_snapshot = now, values
+        return values
+
+    def write_snapshot(self):
+        """
+        appends a snapshot to path
+        """
+        snapshot = dict(self.labels)
+        snapshot.update(self.snapshot())
+        with open(self.path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
@@ -3,11 +3,15 @@ from program import *
 from cfg import *
 from pcfg import *
 from dsl import *
+from evaluation_cache import EvaluationCache
+from legacy_pickle import load_legacy_task
+from vectorised_eval import encode_examples, check_examples
+from DSL.deepcoder import vectorised_semantics
 
 from dreamcoder.grammar import *
 
 # Import algorithms
-from Algorithms.heap_search import heap_search
+from Algorithms.heap_search import heap_search, heap_search_batch
 from Algorithms.heap_search_naive import heap_search_naive
 from Algorithms.a_star import a_star
 from Algorithms.threshold_search import threshold_search
@@ -32,6 +36,9 @@ parser.add_argument('--range_task_begin', '-rb', dest='range_task_begin', defaul
 parser.add_argument('--range_task_end', '-re', dest='range_task_end', default=1)
 parser.add_argument('--timeout', '-t', dest='timeout', default=100)
 parser.add_argument('--total_number_programs', '-T', dest='total_number_programs', default=1_000_000)
+parser.add_argument('--cache_entries', dest='cache_entries', default=None)
+parser.add_argument('--cache_bytes', dest='cache_bytes', default=None)
+parser.add_argument('--vectorised', dest='vectorised', default=0)
 args,unknown = parser.parse_known_args()
 
 verbosity = int(args.verbose)
@@ -40,15 +47,28 @@ logging.basicConfig(format='%(message)s', level=logging_levels[verbosity])
 timeout = int(args.timeout)
 total_number_programs = int(args.total_number_programs)
 range_task = range(int(args.range_task_begin), int(args.range_task_end))
+cache_entries = None if args.cache_entries is None else int(args.cache_entries)
+cache_bytes = None if args.cache_bytes is None else int(args.cache_bytes)
+# evaluate the programs on all examples at once with the vectorised deepcoder semantics,
+# only for tasks over the deepcoder DSL
+vectorised = bool(int(args.vectorised))
 
 # Set of algorithms where we need to reconstruct the programs
 reconstruct = {dfs, bfs, threshold_search, a_star, sort_and_add}
 
+# Set of algorithms which output lists of programs
+batch = {heap_search_batch}
+
 def run_algorithm(dsl, examples, pcfg, algorithm, name_algo, param):
     '''
     Run the algorithm until either timeout or 1M programs, and for each program record probability and time of output
     '''
     logging.info('\n## Running: %s'%algorithm.__name__)
+    param = dict(param)
+    if param.pop('observational_equivalence', False):
+        # prune programs with the same outputs on the inputs of the task
+        param['dsl'] = dsl
+        param['environments'] = [input_ for input_, _ in examples]
     search_time = 0
     evaluation_time = 0
     gen = algorithm(pcfg, **param)
@@ -57,13 +77,25 @@ def run_algorithm(dsl, examples, pcfg, algorithm, name_algo, param):
         _ = next(gen)  
         logging.debug('SQRT initialised')
     nb_programs = 0
+    # evaluations of (sub)programs shared between the programs of this run,
+    # evicted in least recently used order beyond cache_entries or cache_bytes
+    cache = EvaluationCache(max_entries=cache_entries, max_bytes=cache_bytes)
+    encoded_examples = encode_examples(examples) if vectorised else None
+    vectorised_cache = EvaluationCache(
+        max_entries=cache_entries,
+        max_bytes=cache_bytes,
+        sizeof=lambda batch: sum(array.nbytes for array in batch),
+    )
 
     while (search_time + evaluation_time < timeout and nb_programs < total_number_programs):
 
-        # Searching for the next program
+        # Searching for the next program, or the next batch of programs
         search_time -= time.perf_counter()
         try:
-            program = next(gen)
+            if algorithm in batch:
+                programs = next(gen)
+            else:
+                programs = [next(gen)]
         except:
             search_time += time.perf_counter()
             logging.info("Output the last program after {}".format(nb_programs))
@@ -72,31 +104,44 @@ def run_algorithm(dsl, examples, pcfg, algorithm, name_algo, param):
         # Reconstruction if needed
         if algorithm in reconstruct:
             target_type = pcfg.start[0]
-            program = reconstruct_from_compressed(program, target_type)
+            programs = [reconstruct_from_compressed(program, target_type) for program in programs]
         search_time += time.perf_counter()
-        logging.debug('program found: {}'.format(program))
-
-        if program == None:
-            logging.info("Output the last program after {}".format(nb_programs))
-            break
 
-        nb_programs += 1
-        logging.debug('probability: %s'%pcfg.probability_program(pcfg.start, program))
-
-        # Evaluation of the program
+        # Evaluation of the programs
         evaluation_time -= time.perf_counter()
-        correct = True
-        i = 0
-        while correct and i < len(examples):
-            input_,output = examples[i]
-            correct = program.eval(dsl, input_, i) == output
-            i += 1
-        if correct:
-            found = True
+        last = False
+        for program in programs:
+            logging.debug('program found: {}'.format(program))
+
+            if program == None:
+                last = True
+                break
+
+            nb_programs += 1
+            logging.debug('probability: %s'%pcfg.probability_program(pcfg.start, program))
+
+            correct = None
+            if encoded_examples is not None:
+                correct = check_examples(program, vectorised_semantics, encoded_examples, vectorised_cache)
+            if correct is None:
+                # not vectorisable: one example at a time
+                correct = True
+                i = 0
+                while correct and i < len(examples):
+                    input_,output = examples[i]
+                    correct = program.eval(dsl, input_, i, cache) == output
+                    i += 1
+            if correct:
+                found = True
+                break
+
+            if nb_programs % 100_000 == 0:
+                logging.info('tested {} programs'.format(nb_programs))
         evaluation_time += time.perf_counter()
 
-        if nb_programs % 100_000 == 0:
-            logging.info('tested {} programs'.format(nb_programs))
+        if last:
+            logging.info("Output the last program after {}".format(nb_programs))
+            break
 
         if found:
             logging.info("\nSolution found: %s"%program)
@@ -104,6 +149,7 @@ def run_algorithm(dsl, examples, pcfg, algorithm, name_algo, param):
             logging.info("[SEARCH TIME]: %s"%search_time)
             logging.info("[EVALUATION TIME]: %s"%evaluation_time)
             logging.info("[TOTAL TIME]: %s"%(evaluation_time + search_time))
+            logging.info("[CACHE]: %s"%cache)
             return program, search_time, evaluation_time, nb_programs
 
     logging.info("\nNot found")
@@ -111,10 +157,13 @@ def run_algorithm(dsl, examples, pcfg, algorithm, name_algo, param):
     logging.info("[SEARCH TIME]: %s"%search_time)
     logging.info("[EVALUATION TIME]: %s"%evaluation_time)
     logging.info("[TOTAL TIME]: %s"%(evaluation_time + search_time))
+    logging.info("[CACHE]: %s"%cache)
     return None, timeout, timeout, nb_programs
 
 list_algorithms = [
     # (heap_search, 'heap search', {}), 
+    # (heap_search, 'heap search OE', {'observational_equivalence' : True}), 
+    # (heap_search_batch, 'heap search batch', {'batch_size' : 1000}), 
     (heap_search_naive, 'heap search naive', {}), 
     # (sqrt_sampling, 'SQRT', {}), 
     # (a_star, 'A*', {}),
@@ -127,8 +176,7 @@ list_algorithms = [
 for i in range_task:
     result = {}
 
-    with open(r'tmp/list_{}.pickle'.format(str(i)), 'rb') as f:
-        name_task, dsl, pcfg, examples = pickle.load(f)
+    name_task, dsl, pcfg, examples = load_legacy_task('tmp/list_{}.pickle'.format(str(i)))
 
     logging.info('\n####### Solving task number {} called {}:'.format(i, name_task))
     logging.debug('Set of examples:\n %s'%examples)
@@ -0,0 +1,109 @@
+from program import *
+from compiled_pcfg import compile_pcfg
+
+# Programs in prefix form: the tuple of the ids of their derivations in a CompiledPCFG,
+# in the order in which dfs, bfs, a_star and threshold_search derive them (with prefix=True):
+# a node comes before its arguments, which are listed from the last one to the first one.
+# Read backwards, this is the postfix order with the arguments from the first to the last,
+# which a stack machine evaluates without building the Program.
+
+
+def prefix_from_compressed(program):
+    """
+    the prefix form of a compressed program whose elements are derivation ids
+    """
+    prefix = []
+    while program is not None:
+        d, program = program
+        prefix.append(d)
+    prefix.reverse()
+    return tuple(prefix)
+
+
+def program_from_prefix(G, prefix):
+    """
+    Returns the Program of a program in prefix form, printed as reconstruct_from_compressed prints it
+    (its leaves are the primitives and variables themselves, not Functions without arguments)
+    G can be either a PCFG or a CompiledPCFG, the one of the algorithm which output prefix
+    """
+    G = compile_pcfg(G)
+    _, _, arguments, _ = G.python_tables()
+    derivations = G.derivations
+    stack = []
+    for d in reversed(prefix):
+        arity = len(arguments[d])
+        if arity == 0:
+            stack.append(derivations[d])
+        else:
+            program = Function(derivations[d], stack[-arity:])
+            del stack[-arity:]
+            stack.append(program)
+    return stack[0]
+
+
+class StackMachine:
+    """
+    Object that evaluates programs in prefix form for a CompiledPCFG and its DSL
+
+    For each derivation id d:
+    arity[d] is its number of arguments,
+    variable[d] is k if d derives the variable k and None otherwise,
+    value[d] is the semantics of the primitive it derives.
+    As in Program.eval, the evaluation of a node raising IndexError, ValueError or TypeError
+    is None, and so is a variable outside of the environment.
+    """
+
+    def __init__(self, G, dsl):
+        self.G = compile_pcfg(G)
+        _, _, arguments, _ = self.G.python_tables()
+        self.arity = [len(arguments_d) for arguments_d in arguments]
+        self.variable = []
+        self.value = []
+        for P in self.G.derivations:
+            if isinstance(P, Variable):
+                self.variable.append(P.variable)
+                self.value.append(None)
+            else:
+                self.variable.append(None)
+                # derivations are closed: they are evaluated in the empty environment
+                self.value.append(P.eval(dsl, (), 0))
+
+    def eval(self, prefix, environment):
+        """
+        the evaluation of the program in prefix form on the environment, as in Program.eval
+        """
+        arity = self.arity
+        variable = self.variable
+        value = self.value
+        stack = []
+        push = stack.append
+        for d in reversed(prefix):
+            k = arity[d]
+            if k == 0:
+                if variable[d] is None:
+                    push(value[d])
+                elif variable[d] < len(environment):
+                    push(environment[variable[d]])
+                else:
+                    push(None)
+            else:
+                result = value[d]
+                try:
+                    for argument in stack[-k:]:
+                        result = result(argument)
+                except (IndexError, ValueError, TypeError):
+                    result = None
+                del stack[-k:]
+                push(result)
+        return stack[0]
+
+    def check(self, prefix, examples):
+        """
+        checks whether the program in prefix form is correct on the examples,
+        a list of pairs (environment, output),
+        stopping at the first incorrect one
+        """
+        for environment, output in examples:
+            if self.eval(prefix, environment) != output:
+                return False
+        return True
@@ -9,7 +9,7 @@ from dsl import *
 from DSL.deepcoder import *
 
 # Import algorithms
-from Algorithms.heap_search import heap_search
+from Algorithms.heap_search import heap_search, heap_search_batch
 from Algorithms.a_star import a_star
 from Algorithms.threshold_search import threshold_search
 from Algorithms.dfs import dfs
@@ -37,6 +37,10 @@ deepcoder_PCFG_t = deepcoder.DSL_to_Random_PCFG(t, alpha = .7)
 # Set of algorithms where we need to reconstruct the programs
 reconstruct = {dfs, bfs, threshold_search, a_star}
 
+# Set of algorithms which output lists of programs,
+# all the programs of a batch are recorded with the time at which the batch was output
+batch = {heap_search_batch}
+
 def create_dataset(PCFG):
 	'''
 	Create a dataset, which is a list of number_samples programs with proba in [1O^(-(i+1),1O^(-i)] for i in [imin, imax]
@@ -81,7 +85,10 @@ def run_algorithm(dsl, PCFG, algorithm, param):
 	gen = algorithm(PCFG, **param)
 	while (chrono < timeout and N < total_number_programs):
 		chrono -= time.perf_counter()
-		program = next(gen)
+		if algorithm in batch:
+			programs = next(gen)
+		else:
+			programs = [next(gen)]
 
 		# if algorithm.__name__ == 'dfs':
     	# 		print(program)
@@ -89,18 +96,19 @@ def run_algorithm(dsl, PCFG, algorithm, param):
 		chrono += time.perf_counter()
 		if algorithm.__name__ == 'bfs':
     			print(N)
-		if algorithm in reconstruct:
-			program = dsl.reconstruct_from_compressed(program, PCFG.start[0])
-		# if algorithm.__name__ == 'dfs':
-    	# 		print(program)
-		# if N <= 10:
-    	# 		print(algorithm.__name__, program)
-
-		hash_program = str(program)
-		if hash_program not in result:
-			N += 1
-			result[hash_program] = N, chrono, PCFG.probability_program(PCFG.start, program)
-			# result.append((program, PCFG.proba_term(PCFG.start, program), chrono))
+		for program in programs:
+			if algorithm in reconstruct:
+				program = reconstruct_from_compressed(program, PCFG.start[0])
+			# if algorithm.__name__ == 'dfs':
+			# 		print(program)
+			# if N <= 10:
+			# 		print(algorithm.__name__, program)
+
+			hash_program = str(program)
+			if hash_program not in result:
+				N += 1
+				result[hash_program] = N, chrono, PCFG.probability_program(PCFG.start, program)
+				# result.append((program, PCFG.proba_term(PCFG.start, program), chrono))
 
 	print("Run successful, output %u programs" % len(result))
 #    print(result)
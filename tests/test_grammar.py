@@ -0,0 +1,35 @@
+import unittest
+
+from dreamcoder.domains.list.listPrimitives import primitives
+from dreamcoder.grammar import Grammar
+from dreamcoder.type import Context, TypeVariable, arrow, tint, tlist
+
+
+def bindings(context):
+    return sorted((v, str(TypeVariable(v).apply(context))) for v in context.substitution)
+
+
+class TestBuildCandidates(unittest.TestCase):
+
+    def test_memoised_candidates(self):
+        g = Grammar.uniform(primitives())
+        k, t0 = Context.EMPTY.makeVariable()
+        k, t1 = k.makeVariable()
+        k = k.unify(t1, tlist(tint))
+        for context, request, environment in [
+                (Context.EMPTY, tlist(tint), [tint]),
+                (k, tlist(t0), [t1, arrow(t0, tint)]),
+                (k, t0, [t1])]:
+            expected = g.computeCandidates(request, context, environment,
+                                           True, False, False, False)
+            for _ in range(2):
+                candidates = g.buildCandidates(request, context, environment)
+                self.assertEqual(
+                    [(l, str(t), p, bindings(c), c.nextVariable)
+                     for l, t, p, c in candidates],
+                    [(l, str(t), p, bindings(c), c.nextVariable)
+                     for l, t, p, c in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
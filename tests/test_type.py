@@ -0,0 +1,34 @@
+import unittest
+
+from dreamcoder.type import Context, UnificationFailure, arrow, tint, tbool, tlist
+
+
+class TestContext(unittest.TestCase):
+
+    def test_unify_is_persistent(self):
+        k, t0 = Context.EMPTY.makeVariable()
+        k, t1 = k.makeVariable()
+        k1 = k.unify(arrow(t0, t1), arrow(tlist(t1), tint))
+        self.assertEqual(t0.apply(k1), tlist(tint))
+        self.assertEqual(t0.apply(k), t0)
+        self.assertIs(k1.unify(t1, tint), k1)
+        with self.assertRaises(UnificationFailure):
+            k1.unify(t1, tbool)
+        self.assertEqual(t1.apply(k1), tint)
+
+    def test_long_chains(self):
+        k, first = Context.EMPTY.makeVariable()
+        previous = first
+        for _ in range(50):
+            k, v = k.makeVariable()
+            k = k.unify(previous, tlist(v))
+            previous = v
+        k = k.unify(previous, tint)
+        expected = tint
+        for _ in range(50):
+            expected = tlist(expected)
+        self.assertEqual(first.apply(k), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,41 +3,66 @@ Objective: define a type system.
 A type can be either PolymorphicType, PrimitiveType, Arrow, or List
 '''
 
+import itertools
+
+# Types are interned: the constructors return the unique type structurally
+# identical to the requested one, so two types are equal if and only if
+# they are the same object, and equality and hashing are those of objects.
+# Each type has an integer id, and its structure queries (returns, arguments,
+# ends_with, size, decompose_type) are computed once, when it is built:
+# the results are shared and should not be modified.
+# There are few distinct types, interned types are never freed.
+
+# maps the key of a type to the type
+unique_types = {}
+fresh_type_ids = itertools.count()
+
+
+def intern_type(cls, key):
+    '''
+    returns the type for key if it exists, and otherwise a fresh uninitialised type
+    '''
+    t = unique_types.get(key)
+    if t is None:
+        t = object.__new__(cls)
+        t.id = next(fresh_type_ids)
+        unique_types[key] = t
+        return t, True
+    return t, False
+
+
 class Type:
     '''
     Object that represents a type
     '''
-    def __eq__(self, other):
-        '''
-        Type equality
-        '''
-        b = isinstance(self, Type) and isinstance(other, Type)
-        b2 = isinstance(self,UnknownType) and isinstance(other,UnknownType)
-        b2 = b2 or (isinstance(self,PolymorphicType) and isinstance(other,PolymorphicType) and self.name == other.name)
-        b2 = b2 or (isinstance(self,PrimitiveType) and isinstance(other,PrimitiveType) and self.type == other.type)
-        b2 = b2 or (isinstance(self,Arrow) and isinstance(other,Arrow) and self.type_in.__eq__(other.type_in) and self.type_out.__eq__(other.type_out))
-        b2 = b2 or (isinstance(self,List) and isinstance(other,List) and self.type_elt.__eq__(other.type_elt))
-        return b and b2
-
     def __gt__(self, other): True
     def __lt__(self, other): False
     def __ge__(self, other): True
     def __le__(self, other): False
 
-    def __hash__(self):
-        return self.hash
-
-    def returns(self):
+    def cache_structure(self):
+        '''
+        computes the structure queries, the components of self being interned
+        '''
         if isinstance(self,Arrow):
-            return self.type_out.returns()
+            self.returns_type = self.type_out.returns_type
+            self.arguments_list = [self.type_in] + self.type_out.arguments_list
+            # suffixes: {id of a suffix of self : the list of arguments before it}
+            self.suffixes = {self.id: []}
+            for suffix_id, arguments_list in self.type_out.suffixes.items():
+                self.suffixes[suffix_id] = [self.type_in] + arguments_list
         else:
-            return self
+            self.returns_type = self
+            self.arguments_list = []
+            self.suffixes = {self.id: []}
+        self.type_size = self.compute_size()
+        self.decomposition = self.compute_decomposition()
+
+    def returns(self):
+        return self.returns_type
 
     def arguments(self):
-        if isinstance(self,Arrow):
-            return [self.type_in] + self.type_out.arguments()
-        else:
-            return []
+        return self.arguments_list
 
     def ends_with(self, other):
         '''
@@ -52,21 +77,16 @@ class Type:
         other = INT
         ends_with(self, other) = [Arrow(INT, INT), INT]
         '''
-        return self.ends_with_rec(other, [])
-
-    def ends_with_rec(self, other, arguments_list):
-        if self == other:
-            return arguments_list
-        if isinstance(self, Arrow):
-            arguments_list.append(self.type_in)
-            return self.type_out.ends_with_rec(other, arguments_list)
-        return None
+        return self.suffixes.get(other.id)
 
     def size(self):
+        return self.type_size
+
+    def compute_size(self):
         if isinstance(self,(PrimitiveType,PolymorphicType)):
             return 1
         if isinstance(self,Arrow):
-            return self.type_in.size() + self.type_out.size()
+            return self.type_in.type_size + self.type_out.type_size
         if isinstance(self,List) and isinstance(self.type_elt,(PrimitiveType,PolymorphicType)):
             return 2
         if isinstance(self,List) and isinstance(self.type_elt,List) \
@@ -94,21 +114,20 @@ class Type:
         '''
         Finds the set of basic types and polymorphic types 
         '''
-        set_basic_types = set()
-        set_polymorphic_types = set()
-        return self.decompose_type_rec(set_basic_types,set_polymorphic_types)
+        return self.decomposition
 
-    def decompose_type_rec(self,set_basic_types,set_polymorphic_types):
+    def compute_decomposition(self):
         if isinstance(self,PrimitiveType):
-            set_basic_types.add(self)
+            return frozenset([self]),frozenset()
         if isinstance(self,PolymorphicType):
-            set_polymorphic_types.add(self)
+            return frozenset(),frozenset([self])
         if isinstance(self,Arrow):
-            self.type_in.decompose_type_rec(set_basic_types,set_polymorphic_types)
-            self.type_out.decompose_type_rec(set_basic_types,set_polymorphic_types)
+            basic_in,polymorphic_in = self.type_in.decomposition
+            basic_out,polymorphic_out = self.type_out.decomposition
+            return basic_in | basic_out,polymorphic_in | polymorphic_out
         if isinstance(self,List):
-            self.type_elt.decompose_type_rec(set_basic_types,set_polymorphic_types)
-        return set_basic_types,set_polymorphic_types
+            return self.type_elt.decomposition
+        return frozenset(),frozenset()
 
     def unify(self, other):
         '''
@@ -161,33 +180,51 @@ class Type:
             return List(new_type_elt)
 
 class PolymorphicType(Type):
-    def __init__(self, name):
+    def __new__(cls, name):
         assert(isinstance(name,str))
-        self.name = name
-        self.hash = hash(name)
+        t, fresh = intern_type(cls, (cls, name))
+        if fresh:
+            t.name = name
+            t.hash = hash(name)
+            t.cache_structure()
+        return t
+
+    def __reduce__(self):
+        return (PolymorphicType, (self.name,))
 
     def __repr__(self):
         return str(self.name)
 
 class PrimitiveType(Type):
-    def __init__(self, type_):
+    def __new__(cls, type_):
         assert(isinstance(type_,str))
-        self.type = type_
-        self.hash = hash(type_)
+        t, fresh = intern_type(cls, (cls, type_))
+        if fresh:
+            t.type = type_
+            t.hash = hash(type_)
+            t.cache_structure()
+        return t
 
+    def __reduce__(self):
+        return (PrimitiveType, (self.type,))
 
     def __repr__(self):
         return str(self.type)
 
 class Arrow(Type):
-    def __init__(self, type_in, type_out):
+    def __new__(cls, type_in, type_out):
         assert(isinstance(type_in,Type))
         assert(isinstance(type_out,Type))
-        self.type_in = type_in
-        self.type_out = type_out
-        self.hash = hash((type_in.hash,type_out.hash))
-        # self.hash = hash(str(self))
+        t, fresh = intern_type(cls, (cls, type_in.id, type_out.id))
+        if fresh:
+            t.type_in = type_in
+            t.type_out = type_out
+            t.hash = hash((type_in.hash,type_out.hash))
+            t.cache_structure()
+        return t
 
+    def __reduce__(self):
+        return (Arrow, (self.type_in, self.type_out))
 
     def __repr__(self):
         rep_in = repr(self.type_in)
@@ -195,11 +232,17 @@ class Arrow(Type):
         return "({} -> {})".format(rep_in, rep_out)
 
 class List(Type):
-    def __init__(self, _type):
+    def __new__(cls, _type):
         assert(isinstance(_type,Type))
-        self.type_elt = _type
-        self.hash = hash(18923 + _type.hash)
+        t, fresh = intern_type(cls, (cls, _type.id))
+        if fresh:
+            t.type_elt = _type
+            t.hash = hash(18923 + _type.hash)
+            t.cache_structure()
+        return t
 
+    def __reduce__(self):
+        return (List, (self.type_elt,))
 
     def __repr__(self):
         if isinstance(self.type_elt,Arrow):
@@ -211,13 +254,20 @@ class UnknownType(Type):
     '''
     In case we need to define an unknown type
     '''
-    def __init__(self):
-        self.type = ""
-        self.hash = 1984
+    def __new__(cls):
+        t, fresh = intern_type(cls, (cls,))
+        if fresh:
+            t.type = ""
+            t.hash = 1984
+            t.cache_structure()
+        return t
+
+    def __reduce__(self):
+        return (UnknownType, ())
 
     def __repr__(self):
         return "UnknownType"
 
 INT = PrimitiveType('int')
 BOOL = PrimitiveType('bool')
-STRING = PrimitiveType('str')
\ No newline at end of file
+STRING = PrimitiveType('str')
@@ -1,16 +1,48 @@
 import logging
 import unittest
+from unittest import mock
 import random
-from math import sqrt
+import pickle
+import os
+import tempfile
+import json
+import time
+import multiprocessing
+import multiprocessing.shared_memory
+import subprocess
+import sys
+from math import sqrt, log
 
 from scipy.stats import chisquare
 
 import dsl as dsl
+from pcfg import PCFG
+from compiled_pcfg import CompiledPCFG, SharedPCFG
+from evaluation_cache import EvaluationCache
+from vectorised_eval import encode_examples, check_examples, vectorised_eval, equal_batches, BOUND
 from DSL.deepcoder import *
-from Algorithms.heap_search import heap_search
-from Algorithms.a_star import a_star
-from Algorithms.sqrt_sampling import sqrt_sampling
-from Algorithms.threshold_search import bounded_threshold
+from Algorithms.heap_search import heap_search, heap_search_batch, heap_search_object, bounded_heap_search_object, load_heap_search, load_bounded_heap_search, freeze
+from Algorithms.parallel_heap_search import split_pcfg, prefix_probability, assign_prefixes, sub_pcfg, sub_compiled_pcfg, parallel_heap_search
+from Algorithms.a_star import a_star, a_star_object, load_a_star
+from Algorithms.bfs import bfs
+from Algorithms.sqrt_sampling import sqrt_sampling, sqrt_PCFG
+from Algorithms.hybrid import hybrid
+from Algorithms.power_sampling import power_pcfg
+from Algorithms.threshold_search import bounded_threshold, threshold_search
+from legacy_pickle import load_legacy_task
+from search_stats import SearchStats
+from Algorithms.dfs import dfs
+from Algorithms.sort_and_add import sort_and_add, truncate
+from stack_machine import StackMachine, program_from_prefix
+from compiled_program import compile_program
+
+
+def enumerate_shared_PCFG(shared_PCFG, n, queue):
+    """
+    Worker of test_shared_PCFG: sends the first n programs of heap search on the attached PCFG
+    """
+    gen_heap_search = heap_search(shared_PCFG.attach())
+    queue.put([str(next(gen_heap_search)) for _ in range(n)])
 
 
 class TestSum(unittest.TestCase):
@@ -37,13 +69,129 @@ class TestSum(unittest.TestCase):
         toy_DSL = dsl.DSL(semantics, primitive_types)
 
         p0 = Function(BasicPrimitive("+1"), [Variable(0)])
-        env = (2, None)
+        env = (2,)
         self.assertTrue(p0.eval(toy_DSL, env, 0) == 3)
 
         p1 = Function(BasicPrimitive("MAP"), [BasicPrimitive("+1"), Variable(0)])
-        env = ([2, 4], None)
+        env = ([2, 4],)
         self.assertTrue(p1.eval(toy_DSL, env, 0) == [3, 5])
 
+    def test_hash_consing(self):
+        """
+        Checks that structurally identical programs are represented by the same node
+        """
+        p1 = Function(BasicPrimitive("MAP[+1]"), [Variable(0, INT)], type_=List(INT))
+        p2 = Function(BasicPrimitive("MAP[+1]"), (Variable(0, INT),), type_=List(INT))
+        p3 = Function(BasicPrimitive("MAP[+1]"), [Variable(0)], type_=List(INT))
+        self.assertIs(p1, p2)
+        self.assertEqual(p1.id, p2.id)
+        self.assertIsNot(p1, p3)
+        self.assertNotEqual(p1.id, p3.id)
+        self.assertTrue(p1.typeless_eq(p3))
+        self.assertIs(pickle.loads(pickle.dumps(p1)), p1)
+        with self.assertRaises(AttributeError):
+            p1.probability = {}
+
+        semantics = {"+1": lambda x: x + 1}
+        toy_DSL = dsl.DSL(semantics, {"+1": Arrow(INT, INT)})
+        p4 = Function(BasicPrimitive("+1"), [Function(BasicPrimitive("+1"), [Variable(0)])])
+        cache = {}
+        self.assertEqual(p4.eval(toy_DSL, (2,), 0, cache), 4)
+        self.assertEqual(p4.eval(toy_DSL, (5,), 1, cache), 7)
+        self.assertEqual(cache[p4.arguments[0].id, 0], 3)
+        self.assertEqual(cache[p4.id, 1], 7)
+
+    def test_interned_types(self):
+        """
+        Checks that structurally identical types are the same object, and their structure queries
+        """
+        t0 = PolymorphicType("t0")
+        t1 = Arrow(List(t0), Arrow(INT, List(INT)))
+        t2 = Arrow(List(PolymorphicType("t0")), Arrow(PrimitiveType("int"), List(INT)))
+        self.assertIs(t1, t2)
+        self.assertEqual(t1.id, t2.id)
+        self.assertIsNot(t1, Arrow(List(INT), Arrow(INT, List(INT))))
+        self.assertIs(pickle.loads(pickle.dumps(t1)), t1)
+        self.assertIs(UnknownType(), UnknownType())
+
+        self.assertIs(t1.returns(), List(INT))
+        self.assertEqual(t1.arguments(), [List(t0), INT])
+        self.assertEqual(t1.ends_with(Arrow(INT, List(INT))), [List(t0)])
+        self.assertEqual(t1.ends_with(t1), [])
+        self.assertIsNone(t1.ends_with(INT))
+        self.assertEqual(t1.size(), 5)
+        self.assertEqual(t1.decompose_type(), ({INT}, {t0}))
+        self.assertIs(t1.apply_unifier({"t0": INT}), Arrow(List(INT), Arrow(INT, List(INT))))
+
+    def test_evaluation_cache(self):
+        """
+        Checks that the bounded evaluation cache evicts least recently used evaluations
+        """
+        semantics = {"+1": lambda x: x + 1}
+        toy_DSL = dsl.DSL(semantics, {"+1": Arrow(INT, INT)})
+        p1 = Function(BasicPrimitive("+1"), [Variable(0)])
+        p2 = Function(BasicPrimitive("+1"), [p1])
+
+        cache = EvaluationCache(max_entries=3)
+        self.assertEqual(p2.eval(toy_DSL, (2,), 0, cache), 4)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(p2.eval(toy_DSL, (2,), 0, cache), 4)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(p2.eval(toy_DSL, (5,), 1, cache), 7)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.evictions, 3)
+        self.assertNotIn((p2.id, 0), cache)
+        self.assertEqual(cache[p2.id, 1], 7)
+
+        cache = EvaluationCache(max_bytes=100, sizeof=lambda value: 40)
+        p2.eval(toy_DSL, (2,), 0, cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.bytes, 80)
+        self.assertIn((p2.id, 0), cache)
+
+    def test_vectorised_eval(self):
+        """
+        Checks that the vectorised semantics runs and agrees with eval on the first programs of heap search
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(INT, Arrow(List(INT), List(INT)))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request)
+        environments = [(2, [3, -1, 4, 1, -5]), (-3, []), (0, [7, 7, -2])]
+
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        cache = {}
+        vectorised = 0
+        for _ in range(2_000):
+            program = next(gen_heap_search)
+            outputs = [
+                program.eval(deepcoder, environment, i)
+                for i, environment in enumerate(environments)
+            ]
+            examples = list(zip(environments, outputs))
+            encoded_examples = encode_examples(examples)
+            # only batches of undefined values or of values beyond BOUND cannot be encoded
+            encodable = any(output is not None for output in outputs) and all(
+                abs(x) <= BOUND for output in outputs if output is not None for x in output
+            )
+            self.assertEqual(encoded_examples is not None, encodable)
+            if not encodable:
+                continue
+            inputs, encoded_outputs = encoded_examples
+
+            batch = vectorised_eval(program, vectorised_semantics, inputs, cache)
+            self.assertEqual(type(batch), type(encoded_outputs))
+            self.assertEqual(batch.defined.tolist(), [output is not None for output in outputs])
+            self.assertTrue(equal_batches(batch, encoded_outputs).all())
+
+            correct = check_examples(program, vectorised_semantics, encoded_examples, cache)
+            self.assertIs(correct, True)
+            examples[0] = (environments[0], [43] if outputs[0] == [42] else [42])
+            correct = check_examples(program, vectorised_semantics, encode_examples(examples), cache)
+            self.assertIs(correct, False)
+            vectorised += 1
+        self.assertGreater(vectorised, 500)
+
     def test_construction_CFG(self):
         """
         Checks the construction of a CFG from a DSL
@@ -68,6 +216,30 @@ class TestSum(unittest.TestCase):
         self.assertTrue(len(toy_CFG.rules) == 14)
         self.assertTrue(len(toy_CFG.rules[toy_CFG.start]) == 3)
 
+    def test_memoised_CFG(self):
+        """
+        Checks that DSL_to_CFG is memoised and does not depend on the order of the type requests
+        """
+        type_requests = [Arrow(List(INT), List(INT)), Arrow(INT, Arrow(List(INT), INT))]
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        list_primitives = list(deepcoder.list_primitives)
+        CFGs = [deepcoder.DSL_to_CFG(type_request) for type_request in type_requests]
+        self.assertEqual(deepcoder.list_primitives, list_primitives)
+        self.assertIs(deepcoder.DSL_to_CFG(type_requests[0]), CFGs[0])
+
+        instantiated_primitives = deepcoder.instantiate_polymorphic_types()
+        self.assertTrue(
+            all(not P.type.decompose_type()[1] for P in instantiated_primitives)
+        )
+        self.assertEqual(len(deepcoder.instantiate_polymorphic_types(upper_bound_type_size=6)), 40)
+
+        other_deepcoder = dsl.DSL(semantics, primitive_types)
+        for type_request, CFG in reversed(list(zip(type_requests, CFGs))):
+            other_CFG = other_deepcoder.DSL_to_CFG(type_request)
+            self.assertEqual(list(other_CFG.rules), list(CFG.rules))
+            for S in CFG.rules:
+                self.assertEqual(other_CFG.rules[S], CFG.rules[S])
+
     def test_construction_PCFG1(self):
         """
         Checks the construction of a PCFG from a DSL
@@ -119,7 +291,7 @@ class TestSum(unittest.TestCase):
         for S in toy_PCFG.rules:
             max_program = toy_PCFG.max_probability[S]
             self.assertTrue(
-                max_program.probability[(toy_PCFG.__hash__(), S)]
+                toy_PCFG.probabilities[S][max_program.id]
                 == toy_PCFG.probability_program(S, max_program)
             )
 
@@ -134,20 +306,558 @@ class TestSum(unittest.TestCase):
         for S in deepcoder_PCFG.rules:
             max_program = deepcoder_PCFG.max_probability[S]
             self.assertTrue(
-                deepcoder_PCFG.max_probability[S].probability[
-                    (deepcoder_PCFG.__hash__(), S)
-                ]
+                deepcoder_PCFG.max_program_probability(S)
                 == deepcoder_PCFG.probability_program(S, max_program)
             )
             for P in deepcoder_PCFG.rules[S]:
                 max_program = deepcoder_PCFG.max_probability[(S, P)]
                 self.assertTrue(
-                    deepcoder_PCFG.max_probability[(S, P)].probability[
-                        (deepcoder_PCFG.__hash__(), S)
-                    ]
+                    deepcoder_PCFG.max_program_probability(S, P)
                     == deepcoder_PCFG.probability_program(S, max_program)
                 )
 
+    def test_compiled_PCFG(self):
+        """
+        Checks the compilation of a PCFG into arrays and that enumerators accept it
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
+        compiled_PCFG = CompiledPCFG(deepcoder_PCFG)
+
+        self.assertEqual(
+            compiled_PCFG.non_terminals[compiled_PCFG.start], deepcoder_PCFG.start
+        )
+        for s, S in enumerate(compiled_PCFG.non_terminals):
+            self.assertEqual(len(compiled_PCFG.rules_of(s)), len(deepcoder_PCFG.rules[S]))
+            for d in compiled_PCFG.rules_of(s):
+                P = compiled_PCFG.derivations[d]
+                args_P, w = deepcoder_PCFG.rules[S][P]
+                self.assertEqual(compiled_PCFG.lhs[d], s)
+                self.assertEqual(compiled_PCFG.weight[d], w)
+                self.assertEqual(compiled_PCFG.arity[d], len(args_P))
+                self.assertEqual(
+                    [compiled_PCFG.non_terminals[arg] for arg in compiled_PCFG.arguments_of(d)],
+                    list(args_P),
+                )
+
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        gen_heap_search_compiled = heap_search(compiled_PCFG)
+        gen_a_star = a_star(compiled_PCFG)
+        current_probability = 1
+        for _ in range(1000):
+            self.assertEqual(str(next(gen_heap_search)), str(next(gen_heap_search_compiled)))
+            program = reconstruct_from_compressed(next(gen_a_star), type_request.returns())
+            new_probability = deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
+            self.assertLessEqual(new_probability, current_probability + 10e-15)
+            current_probability = new_probability
+
+    def test_shared_PCFG(self):
+        """
+        Checks that a compiled PCFG published in shared memory can be attached to through a pickled handle
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        compiled_PCFG = CompiledPCFG(deepcoder.DSL_to_Random_PCFG(type_request))
+        shared_PCFG = SharedPCFG(compiled_PCFG)
+        try:
+            attached_PCFG = pickle.loads(pickle.dumps(shared_PCFG)).attach()
+            self.assertFalse(attached_PCFG.weight.flags.writeable)
+            self.assertTrue((attached_PCFG.children == compiled_PCFG.children).all())
+            # the objects of the publishing process are not unpickled
+            self.assertIs(attached_PCFG.derivations, compiled_PCFG.derivations)
+
+            gen_heap_search = heap_search(compiled_PCFG)
+            gen_heap_search_shared = heap_search(attached_PCFG)
+            programs = [next(gen_heap_search) for _ in range(1000)]
+            for program in programs:
+                self.assertIs(program, next(gen_heap_search_shared))
+
+            # a spawned worker unpickles the objects and shares the resource tracker
+            context = multiprocessing.get_context("spawn")
+            queue = context.Queue()
+            process = context.Process(target=enumerate_shared_PCFG, args=(shared_PCFG, 100, queue))
+            process.start()
+            self.assertEqual(queue.get(timeout=120), [str(program) for program in programs[:100]])
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+            # a process which is not a child has its own resource tracker, which must not unlink the block
+            code = "import pickle, sys; print(len(pickle.loads(bytes.fromhex(sys.argv[1])).attach().derivations))"
+            result = subprocess.run(
+                [sys.executable, "-c", code, pickle.dumps(shared_PCFG).hex()],
+                capture_output=True,
+                text=True,
+                env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+            )
+            self.assertEqual(result.stdout.strip(), str(len(compiled_PCFG.derivations)))
+            self.assertNotIn("leaked", result.stderr)
+        finally:
+            shared_PCFG.unlink()
+
+    def test_log_probability(self):
+        """
+        Checks that the log mode enumerates programs in the same order with log-probabilities
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
+        log_PCFG = PCFG(
+            start=deepcoder_PCFG.start,
+            rules={S: dict(deepcoder_PCFG.rules[S]) for S in deepcoder_PCFG.rules},
+            max_program_depth=deepcoder_PCFG.max_program_depth,
+            log_probability=True,
+        )
+
+        H = heap_search_object(log_PCFG)
+        gen_heap_search = H.generator()
+        gen_a_star = a_star(log_PCFG)
+        current_log_probability = 0
+        for _ in range(1000):
+            program = next(gen_heap_search)
+            log_probability = H.probabilities[H.start][program.id]
+            self.assertAlmostEqual(
+                log_probability,
+                log(deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)),
+            )
+            self.assertLessEqual(log_probability, current_log_probability)
+            current_log_probability = log_probability
+
+            program = reconstruct_from_compressed(next(gen_a_star), type_request.returns())
+            self.assertLessEqual(
+                log_PCFG.log_probability_program(log_PCFG.start, program),
+                log_probability + 10e-12,
+            )
+
+        threshold = 0.00001
+        seen_threshold = set(
+            str(reconstruct_from_compressed(program, type_request.returns()))
+            for program in bounded_threshold(log_PCFG, threshold)
+        )
+        seen_threshold_raw = set(
+            str(reconstruct_from_compressed(program, type_request.returns()))
+            for program in bounded_threshold(deepcoder_PCFG, threshold)
+        )
+        self.assertEqual(seen_threshold, seen_threshold_raw)
+
+    def test_heap_search_batch(self):
+        """
+        Checks that heap search by batches outputs the same programs as heap search
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
+
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        gen_heap_search_batch = heap_search_batch(deepcoder_PCFG, batch_size=100)
+        for _ in range(20):
+            batch = next(gen_heap_search_batch)
+            self.assertEqual(len(batch), 100)
+            for program in batch:
+                self.assertEqual(str(program), str(next(gen_heap_search)))
+
+    def test_observational_equivalence(self):
+        """
+        Checks that heap search with observational equivalence outputs exactly
+        one program for each evaluation, in the same order as heap search
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request)
+        environments = [([3, -1, 4, 1, -5],), ([],), ([7, 7, -2, 0],)]
+
+        def evaluations(program):
+            return tuple(
+                freeze(program.eval(deepcoder, environment, i))
+                for i, environment in enumerate(environments)
+            )
+
+        H = heap_search_object(deepcoder_PCFG)
+        gen_heap_search = H.generator()
+        first_evaluations = []
+        for _ in range(3_000):
+            program = next(gen_heap_search)
+            if evaluations(program) not in first_evaluations:
+                first_evaluations.append(evaluations(program))
+        # the last evaluations may tie with programs of the same probability
+        first_evaluations = first_evaluations[:-10]
+
+        H_pruned = heap_search_object(deepcoder_PCFG, deepcoder, environments)
+        gen_pruned = H_pruned.generator()
+        pruned_programs = [next(gen_pruned) for _ in first_evaluations]
+        pruned_evaluations = [evaluations(program) for program in pruned_programs]
+        self.assertEqual(len(set(pruned_evaluations)), len(pruned_evaluations))
+        self.assertEqual(set(first_evaluations), set(pruned_evaluations))
+
+        # the keys of succ are the ids of programs kept alive, output or pruned
+        for S in H_pruned.symbols:
+            alive = {program.id for program in H_pruned.succ[S].values()}
+            alive.update(program.id for program in H_pruned.pruned[S])
+            self.assertLessEqual(set(H_pruned.succ[S]) - {-1}, alive)
+        self.assertGreater(sum(len(pruned) for pruned in H_pruned.pruned), 0)
+
+        H_small_cache = heap_search_object(deepcoder_PCFG, deepcoder, environments, cache_entries=100)
+        self.assertIsInstance(H_small_cache.evaluations, EvaluationCache)
+        gen_small_cache = H_small_cache.generator()
+        self.assertEqual(pruned_programs, [next(gen_small_cache) for _ in pruned_programs])
+        self.assertLessEqual(len(H_small_cache.evaluations), 100)
+
+    def test_bounded_heap_search(self):
+        """
+        Checks that heap search within a memory budget outputs the same programs as heap search
+        in decreasing probability, and that it drops successors
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request)
+        N = 20_000
+
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        programs = [next(gen_heap_search) for _ in range(N)]
+        H = bounded_heap_search_object(deepcoder_PCFG, memory_budget=4 * 2 ** 20, check_every=1_000)
+        gen_bounded = H.generator()
+        bounded_programs = [next(gen_bounded) for _ in range(N)]
+        self.assertEqual(set(programs), set(bounded_programs))
+        probabilities = [
+            deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
+            for program in bounded_programs
+        ]
+        for probability, next_probability in zip(probabilities, probabilities[1:]):
+            self.assertGreaterEqual(probability, next_probability)
+        self.assertLess(sum(len(succ) for succ in H.succ), N)
+        self.assertIn("heaps", H.memory_usage())
+        self.assertIsNone(H.cutoff)
+
+        # with a smaller budget programs are evicted, the more probable ones are all output
+        H = bounded_heap_search_object(deepcoder_PCFG, memory_budget=2 ** 20, check_every=1_000)
+        gen_bounded = H.generator()
+        bounded_programs = [next(gen_bounded) for _ in range(N)]
+        self.assertIsNotNone(H.cutoff)
+        self.assertEqual(len(set(bounded_programs)), N)
+        probabilities = [
+            deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
+            for program in bounded_programs
+        ]
+        for probability, next_probability in zip(probabilities, probabilities[1:]):
+            self.assertGreaterEqual(probability, next_probability)
+        more_probable = [
+            program
+            for program in programs
+            if deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program) > H.cutoff
+        ]
+        self.assertGreater(len(more_probable), 0)
+        self.assertLessEqual(set(more_probable), set(bounded_programs))
+        self.assertLessEqual(sum(H.memory_usage().values()), 2 ** 20)
+
+    def test_heap_search_ties(self):
+        """
+        Checks that heap search and heap search within a memory budget output the same programs
+        when probabilities tie, even if the first program output from a non-terminal
+        is not its most probable program in the PCFG
+        """
+        semantics_ = {"SUCC": lambda x: x + 1, "ZERO": 0, "ONE": 1}
+        primitive_types_ = {"SUCC": Arrow(INT, INT), "ZERO": INT, "ONE": INT}
+        toy_DSL = dsl.DSL(semantics_, primitive_types_)
+        type_request = Arrow(INT, INT)
+        toy_CFG = toy_DSL.DSL_to_CFG(type_request)
+        # SUCC comes first, its most probable program (SUCC var0) ties with var0
+        # which the heaps output first
+        weights = {"SUCC": 0.5, "var0": 0.25, "ZERO": 0.125, "ONE": 0.125}
+        rules = {}
+        for S in toy_CFG.rules:
+            derivations = sorted(toy_CFG.rules[S], key=lambda P: str(P) != "SUCC")
+            rules[S] = {P: (toy_CFG.rules[S][P], weights[str(P)]) for P in derivations}
+        toy_PCFG = PCFG(toy_CFG.start, rules)
+
+        above_threshold = {
+            str(reconstruct_from_compressed(program, type_request.returns()))
+            for program in bounded_threshold(toy_PCFG, 10 ** -9)
+        }
+        for H in [
+            heap_search_object(toy_PCFG),
+            bounded_heap_search_object(toy_PCFG, memory_budget=2 ** 20, check_every=1),
+        ]:
+            programs = []
+            for program in H.generator():
+                if program is None:
+                    break
+                programs.append(str(program))
+            self.assertEqual(len(programs), len(set(programs)))
+            self.assertEqual(set(programs), above_threshold)
+
+        # many probabilities tie in the uniform PCFG
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        deepcoder_PCFG = deepcoder.DSL_to_Uniform_PCFG(Arrow(List(INT), List(INT)))
+        N = 10_000
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        programs = [next(gen_heap_search) for _ in range(N)]
+        H = bounded_heap_search_object(deepcoder_PCFG, memory_budget=4 * 2 ** 20, check_every=1_000)
+        gen_bounded = H.generator()
+        bounded_programs = [next(gen_bounded) for _ in range(N)]
+        probabilities = [
+            deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program) for program in programs
+        ]
+        self.assertEqual(
+            probabilities,
+            [
+                deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
+                for program in bounded_programs
+            ],
+        )
+        # the programs tying with the last ones may differ
+        self.assertEqual(
+            {program for program, p in zip(programs, probabilities) if p > probabilities[-1]},
+            {program for program, p in zip(bounded_programs, probabilities) if p > probabilities[-1]},
+        )
+
+    def test_a_star_ties(self):
+        """
+        Checks that A* and BFS break ties between partial programs, in both modes,
+        and that A* resumed from a checkpoint breaks them in the same way
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        N = 2_000
+
+        for log_probability in [False, True]:
+            uniform_PCFG = deepcoder.DSL_to_Uniform_PCFG(type_request, log_probability=log_probability)
+            gen_heap_search = heap_search(uniform_PCFG)
+            programs = [next(gen_heap_search) for _ in range(N)]
+            probabilities = [
+                uniform_PCFG.probability_program(uniform_PCFG.start, program) for program in programs
+            ]
+
+            gen_a_star = a_star(uniform_PCFG)
+            a_star_programs = [
+                reconstruct_from_compressed(next(gen_a_star), type_request.returns())
+                for _ in range(N)
+            ]
+            a_star_probabilities = [
+                uniform_PCFG.probability_program(uniform_PCFG.start, program)
+                for program in a_star_programs
+            ]
+            for probability, a_star_probability in zip(probabilities, a_star_probabilities):
+                self.assertAlmostEqual(probability, a_star_probability)
+            # the programs tying with the last ones may differ, the probabilities are
+            # computed in a different order by the two algorithms
+            last_probability = probabilities[-1] * (1 + 10 ** -6)
+            self.assertEqual(
+                {str(program) for program, p in zip(programs, probabilities) if p > last_probability},
+                {
+                    str(program)
+                    for program, p in zip(a_star_programs, a_star_probabilities)
+                    if p > last_probability
+                },
+            )
+
+            gen_bfs = bfs(uniform_PCFG, beam_width=1_000)
+            bfs_programs = {str(next(gen_bfs)) for _ in range(1_000)}
+            self.assertEqual(len(bfs_programs), 1_000)
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "checkpoint.npz")
+                A = a_star_object(uniform_PCFG)
+                gen_a_star = A.generator()
+                for _ in range(N):
+                    next(gen_a_star)
+                A.save(path)
+                programs = [next(gen_a_star) for _ in range(N)]
+                gen_resumed = load_a_star(path, uniform_PCFG).generator()
+                self.assertEqual(programs, [next(gen_resumed) for _ in range(N)])
+
+    def test_checkpoint(self):
+        """
+        Checks that heap search and A* resumed from a checkpoint continue with the same programs
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request)
+        environments = [([3, -1, 4, 1, -5],), ([],)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.npz")
+            for dsl_, environments_ in [(None, None), (deepcoder, environments)]:
+                H = heap_search_object(deepcoder_PCFG, dsl_, environments_)
+                gen_heap_search = H.generator()
+                for _ in range(2_000):
+                    next(gen_heap_search)
+                H.save(path)
+                programs = [next(gen_heap_search) for _ in range(1_000)]
+                H_resumed = load_heap_search(path, deepcoder_PCFG, dsl_, environments_)
+                gen_resumed = H_resumed.generator()
+                self.assertEqual(programs, [next(gen_resumed) for _ in range(1_000)])
+
+                H = bounded_heap_search_object(
+                    deepcoder_PCFG, 2 ** 30, dsl_, environments_, check_every=1_000
+                )
+                gen_heap_search = H.generator()
+                for _ in range(2_000):
+                    next(gen_heap_search)
+                H.save(path)
+                programs = [next(gen_heap_search) for _ in range(1_000)]
+                H_resumed = load_bounded_heap_search(
+                    path, deepcoder_PCFG, 2 ** 30, dsl_, environments_, check_every=1_000
+                )
+                gen_resumed = H_resumed.generator()
+                self.assertEqual(programs, [next(gen_resumed) for _ in range(1_000)])
+
+            A = a_star_object(deepcoder_PCFG)
+            gen_a_star = A.generator()
+            for _ in range(1_000):
+                next(gen_a_star)
+            A.save(path)
+            programs = [next(gen_a_star) for _ in range(1_000)]
+            gen_resumed = load_a_star(path, deepcoder_PCFG).generator()
+            self.assertEqual(programs, [next(gen_resumed) for _ in range(1_000)])
+
+            # the modes of the search are saved: the programs are output in prefix form
+            # as before saving, and the checkpoint is not resumed in another mode
+            A = a_star_object(deepcoder_PCFG, prefix=True)
+            gen_a_star = A.generator()
+            for _ in range(1_000):
+                next(gen_a_star)
+            A.save(path)
+            programs = [next(gen_a_star) for _ in range(1_000)]
+            gen_resumed = load_a_star(path, deepcoder_PCFG).generator()
+            self.assertEqual(programs, [next(gen_resumed) for _ in range(1_000)])
+            with self.assertRaises(ValueError):
+                load_a_star(path, deepcoder_PCFG, prefix=False)
+            log_PCFG = PCFG(
+                start=deepcoder_PCFG.start,
+                rules={S: dict(deepcoder_PCFG.rules[S]) for S in deepcoder_PCFG.rules},
+                max_program_depth=deepcoder_PCFG.max_program_depth,
+                log_probability=True,
+            )
+            with self.assertRaises(ValueError):
+                load_a_star(path, log_PCFG)
+
+    def test_search_stats(self):
+        """
+        Checks that the algorithms output the same programs with stats,
+        and that the snapshots are written
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request)
+        N = 5_000
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stats.jsonl")
+            for algorithm, name in [(heap_search, "heappush"), (a_star, "heappop"), (dfs, "pop")]:
+                gen = algorithm(deepcoder_PCFG)
+                programs = [next(gen) for _ in range(N)]
+                stats = SearchStats(path, snapshot_every=1_000, labels={"algorithm": algorithm.__name__})
+                gen = algorithm(deepcoder_PCFG, stats=stats)
+                self.assertEqual(programs, [next(gen) for _ in range(N)])
+                self.assertEqual(stats.outputs, N)
+                self.assertGreater(stats.calls[name], 0)
+                self.assertGreater(stats.seconds(name), 0)
+            with open(path) as f:
+                snapshots = [json.loads(line) for line in f]
+        self.assertEqual(len(snapshots), 3 * N // 1_000)
+        self.assertEqual(snapshots[-1]["outputs"], N)
+        heap_search_snapshot = snapshots[N // 1_000 - 1]
+        self.assertEqual(heap_search_snapshot["algorithm"], "heap_search")
+        self.assertIn("heap_sizes", heap_search_snapshot)
+        self.assertGreater(heap_search_snapshot["counters"]["succ_hits"], 0)
+
+    def test_legacy_task(self):
+        """
+        Checks that a task pickled with the classes of dreamcoder/PCFG is converted,
+        and that heap search finds a program correct on its examples
+        """
+        name, dsl_, pcfg, examples = load_legacy_task("tmp/list_0.pickle")
+        self.assertIsInstance(pcfg, PCFG)
+        gen_heap_search = heap_search(pcfg)
+        for _ in range(100_000):
+            program = next(gen_heap_search)
+            if all(program.eval(dsl_, input_, i) == output for i, (input_, output) in enumerate(examples)):
+                break
+        else:
+            self.fail("no solution found for {}".format(name))
+
+    def test_parallel_heap_search(self):
+        """
+        Checks that the sub-PCFGs of the workers partition the programs and keep their probabilities,
+        and that parallel heap search finds a solution
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request)
+
+        prefixes = split_pcfg(deepcoder_PCFG)
+        self.assertAlmostEqual(
+            sum(prefix_probability(deepcoder_PCFG, prefix) for prefix in prefixes), 1
+        )
+        compiled_PCFG = CompiledPCFG(deepcoder_PCFG)
+        seen = set()
+        for prefixes_k in assign_prefixes(deepcoder_PCFG, prefixes, 3):
+            sub_PCFG = sub_pcfg(deepcoder_PCFG, prefixes_k)
+            # the derivations and their samplers follow the weights of G
+            for S in sub_PCFG.rules:
+                weights = [sub_PCFG.rules[S][P][1] for P in sub_PCFG.list_derivations[S]]
+                self.assertEqual(weights, sorted(weights))
+            for program in sub_PCFG.sample_batch(100):
+                self.assertGreater(sub_PCFG.probability_program(sub_PCFG.start, program), 0)
+            H = heap_search_object(sub_PCFG)
+            gen_heap_search = H.generator()
+            # the restriction of the compiled PCFG generates the same programs
+            H_compiled = heap_search_object(sub_compiled_pcfg(compiled_PCFG, prefixes_k))
+            gen_compiled = H_compiled.generator()
+            for _ in range(500):
+                program = next(gen_heap_search)
+                self.assertNotIn(program.id, seen)
+                seen.add(program.id)
+                self.assertAlmostEqual(
+                    H.probabilities[H.start][program.id],
+                    deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program),
+                )
+                self.assertIs(next(gen_compiled), program)
+                self.assertEqual(
+                    H_compiled.probabilities[H_compiled.start][program.id],
+                    H.probabilities[H.start][program.id],
+                )
+
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        for _ in range(1_000):
+            target = next(gen_heap_search)
+        inputs = [[3, -1, 4, 1, -5], [2, 7, 7, -2], [0, 6]]
+        examples = [((x,), target.eval(deepcoder, (x,), i)) for i, x in enumerate(inputs)]
+        program, _, nb_programs = parallel_heap_search(
+            deepcoder_PCFG, deepcoder, examples, CPUs=2, timeout=60
+        )
+        self.assertIsNotNone(program)
+        self.assertGreater(nb_programs, 0)
+        for i, (input_, output) in enumerate(examples):
+            self.assertEqual(program.eval(deepcoder, input_, i), output)
+
+        # without solution the search ends at the deadline
+        chrono = -time.perf_counter()
+        program, _, nb_programs = parallel_heap_search(
+            deepcoder_PCFG, deepcoder, [(([1, 2],), "no solution")], CPUs=2, timeout=2
+        )
+        chrono += time.perf_counter()
+        self.assertIsNone(program)
+        self.assertGreater(nb_programs, 0)
+        self.assertLess(chrono, 5)
+
+        # when the master fails, the workers are stopped and the shared PCFG is freed
+        published = []
+
+        class RecordedSharedPCFG(SharedPCFG):
+            def __init__(self, G):
+                super().__init__(G)
+                published.append(self)
+
+        with mock.patch("Algorithms.parallel_heap_search.SharedPCFG", RecordedSharedPCFG), \
+                mock.patch("Algorithms.parallel_heap_search.GRACE_PERIOD", None):
+            with self.assertRaises(TypeError):
+                parallel_heap_search(deepcoder_PCFG, deepcoder, examples, CPUs=2, timeout=60)
+        self.assertEqual(len(published), 1)
+        self.assertEqual(multiprocessing.active_children(), [])
+        with self.assertRaises(FileNotFoundError):
+            multiprocessing.shared_memory.SharedMemory(name=published[0].name)
+
     def test_completeness_heap_search(self):
         """
         Check if heap_search does not miss any program and if it outputs programs in decreasing order.
@@ -160,7 +870,8 @@ class TestSum(unittest.TestCase):
         type_request = Arrow(List(INT), List(INT))
         deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
 
-        gen_heap_search = heap_search(deepcoder_PCFG)
+        H = heap_search_object(deepcoder_PCFG)
+        gen_heap_search = H.generator()
         gen_sampling = deepcoder_PCFG.sampling()
         seen_sampling = set()
         seen_heaps = set()
@@ -168,9 +879,9 @@ class TestSum(unittest.TestCase):
         current_probability = 1
         for i in range(N):
             program = next(gen_heap_search)
-            new_probability = program.probability[(deepcoder_PCFG.__hash__(), deepcoder_PCFG.start)]
+            new_probability = H.probabilities[H.start][program.id]
             self.assertTrue(
-                program.probability[(deepcoder_PCFG.__hash__(), deepcoder_PCFG.start)]
+                new_probability
                 == deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
             )
             self.assertLessEqual(new_probability, current_probability)
@@ -263,6 +974,130 @@ class TestSum(unittest.TestCase):
 
         self.assertEqual(0, len(diff))
 
+    def test_incremental_threshold_search(self):
+        """
+        Checks that threshold search outputs each program once, and the programs
+        above a threshold before the others
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
+
+        above = set(bounded_threshold(deepcoder_PCFG, 0.0001 / 10 ** 2))
+        gen_threshold = threshold_search(deepcoder_PCFG, initial_threshold=0.0001, scale_factor=10)
+        programs = [next(gen_threshold) for _ in range(2 * len(above))]
+        self.assertEqual(len(set(programs)), len(programs))
+        self.assertEqual(set(programs[: len(above)]), above)
+
+    def test_sort_and_add(self):
+        """
+        Checks that sort and add outputs each program once, and the programs of the
+        truncated PCFG before the others
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
+        target_type = deepcoder_PCFG.start[0]
+
+        truncated = {
+            str(reconstruct_from_compressed(program, target_type))
+            for program in dfs(truncate(deepcoder_PCFG, 4))
+        }
+        gen_sort_and_add = sort_and_add(deepcoder_PCFG, init=2, step=2)
+        programs = [
+            str(reconstruct_from_compressed(next(gen_sort_and_add), target_type))
+            for _ in range(2 * len(truncated))
+        ]
+        self.assertEqual(len(set(programs)), len(programs))
+        self.assertEqual(set(programs[: len(truncated)]), truncated)
+
+    def test_stack_machine(self):
+        """
+        Checks that programs in prefix form are those of dfs, and that the stack machine
+        evaluates them as eval evaluates the reconstructed programs
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(INT, Arrow(List(INT), List(INT)))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
+        target_type = deepcoder_PCFG.start[0]
+        environments = [(2, [3, -1, 4, 1, -5]), (-3, []), (0, [7, 7, -2])]
+
+        machine = StackMachine(deepcoder_PCFG, deepcoder)
+        gen_dfs = dfs(machine.G)
+        gen_prefix = dfs(machine.G, prefix=True)
+        for _ in range(2_000):
+            program = reconstruct_from_compressed(next(gen_dfs), target_type)
+            prefix = next(gen_prefix)
+            self.assertEqual(str(program_from_prefix(machine.G, prefix)), str(program))
+            examples = []
+            for i, environment in enumerate(environments):
+                output = program.eval(deepcoder, environment, i)
+                self.assertEqual(machine.eval(prefix, environment), output)
+                examples.append((environment, output))
+            self.assertTrue(machine.check(prefix, examples))
+
+    def test_compiled_program(self):
+        """
+        Checks that compiled programs evaluate as eval, on lambdas and on the first programs of heap search
+        """
+        toy_semantics = {"map": lambda f: lambda l: [f(x) for x in l], "+": lambda x: lambda y: x + y}
+        toy_types = {
+            "map": Arrow(Arrow(INT, INT), Arrow(List(INT), List(INT))),
+            "+": Arrow(INT, Arrow(INT, INT)),
+        }
+        toy_DSL = dsl.DSL(toy_semantics, toy_types)
+        add = Lambda(Function(BasicPrimitive("+"), [Variable(0), Variable(1)]))
+        p = Function(BasicPrimitive("map"), [add, Variable(1)])
+        environment = (3, [1, 2])
+        self.assertEqual(compile_program(p, toy_DSL)(environment), [4, 5])
+        self.assertEqual(compile_program(p, toy_DSL)((3,)), p.eval(toy_DSL, (3,), 0))
+
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(INT, Arrow(List(INT), List(INT)))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request)
+        environments = [(2, [3, -1, 4, 1, -5]), (-3, []), (0, [7, 7, -2])]
+
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        compiled = {}
+        for _ in range(2_000):
+            program = next(gen_heap_search)
+            f = compile_program(program, deepcoder, compiled)
+            for i, environment in enumerate(environments):
+                self.assertEqual(f(environment), program.eval(deepcoder, environment, i))
+        self.assertIs(compile_program(program, deepcoder, compiled), f)
+
+    def test_sample_batch(self):
+        """
+        Checks the encoding of the programs sampled by batches and their probabilities
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.7)
+
+        batch = deepcoder_PCFG.sample_batch(1_000)
+        self.assertEqual(len(batch), 1_000)
+        probabilities = batch.probabilities()
+        for k, program in enumerate(batch):
+            self.assertIs(batch[k], program)
+            self.assertAlmostEqual(
+                probabilities[k],
+                deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program),
+            )
+
+        # the compiled PCFG is rebuilt after the rules are rewritten
+        S = deepcoder_PCFG.start
+        F = deepcoder_PCFG.list_derivations[S][-1]
+        for P in deepcoder_PCFG.rules[S]:
+            if P != F:
+                args_P, _ = deepcoder_PCFG.rules[S][P]
+                deepcoder_PCFG.rules[S][P] = args_P, 0
+        deepcoder_PCFG.remove_non_productive()
+        deepcoder_PCFG.remove_non_reachable()
+        deepcoder_PCFG.update()
+        self.assertIsNone(deepcoder_PCFG.compiled)
+        for program in deepcoder_PCFG.sample_batch(100):
+            self.assertIs(program.function if isinstance(program, Function) else program, F)
+
     def test_sampling(self):
         """
         Check if the sampling algorithm samples according to the correct probabilities using a chi_square test
@@ -308,6 +1143,87 @@ class TestSum(unittest.TestCase):
         chisq, p_value = chisquare(f_obs, f_exp=f_exp)
         self.assertLessEqual(alpha, p_value)
 
+    def test_power_PCFG(self):
+        """
+        Checks that G^alpha gives each program the probability G(P)^alpha / Z
+        and that it is cached
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.6)
+
+        for alpha in [0.3, 0.5, 1, 2]:
+            power_G = power_pcfg(deepcoder_PCFG, alpha)
+            self.assertIs(power_pcfg(deepcoder_PCFG, alpha), power_G)
+            log_Z = power_G.log_partition_function[power_G.start]
+            if alpha == 1:
+                self.assertAlmostEqual(log_Z, 0)
+            batch = power_G.sample_batch(100)
+            log_probabilities = batch.log_probabilities()
+            for k, program in enumerate(batch):
+                probability = deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
+                self.assertAlmostEqual(log_probabilities[k], alpha * log(probability) - log_Z)
+
+        # sqrt_PCFG is the dictionary-based PCFG of G^0.5
+        sqrt_G = sqrt_PCFG(deepcoder_PCFG)
+        self.assertIsInstance(sqrt_G, PCFG)
+        log_Z = power_pcfg(deepcoder_PCFG, 0.5).log_partition_function[power_G.start]
+        for program in sqrt_G.sample_batch(100):
+            probability = deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
+            self.assertAlmostEqual(
+                log(sqrt_G.probability_program(sqrt_G.start, program)), 0.5 * log(probability) - log_Z
+            )
+
+        # a PCFG whose rules are rewritten is a new grammar for the cache
+        power_G = power_pcfg(deepcoder_PCFG, 0.5)
+        for S in deepcoder_PCFG.rules:
+            derivations = list(deepcoder_PCFG.rules[S])
+            weights = [deepcoder_PCFG.rules[S][P][1] for P in derivations]
+            for P, w in zip(derivations, reversed(weights)):
+                deepcoder_PCFG.rules[S][P] = deepcoder_PCFG.rules[S][P][0], w
+        deepcoder_PCFG.update()
+        new_power_G = power_pcfg(deepcoder_PCFG, 0.5)
+        self.assertIsNot(new_power_G, power_G)
+        log_Z = new_power_G.log_partition_function[new_power_G.start]
+        batch = new_power_G.sample_batch(100)
+        log_probabilities = batch.log_probabilities()
+        for k, program in enumerate(batch):
+            probability = deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program)
+            self.assertAlmostEqual(log_probabilities[k], 0.5 * log(probability) - log_Z)
+
+    def test_hybrid(self):
+        """
+        Checks that hybrid completes the partial programs of the frontier, with and without parallelism
+        """
+        deepcoder = dsl.DSL(semantics, primitive_types)
+        type_request = Arrow(List(INT), List(INT))
+        deepcoder_PCFG = deepcoder.DSL_to_Random_PCFG(type_request, alpha=0.6)
+        target_type = type_request.returns()
+
+        gen_hybrid = hybrid(deepcoder_PCFG, DFS_depth=2, batch_size=1_000)
+        for _ in range(3_000):
+            program = reconstruct_from_compressed(next(gen_hybrid), target_type)
+            self.assertGreater(deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program), 0)
+
+        # the workers stop after timeout seconds and output only the solutions
+        gen_heap_search = heap_search(deepcoder_PCFG)
+        for _ in range(10):
+            target = next(gen_heap_search)
+        inputs = [[3, -1, 4, 1, -5], [2, 7, 7, -2], [0, 6]]
+        examples = [((x,), target.eval(deepcoder, (x,), i)) for i, x in enumerate(inputs)]
+        number_of_programs = 0
+        for program in hybrid(
+            deepcoder_PCFG, DFS_depth=2, batch_size=1_000, CPUs=2, timeout=3, dsl=deepcoder, examples=examples
+        ):
+            program = reconstruct_from_compressed(program, target_type)
+            self.assertGreater(deepcoder_PCFG.probability_program(deepcoder_PCFG.start, program), 0)
+            for i, (input_, output) in enumerate(examples):
+                self.assertEqual(program.eval(deepcoder, input_, i), output)
+            number_of_programs += 1
+        self.assertGreater(number_of_programs, 0)
+        with self.assertRaises(ValueError):
+            next(hybrid(deepcoder_PCFG, DFS_depth=2, batch_size=1_000, CPUs=2))
+
     def test_sqrt_sampling(self):
         """
         Check if sqrt_sampling algorithm samples according to the correct probabilities
@@ -0,0 +1,157 @@
+from program import *
+
+from collections import namedtuple
+import numpy as np
+
+# Evaluation of a program on all the examples of a task at once.
+# The values of a program on n examples are stored as a batch:
+# * IntBatch: values is an int64 array of shape (n,)
+# * ListBatch: values is an int64 array of shape (n, width) padded with 0,
+# the list of the k-th example is values[k, :lengths[k]]
+# In both cases defined is a boolean array of shape (n,),
+# defined[k] is False when the evaluation on the k-th example is None.
+#
+# A vectorised semantics is a dictionary {primitive : (arity, f)}
+# where f maps arity batches to a batch, see DSL/deepcoder.py.
+# Values are bounded by BOUND in absolute value so that no operation
+# of a vectorised semantics overflows int64: beyond that the evaluation
+# is delegated to Program.eval, which works with Python integers.
+
+IntBatch = namedtuple("IntBatch", ["values", "defined"])
+ListBatch = namedtuple("ListBatch", ["values", "lengths", "defined"])
+
+BOUND = 2 ** 31
+
+
+class NotVectorisable(Exception):
+    """
+    Raised when a program cannot be evaluated exactly by a vectorised semantics
+    """
+
+    pass
+
+
+def encode_values(values):
+    """
+    Returns the batch for a list of values (one per example), each an integer,
+    a list of integers or None, or None if they cannot be encoded
+    """
+    n = len(values)
+    defined = np.array([value is not None for value in values], dtype=bool)
+    present = [value for value in values if value is not None]
+    if len(present) == 0:
+        return None
+    if all(isinstance(value, int) for value in present):
+        if any(abs(value) > BOUND for value in present):
+            return None
+        return IntBatch(
+            np.array([0 if value is None else value for value in values], dtype=np.int64),
+            defined,
+        )
+    if all(isinstance(value, list) for value in present):
+        if not all(isinstance(x, int) and abs(x) <= BOUND for value in present for x in value):
+            return None
+        lengths = np.array([0 if value is None else len(value) for value in values], dtype=np.int64)
+        # at least one column so that reductions along the rows are well defined
+        array = np.zeros((n, max(1, int(lengths.max()))), dtype=np.int64)
+        for k, value in enumerate(values):
+            if value:
+                array[k, : len(value)] = value
+        return ListBatch(array, lengths, defined)
+    return None
+
+
+def encode_examples(examples):
+    """
+    Returns (inputs, outputs) for a list of examples (input_, output)
+    where input_ is an environment: inputs is the list of the batches of each variable
+    and outputs the batch of the outputs, or None if they cannot be encoded
+    """
+    environments = [input_ for input_, _ in examples]
+    number_variables = len(environments[0]) if environments else 0
+    if any(len(environment) != number_variables for environment in environments):
+        return None
+    inputs = []
+    for k in range(number_variables):
+        batch = encode_values([environment[k] for environment in environments])
+        if batch is None:
+            return None
+        inputs.append(batch)
+    outputs = encode_values([output for _, output in examples])
+    if outputs is None:
+        return None
+    return inputs, outputs
+
+
+def vectorised_eval(program, semantics, inputs, cache=None):
+    """
+    Returns the batch of the evaluations of program on the inputs
+    Raises NotVectorisable if the program uses a construction outside the semantics
+
+    cache: a dictionary {id : batch} shared between the programs of a task
+    """
+    if cache is not None and program.id in cache:
+        return cache[program.id]
+    if isinstance(program, Variable):
+        if program.variable >= len(inputs):
+            raise NotVectorisable(program)
+        return inputs[program.variable]
+    if isinstance(program, Function):
+        primitive = program.function
+        arguments = program.arguments
+    elif isinstance(program, BasicPrimitive):
+        primitive = program
+        arguments = ()
+    else:
+        raise NotVectorisable(program)
+    if not isinstance(primitive, BasicPrimitive) or primitive.primitive not in semantics:
+        raise NotVectorisable(program)
+    arity, f = semantics[primitive.primitive]
+    if len(arguments) != arity:
+        raise NotVectorisable(program)
+
+    batches = [vectorised_eval(argument, semantics, inputs, cache) for argument in arguments]
+    batch = f(*batches)
+    # the values on undefined examples are arbitrary but bounded as well
+    if batch.values.size and (batch.values.max() > BOUND or batch.values.min() < -BOUND):
+        raise NotVectorisable(program)
+    defined = batch.defined
+    for argument in batches:
+        defined = defined & argument.defined
+    batch = batch._replace(defined=defined)
+    if cache is not None:
+        cache[program.id] = batch
+    return batch
+
+
+def equal_batches(batch1, batch2):
+    """
+    Returns a boolean array, whose k-th entry checks whether the evaluations
+    on the k-th example are equal
+    """
+    both_undefined = ~batch1.defined & ~batch2.defined
+    both_defined = batch1.defined & batch2.defined
+    if type(batch1) != type(batch2):
+        return both_undefined
+    if isinstance(batch1, IntBatch):
+        return both_undefined | (both_defined & (batch1.values == batch2.values))
+    # when the lengths are equal the lists fit in the narrowest width,
+    # and the padding beyond is 0 in both
+    width = min(batch1.values.shape[1], batch2.values.shape[1])
+    same = (batch1.lengths == batch2.lengths) & (
+        batch1.values[:, :width] == batch2.values[:, :width]
+    ).all(axis=1)
+    return both_undefined | (both_defined & same)
+
+
+def check_examples(program, semantics, encoded_examples, cache=None):
+    """
+    Returns whether program is correct on all the encoded examples,
+    or None if it cannot be evaluated with the vectorised semantics
+    """
+    inputs, outputs = encoded_examples
+    try:
+        batch = vectorised_eval(program, semantics, inputs, cache)
+    except NotVectorisable:
+        return None
+    return bool(equal_batches(batch, outputs).all())